@@ -1,70 +1,214 @@
-import boto3
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-# Initialize clients
-cloudwatch = boto3.client('cloudwatch')
-sns = boto3.client('sns')
+from common.anomaly import AnomalyDetector
+from common.clients import get_client
+from common.metrics import expression, get_metric_data, metric_stat
+from common.notify import get_notifier
+from common.state import state_store_from_uri
 
 # Environment variables
 ELB_NAME = os.environ.get('ELB_NAME')  # e.g., app/my-elb/123abc456def
+# Comma-separated load balancer dimensions to watch; empty (and no ELB_NAME) = every ALB in the region
+LOAD_BALANCERS = os.environ.get('LOAD_BALANCERS', ELB_NAME or '')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')  # e.g., arn:aws:sns:us-east-1:123456789012:ELBErrorAlerts
-THRESHOLD = int(os.environ.get('THRESHOLD', 10))  # Default threshold = 10 errors
+THRESHOLD = int(os.environ.get('THRESHOLD', 10))  # Minimum 5xx count in the window before a rate can alert
+ERROR_RATE_THRESHOLD = float(os.environ.get('ERROR_RATE_THRESHOLD', '5'))  # percent of requests answered 5xx
+PERIOD_SECONDS = int(os.environ.get('PERIOD_SECONDS', '300'))  # 5 minutes
+# A period is read once it ended this long ago, so CloudWatch has ingested all of its datapoints
+METRIC_DELAY_SECONDS = int(os.environ.get('METRIC_DELAY_SECONDS', '120'))
+INCLUDE_TARGET_GROUPS = os.environ.get('INCLUDE_TARGET_GROUPS', 'true').lower() == 'true'
+# Learned per-hour error-rate baselines alongside the static thresholds
+ANOMALY_DETECTION = os.environ.get('ANOMALY_DETECTION', 'true').lower() == 'true'
+DETECTOR_STATE_URI = os.environ.get('DETECTOR_STATE_URI', '/tmp/elb-5xx-baselines.json')  # or s3://bucket/key
+ANOMALY_MIN_ERRORS = int(os.environ.get('ANOMALY_MIN_ERRORS', '5'))  # fewer 5xx than this never alert
+
+
+def dimension_from_arn(arn):
+    """'arn:...:loadbalancer/app/my-alb/123' -> 'app/my-alb/123'; 'arn:...:targetgroup/tg/456' -> 'targetgroup/tg/456'"""
+    resource = arn.split(':', 5)[-1]
+    return resource[len('loadbalancer/'):] if resource.startswith('loadbalancer/') else resource
+
+
+def discover_load_balancers():
+    """{load balancer dimension: [target group dimensions]} for every ALB in the region."""
+    elbv2 = get_client('elbv2')
+    arns = {}
+    for page in elbv2.get_paginator('describe_load_balancers').paginate():
+        for lb in page['LoadBalancers']:
+            if lb.get('Type') == 'application':
+                arns[lb['LoadBalancerArn']] = dimension_from_arn(lb['LoadBalancerArn'])
+    target_groups = {dimension: [] for dimension in arns.values()}
+    if INCLUDE_TARGET_GROUPS and arns:
+        for page in elbv2.get_paginator('describe_target_groups').paginate():
+            for tg in page['TargetGroups']:
+                for lb_arn in tg.get('LoadBalancerArns', []):
+                    if lb_arn in arns:
+                        target_groups[arns[lb_arn]].append(dimension_from_arn(tg['TargetGroupArn']))
+    return target_groups
+
+
+def build_error_queries(load_balancers):
+    """One query group per load balancer: 5xx counts, requests and the error-rate expression."""
+    groups = []
+    for n, (lb, target_groups) in enumerate(load_balancers.items()):
+        dims = {'LoadBalancer': lb}
+        group = [
+            metric_stat(f'elb5xx{n}', 'AWS/ApplicationELB', 'HTTPCode_ELB_5XX_Count', dims, 'Sum', PERIOD_SECONDS),
+            metric_stat(f'target5xx{n}', 'AWS/ApplicationELB', 'HTTPCode_Target_5XX_Count', dims, 'Sum',
+                        PERIOD_SECONDS),
+            metric_stat(f'requests{n}', 'AWS/ApplicationELB', 'RequestCount', dims, 'Sum', PERIOD_SECONDS),
+            # 5xx metrics are absent (not 0) in quiet periods, hence FILL. Requests the load balancer
+            # answered with its own 5xx are not in RequestCount, so they are added to the denominator
+            expression(f'errorrate{n}', f'IF(FILL(requests{n}, 0) + FILL(elb5xx{n}, 0) > 0, '
+                                        f'100 * (FILL(elb5xx{n}, 0) + FILL(target5xx{n}, 0))'
+                                        f' / (FILL(requests{n}, 0) + FILL(elb5xx{n}, 0)), 0)'),
+        ]
+        for k, tg in enumerate(target_groups):
+            tg_dims = {'LoadBalancer': lb, 'TargetGroup': tg}
+            group += [
+                metric_stat(f'tg5xx{n}_{k}', 'AWS/ApplicationELB', 'HTTPCode_Target_5XX_Count', tg_dims, 'Sum',
+                            PERIOD_SECONDS),
+                metric_stat(f'tgrequests{n}_{k}', 'AWS/ApplicationELB', 'RequestCount', tg_dims, 'Sum',
+                            PERIOD_SECONDS),
+            ]
+        groups.append(group)
+    return groups
+
+
+def value_at(points, period_start):
+    """Value of the datapoint for the period starting at period_start (naive UTC), or None."""
+    start = period_start.replace(tzinfo=timezone.utc).timestamp()
+    return next((float(value) for ts, value in points or [] if ts.timestamp() == start), None)
+
+
+def evaluate(load_balancers, series, period_start):
+    """
+    Error counts, rate and alert decision per load balancer, for the complete
+    period starting at period_start (5xx metrics have no datapoint, rather
+    than 0, in a period without errors, so the newest datapoint may be older).
+    """
+    results = {}
+    for n, (lb, target_groups) in enumerate(load_balancers.items()):
+        elb_5xx = value_at(series.get(f'elb5xx{n}'), period_start) or 0.0
+        target_5xx = value_at(series.get(f'target5xx{n}'), period_start) or 0.0
+        requests = value_at(series.get(f'requests{n}'), period_start) or 0.0
+        rate = value_at(series.get(f'errorrate{n}'), period_start) or 0.0
+        result = {
+            'elb_5xx': elb_5xx,
+            'target_5xx': target_5xx,
+            'requests': requests,
+            'error_rate': round(rate, 3),
+            'alert': elb_5xx + target_5xx > THRESHOLD and rate >= ERROR_RATE_THRESHOLD,
+            'period_start': period_start.isoformat(),
+        }
+        worst = None
+        for k, tg in enumerate(target_groups):
+            tg_5xx = value_at(series.get(f'tg5xx{n}_{k}'), period_start) or 0.0
+            tg_requests = value_at(series.get(f'tgrequests{n}_{k}'), period_start) or 0.0
+            if tg_5xx and (worst is None or tg_5xx > worst[1]):
+                worst = (tg, tg_5xx, 100 * tg_5xx / tg_requests if tg_requests else 0.0)
+        if worst:
+            result['worst_target_group'] = {'name': worst[0], 'target_5xx': worst[1], 'error_rate': round(worst[2], 3)}
+        results[lb] = result
+    return results
+
+
+def detect_anomalies(load_balancers, series, results, detector):
+    """
+    Feed each load balancer's error-rate datapoints the detector has not seen
+    yet (baselines per hour of day) and mark anomalous ones for alerting.
+    The series only hold complete periods: a datapoint is never revisited.
+    """
+    for n, lb in enumerate(load_balancers):
+        finding = None
+        for ts, rate in series.get(f'errorrate{n}', []):
+            update = detector.update(lb, ts.hour, rate, ts.timestamp())
+            if update and update['anomalous']:
+                finding = update
+        if finding is None:
+            continue
+        result = results[lb]
+        result['anomaly'] = {k: finding[k] for k in ('reason', 'score', 'baseline')}
+        if result['elb_5xx'] + result['target_5xx'] >= ANOMALY_MIN_ERRORS:
+            result['alert'] = True
+            if finding['reason'] == 'sustained':
+                detector.reset_cusum(lb)
+
+
+def queue_alert(notifier, lb, result):
+    message = (
+        f"⚠️ ALERT: High rate of 5xx errors detected!\n\n"
+        f"ELB: {lb}\n"
+        f"Time Window: {PERIOD_SECONDS // 60} minutes from {result['period_start']}\n"
+        f"5xx Error Rate: {result['error_rate']}% (threshold {ERROR_RATE_THRESHOLD}%)\n"
+        f"ELB 5xx: {result['elb_5xx']:.0f}, Target 5xx: {result['target_5xx']:.0f}, "
+        f"Requests: {result['requests']:.0f}\n"
+    )
+    if 'worst_target_group' in result:
+        tg = result['worst_target_group']
+        message += f"Worst target group: {tg['name']} ({tg['target_5xx']:.0f} 5xx, {tg['error_rate']}%)\n"
+    if 'anomaly' in result:
+        anomaly = result['anomaly']
+        message += (f"Anomaly: {anomaly['reason']} (score {anomaly['score']}, "
+                    f"usual rate at this hour {anomaly['baseline']}%)\n")
+    message += "\nCheck CloudWatch metrics for more details."
+    # One fingerprint per ELB: a spike lasting many runs pages once per suppression window
+    notifier.add(
+        f"elb-5xx:{lb}",
+        f"ALERT: {lb.split('/')[1] if '/' in lb else lb} 5xx error rate {result['error_rate']}%",
+        message,
+        group='ELB 5xx alerts'
+    )
+
 
 def lambda_handler(event, context):
     try:
-        # Time window: last 5 minutes
-        end_time = datetime.utcnow()
-        start_time = end_time - timedelta(minutes=5)
-
-        print(f"Checking ELB 5xx errors for {ELB_NAME} between {start_time} and {end_time}")
-
-        # Get 5xx error count from CloudWatch
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/ApplicationELB',
-            MetricName='HTTPCode_ELB_5XX_Count',
-            Dimensions=[
-                {'Name': 'LoadBalancer', 'Value': ELB_NAME}
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=300,  # 5 minutes
-            Statistics=['Sum']
-        )
-
-        # Extract data points
-        data_points = response.get('Datapoints', [])
-        total_5xx_errors = sum(point['Sum'] for point in data_points)
-
-        print(f"Total 5xx errors in last 5 minutes: {total_5xx_errors}")
-
-        # Check threshold
-        if total_5xx_errors > THRESHOLD:
-            message = (
-                f"⚠️ ALERT: High number of 5xx errors detected!\n\n"
-                f"ELB: {ELB_NAME}\n"
-                f"Time Window: Last 5 minutes\n"
-                f"5xx Error Count: {total_5xx_errors}\n"
-                f"Threshold: {THRESHOLD}\n\n"
-                f"Check CloudWatch metrics for more details."
-            )
-
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject=f"ALERT: {ELB_NAME} 5xx Errors Spike Detected",
-                Message=message
-            )
-            print("SNS notification sent.")
+        event = event or {}
+        names = event.get('load_balancers') or [x.strip() for x in LOAD_BALANCERS.split(',') if x.strip()]
+        if names:
+            load_balancers = {name: [] for name in names}
         else:
-            print("5xx error count is within normal range.")
+            load_balancers = discover_load_balancers()
+
+        # Time window: the last two complete periods, on period boundaries and METRIC_DELAY_SECONDS back so
+        # their data has landed. The thresholds use the newest; the detector folds in any it has not seen,
+        # so a late or early run neither skips a period nor reads one still in progress
+        now = (datetime.utcnow() - timedelta(seconds=METRIC_DELAY_SECONDS)).replace(microsecond=0)
+        end_time = now - timedelta(seconds=now.replace(tzinfo=timezone.utc).timestamp() % PERIOD_SECONDS)
+        start_time = end_time - timedelta(seconds=2 * PERIOD_SECONDS)
+        print(f"Checking 5xx error rates of {len(load_balancers)} load balancers between {start_time} and {end_time}")
+
+        # All metrics of all load balancers in batched GetMetricData calls (up to 500 queries each)
+        series = get_metric_data(build_error_queries(load_balancers), start_time, end_time)
+        results = evaluate(load_balancers, series, end_time - timedelta(seconds=PERIOD_SECONDS))
+        if ANOMALY_DETECTION:
+            store = state_store_from_uri(DETECTOR_STATE_URI)
+            detector = AnomalyDetector(store.load() or {}, min_scale=0.02, log_values=True)
+            detect_anomalies(load_balancers, series, results, detector)
+            store.save(detector.to_state())
+
+        alerts = [lb for lb, result in results.items() if result['alert']]
+        for lb in alerts:
+            print(f"ALERT {lb}: {results[lb]}")
+            if SNS_TOPIC_ARN:
+                queue_alert(get_notifier(SNS_TOPIC_ARN), lb, results[lb])
+        if alerts and SNS_TOPIC_ARN:
+            stats = get_notifier(SNS_TOPIC_ARN).flush()
+            print(f"SNS: {stats['sent']} messages for {len(alerts)} alerting load balancers, "
+                  f"{stats['suppressed']} suppressed as repeats.")
+        elif not alerts:
+            print("5xx error rates are within normal range.")
 
         # ✅ Return structured response for testing/logging
         return {
             "status": "ok",
-            "elb_name": ELB_NAME,
-            "total_5xx_errors": total_5xx_errors,
+            "load_balancers": results,
+            "total_5xx_errors": sum(r['elb_5xx'] + r['target_5xx'] for r in results.values()),
             "threshold": THRESHOLD,
-            "alert_triggered": total_5xx_errors > THRESHOLD
+            "error_rate_threshold": ERROR_RATE_THRESHOLD,
+            "alerts": alerts,
+            "alert_triggered": bool(alerts)
         }
 
     except Exception as e:
@@ -1,27 +1,41 @@
+import json
+import math
 import os
-import boto3
 import logging
-from datetime import datetime, timedelta
+import re
+from datetime import datetime, timedelta, timezone
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+from common.clients import get_client
+from common.executor import get_executor
+from common.inventory import get_inventory, is_state_change_event
+from common.metrics import expression, get_metric_data, latest, metric_stat
+from common.notify import get_notifier
+from common.state import state_store_from_uri
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# clients
-cw = boto3.client('cloudwatch')
-ec2 = boto3.client('ec2')
-sns = boto3.client('sns')
-
 # Environment variables (set these in Lambda configuration)
 ELB_NAME = os.environ.get('ELB_NAME')  # e.g. "app/my-alb/1234567890abcdef"
+# Several load balancers, optionally paired with their target group for healthy-host counts:
+# "app/alb-a/123:targetgroup/tg-a/456,app/alb-b/789"
+LOAD_BALANCERS = os.environ.get('LOAD_BALANCERS', ELB_NAME or '')
 METRIC_NAMESPACE = os.environ.get('METRIC_NAMESPACE', 'AWS/ApplicationELB')  # default for ALB
 METRIC_NAME = os.environ.get('METRIC_NAME', 'RequestCount')  # or 'ActiveConnectionCount' for NLB, etc.
 METRIC_DIMENSION_NAME = os.environ.get('METRIC_DIMENSION_NAME', 'LoadBalancer')  # for AWS/ApplicationELB
-HIGH_THRESHOLD = float(os.environ.get('HIGH_THRESHOLD', '80'))  # percent or absolute depending on metric
+# Signal compared with the thresholds: requests_per_host (requests/s per healthy host),
+# latency_p95 (TargetResponseTime p95, seconds), cpu (average CPUUtilization of managed
+# instances, percent) or metric (METRIC_NAME with AGGREGATION, as configured above)
+SCALING_METRIC = os.environ.get('SCALING_METRIC', {
+    'RequestCount': 'requests_per_host', 'TargetResponseTime': 'latency_p95', 'CPUUtilization': 'cpu'
+}.get(METRIC_NAME, 'metric'))
+HIGH_THRESHOLD = float(os.environ.get('HIGH_THRESHOLD', '80'))  # in the unit of SCALING_METRIC
 LOW_THRESHOLD = float(os.environ.get('LOW_THRESHOLD', '20'))
-# Interpret thresholds relative to "per-instance" request capacity when using RequestCount.
 AGGREGATION = os.environ.get('AGGREGATION', 'Average')  # Average, Sum, Maximum
 PERIOD_SECONDS = int(os.environ.get('PERIOD_SECONDS', '300'))  # 5 minutes
+CPU_QUERIES_PER_GROUP = 400  # per-instance CPU queries averaged by one expression
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 
 # If you want Lambda to create instances directly:
@@ -35,79 +49,359 @@ MAX_INSTANCES = int(os.environ.get('MAX_INSTANCES', '5'))  # cap max
 INSTANCE_TAG_KEY = os.environ.get('INSTANCE_TAG_KEY', 'AutoScaleManaged')
 INSTANCE_TAG_VALUE = os.environ.get('INSTANCE_TAG_VALUE', 'true')
 
+# Scaling policy: "step" adds/removes the instances of the matching step when a threshold is
+# breached ([[breach, change], ...], breach measured past HIGH/LOW_THRESHOLD); "target" tracks
+# TARGET_VALUE proportionally (desired = ceil(capacity * metric / target)).
+POLICY_TYPE = os.environ.get('POLICY_TYPE', 'step')
+SCALE_OUT_STEPS = json.loads(os.environ.get('SCALE_OUT_STEPS', '[[0, 1]]'))  # e.g. [[0, 1], [40, 2], [100, 4]]
+SCALE_IN_STEPS = json.loads(os.environ.get('SCALE_IN_STEPS', '[[0, 1]]'))
+TARGET_VALUE = float(os.environ.get('TARGET_VALUE', (HIGH_THRESHOLD + LOW_THRESHOLD) / 2))
+TARGET_TOLERANCE = float(os.environ.get('TARGET_TOLERANCE', '0.1'))  # dead band around the target
+SCALE_OUT_COOLDOWN = int(os.environ.get('SCALE_OUT_COOLDOWN', '300'))  # seconds after a scale-out
+SCALE_IN_COOLDOWN = int(os.environ.get('SCALE_IN_COOLDOWN', '900'))  # seconds after any action
+# Last action and cooldown state (local file or s3://bucket/key, shared by concurrent runs)
+SCALING_STATE_URI = os.environ.get('SCALING_STATE_URI', '/tmp/autoscaler-state.json')
+
+# Predictive pre-scaling: an hour-of-week + trend model of total request demand, fitted
+# with NumPy on FORECAST_HISTORY_DAYS of hourly RequestCount and cached in FORECAST_MODEL_URI.
+# Capacity is raised ahead of the forecast (never lowered); needs SCALING_METRIC=requests_per_host.
+PREDICTIVE_SCALING = os.environ.get('PREDICTIVE_SCALING', 'false').lower() == 'true'
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', '28'))
+FORECAST_MODEL_URI = os.environ.get('FORECAST_MODEL_URI', '/tmp/autoscaler-forecast.json')
+FORECAST_REFRESH_HOURS = float(os.environ.get('FORECAST_REFRESH_HOURS', '24'))
+FORECAST_LEAD_MINUTES = int(os.environ.get('FORECAST_LEAD_MINUTES', '15'))  # launch-to-serving time to cover
+FORECAST_HEADROOM = float(os.environ.get('FORECAST_HEADROOM', '1.1'))  # multiplier on the forecast
+
+# Warm pool: keep WARM_POOL_SIZE stopped, already bootstrapped instances. Scale-out starts them
+# before launching from the AMI and scale-in stops instances back into the pool. New pool members
+# run for WARM_POOL_INIT_SECONDS (bootstrap/user data) and are then stopped by a later run.
+WARM_POOL_SIZE = int(os.environ.get('WARM_POOL_SIZE', '0'))  # 0 disables the pool
+WARM_POOL_TAG_KEY = os.environ.get('WARM_POOL_TAG_KEY', 'AutoScaleWarmPool')  # initializing / ready / in-service
+WARM_POOL_INIT_SECONDS = int(os.environ.get('WARM_POOL_INIT_SECONDS', '300'))
+# Target groups whose health marks an instance as serving (otherwise passing EC2 status checks does)
+TARGET_GROUP_ARNS = [a for a in os.environ.get('TARGET_GROUP_ARNS', '').split(',') if a]
+
+SCALING_POLICY = {
+    'type': POLICY_TYPE,
+    'high': HIGH_THRESHOLD,
+    'low': LOW_THRESHOLD,
+    'scale_out_steps': SCALE_OUT_STEPS,
+    'scale_in_steps': SCALE_IN_STEPS,
+    'target': TARGET_VALUE,
+    'tolerance': TARGET_TOLERANCE,
+    'min': MIN_INSTANCES,
+    'max': MAX_INSTANCES,
+    'scale_out_cooldown': SCALE_OUT_COOLDOWN,
+    'scale_in_cooldown': SCALE_IN_COOLDOWN,
+}
+
 # Which instances to count/manage: filter by tag.
 MANAGED_FILTERS = [{'Name': f'tag:{INSTANCE_TAG_KEY}', 'Values': [INSTANCE_TAG_VALUE]}]
 
-def publish_sns(subject: str, message: str):
+def publish_sns(subject: str, message: str, instance_ids=()):
     if not SNS_TOPIC_ARN:
         logger.warning("SNS_TOPIC_ARN not configured; skipping notification.")
         return
     try:
-        sns.publish(TopicArn=SNS_TOPIC_ARN, Subject=subject, Message=message)
-        logger.info("SNS published: %s", subject)
+        # Fingerprint on the direction (subject) and the instances acted on: every real scaling action
+        # is sent, only a repeat of the same one within the suppression window is dropped
+        fingerprint = ':'.join([subject, *sorted(instance_ids)])
+        stats = get_notifier(SNS_TOPIC_ARN).publish(fingerprint, subject, message)
+        logger.info("SNS %s: %d sent, %d suppressed", subject, stats['sent'], stats['suppressed'])
     except ClientError as e:
         logger.exception("Failed to publish SNS: %s", e)
 
-def get_metric_value():
+def parse_load_balancers(spec):
+    """'lb-a:tg-a,lb-b' -> [('lb-a', 'tg-a'), ('lb-b', None)]"""
+    pairs = []
+    for item in spec.split(','):
+        if item.strip():
+            lb, _, tg = item.strip().partition(':')
+            pairs.append((lb, tg or None))
+    return pairs
+
+
+def build_metric_queries(load_balancers, instance_ids):
     """
-    Fetch metric from CloudWatch for the last PERIOD_SECONDS window.
-    Returns the requested statistic value (float) or None.
+    GetMetricData query groups: per load balancer RequestCount, healthy hosts,
+    requests/s per healthy host (metric math) and TargetResponseTime p95, plus
+    the average CPU of the managed instances.
+    """
+    groups = []
+    for n, (lb, tg) in enumerate(load_balancers):
+        group = [
+            metric_stat(f'requests{n}', 'AWS/ApplicationELB', 'RequestCount', {'LoadBalancer': lb}, 'Sum',
+                        PERIOD_SECONDS),
+            metric_stat(f'latency{n}', 'AWS/ApplicationELB', 'TargetResponseTime', {'LoadBalancer': lb}, 'p95',
+                        PERIOD_SECONDS),
+        ]
+        if tg:
+            group += [
+                metric_stat(f'healthy{n}', 'AWS/ApplicationELB', 'HealthyHostCount',
+                            {'LoadBalancer': lb, 'TargetGroup': tg}, 'Minimum', PERIOD_SECONDS),
+                expression(f'perhost{n}', f'IF(healthy{n} > 0, requests{n} / healthy{n}, requests{n}) / {PERIOD_SECONDS}'),
+            ]
+        if SCALING_METRIC == 'metric':
+            group.append(metric_stat(f'metric{n}', METRIC_NAMESPACE, METRIC_NAME, {METRIC_DIMENSION_NAME: lb},
+                                     AGGREGATION, PERIOD_SECONDS))
+        groups.append(group)
+    for k in range(0, len(instance_ids), CPU_QUERIES_PER_GROUP):
+        chunk = instance_ids[k:k + CPU_QUERIES_PER_GROUP]
+        ids = [f'cpu{k + j}' for j in range(len(chunk))]
+        groups.append([
+            metric_stat(query_id, 'AWS/EC2', 'CPUUtilization', {'InstanceId': instance_id}, 'Average',
+                        PERIOD_SECONDS, return_data=False)
+            for query_id, instance_id in zip(ids, chunk)
+        ] + [expression(f'cpuavg{k}', f"AVG([{', '.join(ids)}])")])
+    return groups
+
+
+def fetch_load_metrics(load_balancers, instance_ids, serving_count):
+    """
+    One batched GetMetricData round for every load balancer and managed
+    instance. Returns per-load-balancer values and the fleet CPU average.
+    Load balancers without a target group are normalised by serving_count.
     """
     end = datetime.utcnow()
-    start = end - timedelta(seconds=PERIOD_SECONDS)
-    dims = [{'Name': METRIC_DIMENSION_NAME, 'Value': ELB_NAME}]
+    # A few periods back so the newest complete datapoint is always included
+    start = end - timedelta(seconds=3 * PERIOD_SECONDS)
     try:
-        resp = cw.get_metric_statistics(
-            Namespace=METRIC_NAMESPACE,
-            MetricName=METRIC_NAME,
-            Dimensions=dims,
-            StartTime=start,
-            EndTime=end,
-            Period=PERIOD_SECONDS,
-            Statistics=[AGGREGATION]
-        )
-        datapoints = resp.get('Datapoints', [])
-        if not datapoints:
-            logger.info("No datapoints returned for metric query.")
-            return None
-        # pick the latest datapoint by timestamp
-        latest = max(datapoints, key=lambda d: d['Timestamp'])
-        value = latest.get(AGGREGATION)
-        logger.info("Metric fetched: %s=%s (timestamp=%s)", METRIC_NAME, value, latest.get('Timestamp'))
-        return float(value)
+        series = get_metric_data(build_metric_queries(load_balancers, instance_ids), start, end)
     except ClientError:
-        logger.exception("Error fetching metric")
+        logger.exception("Error fetching metrics")
         return None
 
+    per_lb = {}
+    for n, (lb, tg) in enumerate(load_balancers):
+        requests = latest(series.get(f'requests{n}'))
+        if tg:
+            per_host = latest(series.get(f'perhost{n}'))
+        else:
+            per_host = requests / PERIOD_SECONDS / max(serving_count, 1) if requests is not None else None
+        per_lb[lb] = {
+            'requests': requests,
+            'requests_per_host': per_host,
+            'latency_p95': latest(series.get(f'latency{n}')),
+            'metric': latest(series.get(f'metric{n}')),
+        }
+    # Chunk averages weighted by chunk size
+    cpu_parts = [(latest(series.get(f'cpuavg{k}')), len(instance_ids[k:k + CPU_QUERIES_PER_GROUP]))
+                 for k in range(0, len(instance_ids), CPU_QUERIES_PER_GROUP)]
+    cpu_parts = [(value, weight) for value, weight in cpu_parts if value is not None]
+    cpu = sum(v * w for v, w in cpu_parts) / sum(w for _, w in cpu_parts) if cpu_parts else None
+    logger.info("Metrics fetched: cpu=%s load_balancers=%s", cpu, per_lb)
+    return {'load_balancers': per_lb, 'cpu': cpu}
+
+
+def scaling_signal(metrics):
+    """The value compared with the thresholds; the busiest load balancer drives the decision."""
+    if SCALING_METRIC == 'cpu':
+        return metrics['cpu']
+    values = [m[SCALING_METRIC] for m in metrics['load_balancers'].values() if m[SCALING_METRIC] is not None]
+    return max(values) if values else None
+
+
+def managed_inventory():
+    """Cached, paginated inventory of the managed instances (see common/inventory.py)."""
+    return get_inventory('autoscaler', MANAGED_FILTERS, tag_keys=(WARM_POOL_TAG_KEY,))
+
+
 def count_managed_instances():
-    """Count running/stopped instances that match our tag filters (and are EC2-managed by this function)."""
+    """Compact records of the live instances that match our tag filters (and are EC2-managed by this function)."""
     try:
-        resp = ec2.describe_instances(Filters=MANAGED_FILTERS + [{'Name': 'instance-state-name', 'Values': ['pending','running','stopping','stopped']}])
-        instances = []
-        for r in resp.get('Reservations', []):
-            for i in r.get('Instances', []):
-                instances.append(i)
+        instances = managed_inventory().snapshot()
         logger.info("Found %d managed instances", len(instances))
         return instances
     except ClientError:
         logger.exception("Failed to describe instances")
         return []
 
-def start_new_instance():
-    """Start a single new EC2 instance, tagged so it is managed."""
+
+def step_change(steps, breach):
+    """Change of the step with the largest lower bound not above breach (0 if none applies)."""
+    change = 0
+    for lower, step in sorted(steps):
+        if breach >= lower:
+            change = step
+    return change
+
+
+def desired_capacity(policy, metric, capacity):
+    """Capacity the policy asks for, before cooldowns, clamped to [min, max]."""
+    if policy['type'] == 'target':
+        target = policy['target']
+        if abs(metric - target) <= target * policy['tolerance']:
+            desired = capacity
+        else:
+            desired = math.ceil(max(capacity, 1) * metric / target)
+    elif metric >= policy['high']:
+        desired = capacity + abs(step_change(policy['scale_out_steps'], metric - policy['high']))
+    elif metric <= policy['low']:
+        desired = capacity - abs(step_change(policy['scale_in_steps'], policy['low'] - metric))
+    else:
+        desired = capacity
+    return max(policy['min'], min(policy['max'], desired))
+
+
+def decide(policy, metric, capacity, state, now):
+    """
+    (desired capacity, reason). Scale-out waits scale_out_cooldown after the
+    last scale-out; scale-in waits scale_in_cooldown after any action, so
+    capacity added for a spike is not removed straight away.
+    """
+    desired = desired_capacity(policy, metric, capacity)
+    if desired == capacity:
+        return capacity, 'within_target'
+    last_action = state.get('last_action')
+    elapsed = (now - datetime.fromisoformat(state['last_action_at'])).total_seconds() if last_action else None
+    if desired > capacity:
+        if last_action == 'scale_up' and elapsed < policy['scale_out_cooldown']:
+            return capacity, 'scale_out_cooldown'
+        return desired, 'scale_up'
+    if last_action and elapsed < policy['scale_in_cooldown']:
+        return capacity, 'scale_in_cooldown'
+    return desired, 'scale_down'
+
+
+HOURS_PER_WEEK = 168
+
+
+def hour_of_week(timestamps):
+    """Monday 00:00 UTC = 0 ... Sunday 23:00 = 167, for epoch-second timestamps."""
+    import numpy as np
+    # 1970-01-01 was a Thursday: shift by three days so Monday starts the week
+    return ((np.asarray(timestamps, dtype=float) // 3600 + 72) % HOURS_PER_WEEK).astype(int)
+
+
+def fit_forecast_model(timestamps, values):
+    """
+    Fit demand = intercept + slope * hours + seasonal[hour of week] to hourly
+    points. The trend is a least-squares line; each seasonal baseline is the
+    median residual of its hour of week (0 where there is no history).
+    """
+    import numpy as np
+    t = np.asarray(timestamps, dtype=float)
+    y = np.asarray(values, dtype=float)
+    t0 = float(t.min())
+    hours = (t - t0) / 3600
+    slope, intercept = np.polyfit(hours, y, 1) if len(set(hours)) > 1 else (0.0, float(y.mean()))
+    residual = y - (intercept + slope * hours)
+    slots = hour_of_week(t)
+    seasonal = np.zeros(HOURS_PER_WEEK)
+    for slot in np.unique(slots):
+        seasonal[slot] = np.median(residual[slots == slot])
+    return {
+        't0': t0,
+        'intercept': float(intercept),
+        'slope': float(slope),
+        'seasonal': [round(float(v), 4) for v in seasonal],
+        'points': int(len(y)),
+    }
+
+
+def forecast(model, timestamps):
+    """Predicted demand (never negative) at each epoch-second timestamp."""
+    import numpy as np
+    t = np.asarray(timestamps, dtype=float)
+    trend = model['intercept'] + model['slope'] * (t - model['t0']) / 3600
+    return np.maximum(0.0, trend + np.asarray(model['seasonal'])[hour_of_week(t)])
+
+
+def fetch_demand_history(load_balancers, end, days):
+    """Hourly total requests/s across all load balancers: (epoch timestamps, values)."""
+    ids = [f'history{n}' for n in range(len(load_balancers))]
+    group = [metric_stat(query_id, 'AWS/ApplicationELB', 'RequestCount', {'LoadBalancer': lb}, 'Sum', 3600,
+                         return_data=False)
+             for query_id, (lb, _) in zip(ids, load_balancers)]
+    group.append(expression('demand', f"SUM([{', '.join(ids)}]) / 3600"))
+    points = get_metric_data([group], end - timedelta(days=days), end).get('demand', [])
+    return [ts.timestamp() for ts, _ in points], [value for _, value in points]
+
+
+def load_forecast_model(load_balancers, now):
+    """The cached model, refitted from CloudWatch history once it is older than FORECAST_REFRESH_HOURS."""
+    store = state_store_from_uri(FORECAST_MODEL_URI)
+    cached = store.load()
+    if cached and now - datetime.fromisoformat(cached['fitted_at']) < timedelta(hours=FORECAST_REFRESH_HOURS):
+        return cached
+    timestamps, values = fetch_demand_history(load_balancers, now, FORECAST_HISTORY_DAYS)
+    if len(values) < 24:
+        logger.warning("Only %d hours of demand history; predictive scaling skipped", len(values))
+        return cached
+    model = {**fit_forecast_model(timestamps, values), 'fitted_at': now.isoformat()}
+    store.save(model)
+    logger.info("Forecast model refitted on %d hourly points (trend %.3f req/s per hour)",
+                model['points'], model['slope'])
+    return model
+
+
+def predictive_capacity(model, policy, now, lead_minutes=FORECAST_LEAD_MINUTES, headroom=FORECAST_HEADROOM):
+    """Capacity needed for the highest forecast demand between now and now + lead time."""
+    start = now.timestamp()
+    horizon = [start + minutes * 60 for minutes in range(0, lead_minutes + 1, 5)]
+    demand = float(forecast(model, horizon).max()) * headroom
+    return max(policy['min'], min(policy['max'], math.ceil(demand / policy['target']))), demand
+
+
+def backtest(timestamps, values, policy, train_hours=HOURS_PER_WEEK * 2, refit_hours=24, headroom=FORECAST_HEADROOM):
+    """
+    Replay an hourly demand series: refit every refit_hours on the history so
+    far and forecast the next hours. Scores forecast error (MAE, MAPE) and the
+    capacity the forecast would provision against what demand needed, next to
+    a reactive baseline that provisions for the previous hour's demand.
+    """
+    import numpy as np
+    t = np.asarray(timestamps, dtype=float)
+    y = np.asarray(values, dtype=float)
+    predicted = []
+    for start in range(train_hours, len(y), refit_hours):
+        model = fit_forecast_model(t[:start], y[:start])
+        predicted.extend(forecast(model, t[start:start + refit_hours]))
+    actual = y[train_hours:]
+    predicted = np.asarray(predicted)
+    if not len(actual):
+        raise ValueError(f"need more than {train_hours} hourly points to backtest")
+
+    def capacity(demand):
+        return np.clip(np.ceil(demand / policy['target']), policy['min'], policy['max'])
+
+    needed = capacity(actual)
+    scores = {'hours': int(len(actual))}
+    for name, provisioned in (('predictive', capacity(predicted * headroom)),
+                              ('reactive', capacity(y[train_hours - 1:-1]))):
+        scores[name] = {
+            'over_provisioned_instance_hours': float(np.maximum(0, provisioned - needed).sum()),
+            'under_provisioned_hours': int((provisioned < needed).sum()),
+            'instance_hours': float(provisioned.sum()),
+        }
+    nonzero = actual > 0
+    scores['forecast_mae'] = round(float(np.abs(predicted - actual).mean()), 3)
+    scores['forecast_mape'] = round(float(np.abs((predicted - actual)[nonzero] / actual[nonzero]).mean()), 4) \
+        if nonzero.any() else None
+    return scores
+
+
+def start_new_instances(count, pool_role=None):
+    """
+    Launch up to count new EC2 instances in one run_instances call, tagged so
+    they are managed (and, for warm-pool members, with their pool role).
+    """
     if not AMI_ID:
         raise RuntimeError("AMI_ID not configured; cannot launch instance.")
     sg_ids = [x.strip() for x in SECURITY_GROUP_IDS.split(',')] if SECURITY_GROUP_IDS else None
     launch_args = {
         'ImageId': AMI_ID,
         'InstanceType': INSTANCE_TYPE,
+        # Take what capacity is available rather than failing the whole spike response
         'MinCount': 1,
-        'MaxCount': 1,
+        'MaxCount': count,
         'TagSpecifications': [{
             'ResourceType': 'instance',
             'Tags': [{'Key': INSTANCE_TAG_KEY, 'Value': INSTANCE_TAG_VALUE}]
         }]
     }
+    if pool_role:
+        launch_args['TagSpecifications'][0]['Tags'].append({'Key': WARM_POOL_TAG_KEY, 'Value': pool_role})
     if sg_ids:
         launch_args['SecurityGroupIds'] = sg_ids
     if KEY_NAME:
@@ -116,71 +410,309 @@ def start_new_instance():
         launch_args['SubnetId'] = SUBNET_ID
 
     try:
-        resp = ec2.run_instances(**launch_args)
-        instance_id = resp['Instances'][0]['InstanceId']
-        logger.info("Launched instance %s", instance_id)
-        publish_sns("Scale Up: Launched EC2", f"Launched instance {instance_id} due to high load.")
-        return instance_id
+        resp = get_executor().call('ec2', get_client('ec2').run_instances, **launch_args)
+        instance_ids = [i['InstanceId'] for i in resp['Instances']]
+        managed_inventory().record_launch(resp['Instances'], {WARM_POOL_TAG_KEY: pool_role} if pool_role else None)
+        logger.info("Launched instances %s", instance_ids)
+        if pool_role:
+            return instance_ids
+        publish_sns("Scale Up: Launched EC2", f"Launched {len(instance_ids)} instances {instance_ids} due to high load.",
+                    instance_ids)
+        return instance_ids
     except ClientError:
-        logger.exception("Failed to launch instance")
-        return None
+        logger.exception("Failed to launch instances")
+        return []
+
+
+def select_instances_to_terminate(instances, count):
+    """The count oldest running instances (inventory records)."""
+    running = [i for i in instances if i['state'] == 'running']
+    return sorted(running, key=lambda i: i['launch_time'])[:count]
+
+
+def terminate_instances(instances):
+    """Terminate the given instances with one terminate_instances call."""
+    if not instances:
+        logger.info("No running instances to terminate.")
+        return []
+    inst_ids = [i['id'] for i in instances]
+    try:
+        get_executor().call('ec2', get_client('ec2').terminate_instances, InstanceIds=inst_ids)
+        managed_inventory().set_state(inst_ids, 'terminated')
+        logger.info("Terminated instances %s", inst_ids)
+        publish_sns("Scale Down: Terminated EC2", f"Terminated {len(inst_ids)} instances {inst_ids} due to low load.",
+                    inst_ids)
+        return inst_ids
+    except ClientError:
+        logger.exception("Failed to terminate instances")
+        return []
 
-def terminate_one_instance(instances):
+
+def pool_role(instance):
+    return instance['tags'].get(WARM_POOL_TAG_KEY)
+
+
+def partition_fleet(managed):
     """
-    Terminate one instance from the provided list (prefer stopped or oldest running).
-    Instances is list of instance dicts from describe_instances.
+    (serving, pool, initializing). Stopped/stopping instances are pool members
+    when the warm pool is enabled or they are tagged as ready pool members;
+    otherwise they stay in capacity, so MAX_INSTANCES still covers them.
     """
-    # select candidate: prefer instances in 'stopped', then oldest 'running'
-    stopped = [i for i in instances if i['State']['Name'] == 'stopped']
-    if stopped:
-        target = stopped[0]
-    else:
-        # pick oldest running (by LaunchTime)
-        running = [i for i in instances if i['State']['Name'] == 'running']
-        if not running:
-            logger.info("No running instances to terminate.")
-            return None
-        target = min(running, key=lambda i: i['LaunchTime'])
-
-    inst_id = target['InstanceId']
+    serving, pool, initializing = [], [], []
+    for i in managed:
+        state = i['state']
+        if state in ('stopped', 'stopping') and (WARM_POOL_SIZE or pool_role(i) == 'ready'):
+            pool.append(i)
+        elif pool_role(i) == 'initializing':
+            initializing.append(i)
+        else:
+            serving.append(i)
+    return serving, pool, initializing
+
+
+def set_pool_role(instance_ids, role):
+    get_executor().call('ec2', get_client('ec2').create_tags, Resources=instance_ids,
+                        Tags=[{'Key': WARM_POOL_TAG_KEY, 'Value': role}])
+    managed_inventory().set_tags(instance_ids, {WARM_POOL_TAG_KEY: role})
+
+
+def start_pool_instances(pool, count):
+    """Start up to count stopped pool members with one start_instances call."""
+    inst_ids = [i['id'] for i in pool if i['state'] == 'stopped'][:count]
+    if not inst_ids:
+        return []
     try:
-        ec2.terminate_instances(InstanceIds=[inst_id])
-        logger.info("Terminated instance %s", inst_id)
-        publish_sns("Scale Down: Terminated EC2", f"Terminated instance {inst_id} due to low load.")
-        return inst_id
+        get_executor().call('ec2', get_client('ec2').start_instances, InstanceIds=inst_ids)
+        managed_inventory().set_state(inst_ids, 'pending')
+        set_pool_role(inst_ids, 'in-service')
+        logger.info("Started warm pool instances %s", inst_ids)
+        publish_sns("Scale Up: Started warm EC2", f"Started {len(inst_ids)} warm pool instances {inst_ids} due to high load.",
+                    inst_ids)
+        return inst_ids
     except ClientError:
-        logger.exception("Failed to terminate instance")
-        return None
+        logger.exception("Failed to start warm pool instances")
+        return []
+
+
+def stop_into_pool(instances):
+    """Stop instances and mark them as ready pool members instead of terminating them."""
+    inst_ids = [i['id'] for i in instances]
+    if not inst_ids:
+        return []
+    try:
+        get_executor().call('ec2', get_client('ec2').stop_instances, InstanceIds=inst_ids)
+        managed_inventory().set_state(inst_ids, 'stopping')
+        set_pool_role(inst_ids, 'ready')
+        logger.info("Stopped instances %s into the warm pool", inst_ids)
+        return inst_ids
+    except ClientError:
+        logger.exception("Failed to stop instances into the warm pool")
+        return []
+
+
+def refill_warm_pool(pool_size, initializing, now):
+    """
+    Stop initializing members that had WARM_POOL_INIT_SECONDS to bootstrap and
+    launch new ones for whatever pool_size (pool + initializing after this
+    run's scaling action) is short of WARM_POOL_SIZE.
+    """
+    ready = [i for i in initializing if i['state'] == 'running'
+             and (now - datetime.fromisoformat(i['launch_time'])).total_seconds() >= WARM_POOL_INIT_SECONDS]
+    deficit = WARM_POOL_SIZE - pool_size - len(initializing)
+    return {
+        'stopped': stop_into_pool(ready),
+        'launched': start_new_instances(deficit, pool_role='initializing') if deficit > 0 else [],
+    }
+
+
+def serving_instance_ids(instance_ids):
+    """Which of instance_ids serve: healthy in TARGET_GROUP_ARNS, or passing EC2 status checks."""
+    if not instance_ids:
+        return set()
+    executor = get_executor()
+    if TARGET_GROUP_ARNS:
+        elbv2 = get_client('elbv2')
+        healthy = set()
+        for arn in TARGET_GROUP_ARNS:
+            resp = executor.call('elbv2', elbv2.describe_target_health, TargetGroupArn=arn)
+            healthy.update(d['Target']['Id'] for d in resp['TargetHealthDescriptions']
+                           if d['TargetHealth']['State'] == 'healthy')
+        return healthy & set(instance_ids)
+    resp = executor.call('ec2', get_client('ec2').describe_instance_status, InstanceIds=list(instance_ids))
+    return {s['InstanceId'] for s in resp['InstanceStatuses']
+            if s['InstanceState']['Name'] == 'running' and s['InstanceStatus']['Status'] == 'ok'}
+
+
+def existing_instances(call, instance_ids):
+    """
+    call(instance_ids), retried without the ids EC2 reports as not found
+    (terminated and purged). Returns (result, ids that no longer exist).
+    """
+    ids, missing = list(instance_ids), []
+    while ids:
+        try:
+            return call(ids), missing
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound':
+                raise
+            gone = set(re.findall(r'i-[0-9a-f]+', e.response['Error'].get('Message', ''))) & set(ids)
+            if not gone:
+                raise
+            missing += sorted(gone)
+            ids = [i for i in ids if i not in gone]
+    return None, missing
+
+
+def start_times(instance_ids):
+    """{instance id: LaunchTime}; EC2 resets LaunchTime when a stopped instance starts, so warm starts count too."""
+    resp = get_executor().call('ec2', get_client('ec2').describe_instances, InstanceIds=list(instance_ids))
+    return {i['InstanceId']: i['LaunchTime'] for r in resp['Reservations'] for i in r['Instances']}
+
+
+def status_check_seconds(started, now):
+    """
+    {instance id: seconds from its start to the first minute its EC2 status
+    checks passed}, from the per-minute StatusCheckFailed metric. Instances
+    without a passing minute yet are left out.
+    """
+    ids = list(started)
+    groups = [[metric_stat(f'status{n}', 'AWS/EC2', 'StatusCheckFailed', {'InstanceId': inst_id}, 'Maximum', 60)]
+              for n, inst_id in enumerate(ids)]
+    series = get_metric_data(groups, min(started.values()), now)
+    seconds = {}
+    for n, inst_id in enumerate(ids):
+        passed = [ts for ts, value in series.get(f'status{n}', []) if ts >= started[inst_id] and value == 0]
+        if passed:
+            # A datapoint covers the minute starting at its timestamp
+            seconds[inst_id] = (passed[0] - started[inst_id]).total_seconds() + 60
+    return seconds
+
+
+def track_time_to_serving(state, now):
+    """
+    Move launches that now serve from state['launches'] into per-kind (warm/cold)
+    time-to-serving totals, measured from the instance's start (LaunchTime)
+    to the minute its status checks passed, so the schedule interval does not
+    limit the resolution. Instances that no longer exist are dropped.
+    """
+    launches = state.setdefault('launches', {})
+    stats = state.setdefault('time_to_serving', {})
+    seconds = {}
+    try:
+        serving, gone = existing_instances(serving_instance_ids, list(launches))
+        for inst_id in gone:
+            logger.info("Launched instance %s no longer exists; dropping it from time-to-serving tracking", inst_id)
+            del launches[inst_id]
+        if serving:
+            started, _ = existing_instances(start_times, serving)
+            if started:
+                seconds = status_check_seconds(started, now)
+    except ClientError:
+        logger.exception("Failed to check serving state of new instances")
+    for inst_id in list(launches):
+        entry = launches[inst_id]
+        if inst_id in seconds:
+            kind = stats.setdefault(entry['kind'], {'count': 0, 'total_seconds': 0.0})
+            kind['count'] += 1
+            kind['total_seconds'] += seconds[inst_id]
+            del launches[inst_id]
+        elif (now - datetime.fromisoformat(entry['at'])).total_seconds() > 3600:
+            del launches[inst_id]  # never became healthy; not a launch-time sample
+
+
+def time_to_serving_summary(stats):
+    summary = {kind: round(v['total_seconds'] / v['count'], 1) for kind, v in stats.items() if v['count']}
+    if 'warm' in summary and 'cold' in summary:
+        summary['warm_saves_seconds'] = round(summary['cold'] - summary['warm'], 1)
+    return summary
+
 
 def lambda_handler(event, context):
     logger.info("Auto-scale Lambda started")
-    metric_value = get_metric_value()
-    if metric_value is None:
-        logger.warning("Metric not available; exiting without action.")
-        return {"status": "no_metric"}
-
-    # You must decide what metric_value represents: percent or absolute.
-    # This sample assumes metric is percent-like (0-100). If metric is RequestCount, you may need to normalize to per-instance rate.
+    event = event or {}
+    if is_state_change_event(event):
+        # EventBridge EC2 state-change events keep the cached inventory current between ticks
+        updated = managed_inventory().apply_event(event)
+        return {"action": "inventory_updated" if updated else "inventory_unchanged"}
+    if event.get('mode') == 'backtest':
+        # Score the forecast on this account's own history; no scaling action is taken
+        timestamps, values = fetch_demand_history(parse_load_balancers(LOAD_BALANCERS), datetime.now(timezone.utc),
+                                                  int(event.get('days', FORECAST_HISTORY_DAYS)))
+        return {"action": "backtest", **backtest(timestamps, values, SCALING_POLICY)}
     try:
         managed = count_managed_instances()
-        current_count = len([i for i in managed if i['State']['Name'] in ('pending', 'running', 'stopping', 'stopped')])
-        logger.info("Current managed instance count: %d", current_count)
     except Exception as e:
         logger.exception("Failed to count managed instances: %s", e)
-        current_count = 0
-
-    # Scaling decisions
-    # Scale up
-    if metric_value >= HIGH_THRESHOLD and current_count < MAX_INSTANCES:
-        logger.info("High threshold exceeded: %s >= %s", metric_value, HIGH_THRESHOLD)
-        launched = start_new_instance()
-        return {"action": "scale_up", "launched": launched}
-
-    # Scale down
-    if metric_value <= LOW_THRESHOLD and current_count > MIN_INSTANCES:
-        logger.info("Low threshold met: %s <= %s", metric_value, LOW_THRESHOLD)
-        terminated = terminate_one_instance(managed)
-        return {"action": "scale_down", "terminated": terminated}
-
-    logger.info("No scaling action required. metric=%s thresholds=(%s,%s) count=%d", metric_value, LOW_THRESHOLD, HIGH_THRESHOLD, current_count)
-    return {"action": "no_action", "metric": metric_value}
+        managed = []
+    # Capacity counts instances that serve (or are about to); stopped ones form the warm pool
+    serving, pool, initializing = partition_fleet(managed)
+    capacity = len(serving)
+    logger.info("Current managed capacity: %d (warm pool %d, initializing %d)", capacity, len(pool), len(initializing))
+
+    running = [i['id'] for i in serving if i['state'] == 'running']
+    metrics = fetch_load_metrics(parse_load_balancers(LOAD_BALANCERS), running, len(running))
+    metric_value = scaling_signal(metrics) if metrics else None
+    if metric_value is None:
+        logger.warning("Metric not available; exiting without action.")
+        return {"status": "no_metric"}
+    logger.info("Scaling signal %s=%s", SCALING_METRIC, metric_value)
+
+    store = state_store_from_uri(SCALING_STATE_URI)
+    state = store.load() or {}
+    previous_state = json.dumps(state, sort_keys=True)
+    now = datetime.now(timezone.utc)
+    desired, reason = decide(SCALING_POLICY, metric_value, capacity, state, now)
+    if PREDICTIVE_SCALING:
+        # Pre-scale ahead of the forecast; the reactive policy still adds more if demand beats it
+        model = load_forecast_model(parse_load_balancers(LOAD_BALANCERS), now)
+        if model:
+            predicted, demand = predictive_capacity(model, SCALING_POLICY, now)
+            logger.info("Forecast demand %.1f req/s in the next %d minutes -> %d instances",
+                        demand, FORECAST_LEAD_MINUTES, predicted)
+            if predicted > desired:
+                desired, reason = predicted, 'predictive'
+    logger.info("Policy %s: metric=%s capacity=%d desired=%d (%s)", POLICY_TYPE, metric_value, capacity, desired, reason)
+
+    result = {"action": "no_action", "reason": reason, "metric": metric_value, "capacity": capacity,
+              "desired": desired, "metrics": metrics}
+    launched = []
+    # Pool size once this run's action is applied; the refill runs next to the scaling calls
+    pool_after = len(pool)
+    to_pool = to_terminate = []
+    if desired > capacity:
+        pool_after -= min(desired - capacity, len([i for i in pool if i['state'] == 'stopped']))
+    elif desired < capacity:
+        victims = select_instances_to_terminate(serving, capacity - desired)
+        room = max(0, WARM_POOL_SIZE - len(pool) - len(initializing))
+        # Newest instances go back to the pool, the oldest are replaced
+        victims = sorted(victims, key=lambda i: i['launch_time'], reverse=True)
+        to_pool, to_terminate = victims[:room], victims[room:]
+        pool_after += len(to_pool)
+
+    with ThreadPoolExecutor(max_workers=1) as background:
+        refill = background.submit(refill_warm_pool, pool_after, initializing, now) if WARM_POOL_SIZE else None
+        if desired > capacity:
+            warm = start_pool_instances(pool, desired - capacity) if WARM_POOL_SIZE else []
+            cold = start_new_instances(desired - capacity - len(warm)) if desired - capacity > len(warm) else []
+            launched = [(i, 'warm') for i in warm] + [(i, 'cold') for i in cold]
+            result.update(action="scale_up", launched=cold, warm_started=warm)
+        elif desired < capacity:
+            stopped = stop_into_pool(to_pool)
+            terminated = terminate_instances(to_terminate)
+            result.update(action="scale_down", terminated=terminated, stopped_into_pool=stopped)
+        if refill:
+            result['warm_pool_refill'] = refill.result()
+
+    if result['action'] != 'no_action' and (launched or result.get('terminated') or result.get('stopped_into_pool')):
+        state.update(last_action=result['action'], last_action_at=now.isoformat(),
+                     capacity=capacity, desired=desired, metric=metric_value)
+    for inst_id, kind in launched:
+        state.setdefault('launches', {})[inst_id] = {'kind': kind, 'at': now.isoformat()}
+    if state.get('launches'):
+        track_time_to_serving(state, now)
+    if state.get('time_to_serving'):
+        result['time_to_serving'] = time_to_serving_summary(state['time_to_serving'])
+        logger.info("Average time to serving (s): %s", result['time_to_serving'])
+    if json.dumps(state, sort_keys=True) != previous_state:
+        store.save(state)
+    return result
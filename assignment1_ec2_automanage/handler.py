@@ -1,35 +1,229 @@
-import boto3
+import json
+import os
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-def stop_ec2_instance(event, context):
-    ec2 = boto3.client('ec2')
-    instance_ids = ['i-033231fd0fca97167']  # replace with your instance ID
-    ec2.stop_instances(InstanceIds=instance_ids)
-    print('Stopped EC2 instance:', instance_ids)
+from common.clients import get_client
+from common.executor import get_executor
+from common.inventory import get_inventory, is_state_change_event
+
+# Regions to manage; defaults to the function's own region
+REGIONS = [r.strip() for r in os.environ.get('REGIONS', os.environ.get('AWS_REGION', '')).split(',') if r.strip()]
+# Instances matching every tag are targeted by "start"/"stop", e.g. {"AutoStartStop": ["true"]}
+TARGET_TAGS = json.loads(os.environ.get('TARGET_TAGS', '{}'))
+INSTANCE_IDS = [i for i in os.environ.get('INSTANCE_IDS', '').split(',') if i]  # explicit targets
+# "schedule" runs instances only inside their office-hours tag, e.g. Schedule="08:00-18:00 mon-fri Europe/Berlin"
+SCHEDULE_TAG = os.environ.get('SCHEDULE_TAG', 'Schedule')
+SCHEDULE_TZ = os.environ.get('SCHEDULE_TZ', 'UTC')
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '500'))  # instance ids per StopInstances/StartInstances call
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '16'))
+LOG_IDS_LIMIT = 50
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+# States in which an instance needs no call (or cannot take one) for each target state
+SKIP_STATES = {
+    'stopped': {'stopped', 'stopping', 'terminated', 'shutting-down'},
+    'running': {'running', 'pending', 'stopping', 'terminated', 'shutting-down'},
+}
+# Errors that reject the whole batch because of one instance; the batch is split to isolate it
+SPLIT_ON = {'IncorrectInstanceState', 'UnsupportedOperation', 'InvalidInstanceID.NotFound',
+            'InsufficientInstanceCapacity', 'OperationNotPermitted'}
+
+
+def parse_schedule(value, default_tz=SCHEDULE_TZ):
+    """'08:00-18:00 mon-fri Europe/Berlin' -> (start, end, weekday numbers, tzinfo)."""
+    start = end = None
+    days = set(range(7))
+    tz = default_tz
+    for token in value.split():
+        lowered = token.lower()
+        if lowered[0].isdigit():
+            first, _, last = lowered.partition('-')
+            start, end = dtime.fromisoformat(first), dtime.fromisoformat(last)
+        elif lowered[:3] in DAYS:
+            days = set()
+            for part in lowered.split(','):
+                first, _, last = part.partition('-')
+                lo, hi = DAYS.index(first[:3]), DAYS.index((last or first)[:3])
+                days.update(d % 7 for d in range(lo, hi + 1 if hi >= lo else hi + 8))
+        else:
+            tz = token
+    if start is None:
+        raise ValueError(f"no time range in schedule '{value}'")
+    return start, end, days, ZoneInfo(tz)
+
+
+def desired_state(schedule, now):
+    """'running' inside the schedule window, 'stopped' outside it. Windows may cross midnight."""
+    start, end, days, tz = schedule
+    local = now.astimezone(tz)
+    current = local.time()
+    if start <= end:
+        inside = local.weekday() in days and start <= current < end
+    else:
+        # Overnight window: the part after midnight belongs to the previous day's schedule
+        inside = ((local.weekday() in days and current >= start)
+                  or ((local.weekday() - 1) % 7 in days and current < end))
+    return 'running' if inside else 'stopped'
+
+
+def target_inventory(action, region):
+    """Cached inventory of the tagged instances this action manages in one region."""
+    if action == 'schedule':
+        return get_inventory('scheduler-schedule', [{'Name': 'tag-key', 'Values': [SCHEDULE_TAG]}],
+                             region_name=region, tag_keys=(SCHEDULE_TAG,))
+    filters = []
+    for key, values in TARGET_TAGS.items():
+        if values:
+            filters.append({'Name': f'tag:{key}', 'Values': values if isinstance(values, list) else [values]})
+        else:
+            filters.append({'Name': 'tag-key', 'Values': [key]})
+    return get_inventory('scheduler-tags', filters, region_name=region)
+
+
+def instance_states(ec2):
+    """One paginated DescribeInstanceStatus sweep: {instance_id: state name} for the region."""
+    states = {}
+    pages = ec2.get_paginator('describe_instance_status').paginate(
+        IncludeAllInstances=True, PaginationConfig={'PageSize': 1000})
+    for page in pages:
+        for status in page['InstanceStatuses']:
+            states[status['InstanceId']] = status['InstanceState']['Name']
+    return states
+
+
+def plan_region(region, action, instance_ids, now):
+    """Split a region's targets into {'running': [...], 'stopped': [...]} plus skipped reasons."""
+    if instance_ids and action != 'schedule':
+        targets = dict.fromkeys(instance_ids, 'running' if action == 'start' else 'stopped')
+    elif action != 'schedule' and not TARGET_TAGS:
+        return {'running': [], 'stopped': []}, {}
+    else:
+        # Tagged fleet: the cached inventory only says which instances are targets
+        records = target_inventory(action, region or None).snapshot()
+        if action == 'schedule':
+            targets = {r['id']: r['tags'][SCHEDULE_TAG] for r in records}
+        else:
+            targets = dict.fromkeys((r['id'] for r in records), 'running' if action == 'start' else 'stopped')
+    # Their current states come from one DescribeInstanceStatus sweep: a cached state can be minutes old
+    # (e.g. an instance someone stopped by hand since the listing)
+    states = instance_states(get_client('ec2', region_name=region or None)) if targets else {}
+
+    plan = {'running': [], 'stopped': []}
+    skipped = {}
+    for instance_id, target in targets.items():
+        if action == 'schedule':
+            try:
+                target = desired_state(parse_schedule(target), now)
+            except (ValueError, ZoneInfoNotFoundError) as e:
+                print(f"Ignoring {instance_id}: bad {SCHEDULE_TAG} tag ({e})")
+                skipped[instance_id] = 'invalid_schedule'
+                continue
+        state = states.get(instance_id)
+        if state is None:
+            skipped[instance_id] = 'not_found'
+        elif state in SKIP_STATES[target]:
+            skipped[instance_id] = state
+        else:
+            plan[target].append(instance_id)
+    return plan, skipped
+
+
+def run_batch(ec2, target, instance_ids):
+    """Stop/start one batch. A batch rejected because of one instance is split until the culprit is isolated."""
+    method = ec2.start_instances if target == 'running' else ec2.stop_instances
+    try:
+        get_executor().call('ec2', method, InstanceIds=instance_ids)
+        return instance_ids, {}
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if len(instance_ids) == 1 or code not in SPLIT_ON:
+            return [], dict.fromkeys(instance_ids, code)
+    middle = len(instance_ids) // 2
+    done, failed = run_batch(ec2, target, instance_ids[:middle])
+    more_done, more_failed = run_batch(ec2, target, instance_ids[middle:])
+    return done + more_done, {**failed, **more_failed}
+
+
+def apply_action(action, event):
+    regions = event.get('regions') or REGIONS or [None]
+    instance_ids = event.get('instance_ids') or INSTANCE_IDS
+    now = datetime.now().astimezone()
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as pool:
+        plans = dict(zip(regions, pool.map(lambda r: plan_region(r, action, instance_ids, now), regions)))
+        # Every batch of every region runs at the same time; the executor backs off on throttling
+        batches = []
+        for region, (plan, _) in plans.items():
+            ec2 = get_client('ec2', region_name=region or None)
+            for target, ids in plan.items():
+                for i in range(0, len(ids), BATCH_SIZE):
+                    batches.append((target, pool.submit(run_batch, ec2, target, ids[i:i + BATCH_SIZE])))
+        result = {'started': [], 'stopped': [], 'failed': {}, 'skipped': {}}
+        for target, future in batches:
+            done, failed = future.result()
+            result['started' if target == 'running' else 'stopped'].extend(done)
+            result['failed'].update(failed)
+    if action == 'schedule' or (TARGET_TAGS and not instance_ids):
+        for region in regions:
+            inventory = target_inventory(action, region or None)
+            inventory.set_state(result['started'], 'pending')
+            inventory.set_state(result['stopped'], 'stopping')
+    handled = set(result['started']) | set(result['stopped']) | set(result['failed'])
+    for _, skipped in plans.values():
+        result['skipped'].update((i, reason) for i, reason in skipped.items() if reason != 'not_found')
+    # Explicit ids are looked up in every region; only report those no region knows
+    for _, skipped in plans.values():
+        for instance_id, reason in skipped.items():
+            if reason == 'not_found' and instance_id not in handled and instance_id not in result['skipped']:
+                result['skipped'][instance_id] = reason
+    return result
+
+
+def respond(action, result):
+    print(f"Started {len(result['started'])}, stopped {len(result['stopped'])}, "
+          f"skipped {len(result['skipped'])}, failed {len(result['failed'])} instances ({action})")
+    # Fleet-wide runs touch thousands of instances; only short id lists are logged in full
+    for verb in ('started', 'stopped'):
+        if 0 < len(result[verb]) <= LOG_IDS_LIMIT:
+            print(f'{verb.capitalize()} EC2 instances:', result[verb])
+    for instance_id, code in result['failed'].items():
+        print(f"Could not change {instance_id}: {code}")
+    get_executor().log_metrics()
     return {
         'statusCode': 200,
-        'body': f'Successfully stopped EC2 instance: {instance_ids}'
+        'body': f"Successfully started {len(result['started'])} and stopped {len(result['stopped'])} EC2 instances",
+        **result
     }
 
+
+def stop_ec2_instance(event, context):
+    return respond('stop', apply_action('stop', event))
+
+
 def start_ec2_instance(event, context):
-    ec2 = boto3.client('ec2')
-    instance_ids = ['i-033231fd0fca97167']  # replace with your instance ID
-    ec2.start_instances(InstanceIds=instance_ids)
-    print('Started EC2 instance:', instance_ids)
-    return {
-        'statusCode': 200,
-        'body': f'Successfully started EC2 instance: {instance_ids}'
-    }
+    return respond('start', apply_action('start', event))
+
 
 def lambda_handler(event, context):
     # Determine which action to perform based on event input
+    event = event or {}
+    if is_state_change_event(event):
+        # EventBridge EC2 state-change events keep the cached inventories current between runs
+        actions = ['schedule'] + (['stop'] if TARGET_TAGS else [])
+        updated = [target_inventory(a, event.get('region')).apply_event(event) for a in actions]
+        return {'statusCode': 200, 'body': f"Inventory {'updated' if any(updated) else 'unchanged'}"}
     action = event.get('action', 'stop')  # default to stop if no action specified
-    
+
     if action == 'start':
         return start_ec2_instance(event, context)
     elif action == 'stop':
         return stop_ec2_instance(event, context)
+    elif action == 'schedule':
+        return respond('schedule', apply_action('schedule', event))
     else:
         return {
             'statusCode': 400,
-            'body': 'Invalid action. Use "start" or "stop".'
-        }
\ No newline at end of file
+            'body': 'Invalid action. Use "start", "stop" or "schedule".'
+        }
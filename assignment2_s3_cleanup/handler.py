@@ -1,16 +1,173 @@
-import boto3
+import os
+import time
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone, timedelta
 
-def lambda_handler(event, context):
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket('s3-bucket-cleanup-adish')
+from common.checkpoint import TimeBudget, checkpoint_from_env
+from common.clients import get_client
+from common.executor import get_executor
+
+# Environment variables
+BUCKET_NAME = os.environ.get('BUCKET_NAME', 's3-bucket-cleanup-adish')
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '1'))  # Define the age threshold in days
+PURGE_CONCURRENCY = int(os.environ.get('PURGE_CONCURRENCY', '4'))  # DeleteObjects batches in flight
+MAX_DELETE_RETRIES = int(os.environ.get('MAX_DELETE_RETRIES', '3'))  # retries for keys listed in Errors
+
+# S3 accepts at most 1000 keys per DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+
+def iter_expired_version_pages(s3, bucket_name, cutoff_date, key_marker=None, version_id_marker=None):
+    """
+    Stream one list_object_versions page at a time as (expired, next_marker):
+    the {'Key', 'VersionId'} entries of versions and delete markers last
+    modified before cutoff_date, and the marker to resume after this page
+    (None on the last page).
+    """
+    kwargs = {'Bucket': bucket_name}
+    if key_marker:
+        kwargs['KeyMarker'] = key_marker
+        if version_id_marker:
+            kwargs['VersionIdMarker'] = version_id_marker
+    while True:
+        page = get_executor().call('s3', s3.list_object_versions, **kwargs)
+        expired = [
+            {'Key': entry['Key'], 'VersionId': entry['VersionId']}
+            for entry in page.get('Versions', []) + page.get('DeleteMarkers', [])
+            if entry['LastModified'] < cutoff_date
+        ]
+        if not page.get('IsTruncated'):
+            yield expired, None
+            return
+        kwargs['KeyMarker'] = page['NextKeyMarker']
+        kwargs['VersionIdMarker'] = page.get('NextVersionIdMarker')
+        next_marker = {'key_marker': kwargs['KeyMarker'], 'version_id_marker': kwargs['VersionIdMarker']}
+        yield expired, next_marker
+
+
+def delete_batch(s3, bucket_name, objects):
+    """
+    Delete up to 1000 versions with one DeleteObjects call, retrying only the
+    keys reported in the per-key Errors list. Returns (deleted, failed_objects).
+    """
+    deleted = 0
+    pending = objects
+    for attempt in range(MAX_DELETE_RETRIES + 1):
+        try:
+            resp = get_executor().call(
+                's3', s3.delete_objects,
+                Bucket=bucket_name,
+                Delete={'Objects': pending, 'Quiet': True}
+            )
+            errors = resp.get('Errors', [])
+        except ClientError as e:
+            # The whole request failed after the executor's retries; retry every key in it
+            print(f"DeleteObjects request failed: {e}")
+            errors = pending
+        deleted += len(pending) - len(errors)
+        if not errors:
+            return deleted, []
+        pending = [{'Key': e['Key'], 'VersionId': e['VersionId']} for e in errors]
+        if attempt < MAX_DELETE_RETRIES:
+            print(f"Retrying {len(pending)} keys that failed to delete (attempt {attempt + 1})")
+            time.sleep(0.2 * 2 ** attempt)
+    return deleted, pending
+
+
+def purge_versions(s3, bucket_name, cutoff_date, concurrency=PURGE_CONCURRENCY, budget=None, start=None):
+    """
+    Delete every version and delete marker older than cutoff_date using
+    1000-key DeleteObjects batches, keeping up to `concurrency` batches in flight.
+
+    If `budget` (a TimeBudget) runs out, listing stops at a page boundary and
+    stats['resume_at'] holds the marker to pass back as `start` next time;
+    it is None once the whole bucket has been covered.
+    """
+    start = start or {}
+    stats = {'deleted': 0, 'failed': 0, 'batches': 0, 'resume_at': None}
+    failed_keys = []
+
+    def collect(done):
+        for future in done:
+            deleted, failed = future.result()
+            stats['deleted'] += deleted
+            stats['failed'] += len(failed)
+            failed_keys.extend(failed)
 
-    days_to_keep = 1 # Define the age threshold in days
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        batch = []
+
+        def submit(objects):
+            # Backpressure: never hold more than `concurrency` batches in memory
+            while len(in_flight) >= concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                in_flight.difference_update(done)
+                collect(done)
+            in_flight.add(pool.submit(delete_batch, s3, bucket_name, objects))
+            stats['batches'] += 1
+
+        pages = iter_expired_version_pages(
+            s3, bucket_name, cutoff_date,
+            start.get('key_marker'), start.get('version_id_marker')
+        )
+        for expired, next_marker in pages:
+            for entry in expired:
+                batch.append(entry)
+                if len(batch) == DELETE_BATCH_SIZE:
+                    submit(batch)
+                    batch = []
+            if next_marker and budget is not None and budget.exhausted():
+                # Everything up to next_marker is submitted; stop before the deadline
+                stats['resume_at'] = next_marker
+                break
+        if batch:
+            submit(batch)
+
+        done, _ = wait(in_flight)
+        collect(done)
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['keys_per_second'] = round(stats['deleted'] / elapsed, 1) if elapsed > 0 else 0.0
+    stats['failed_keys'] = failed_keys[:100]  # sample only; failures are also counted above
+    return stats
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    bucket_name = event.get('bucket_name', BUCKET_NAME)
+    days_to_keep = int(event.get('retention_days', RETENTION_DAYS))
+    concurrency = int(event.get('concurrency', PURGE_CONCURRENCY))
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_to_keep)
 
-    # For versioned buckets, delete old versions; else just delete old objects
-    for obj_version in bucket.object_versions.all():
-        if obj_version.last_modified < cutoff_date:
-            obj_version.delete()
+    s3 = get_client('s3')
+    checkpoint = checkpoint_from_env('s3-cleanup', bucket_name, s3=s3)
+    start = checkpoint.load()
+    print(f"Purging versions older than {days_to_keep} days from {bucket_name} "
+          f"(concurrency={concurrency}, resume_from={start or 'start'})")
+
+    # For versioned buckets this removes old versions and delete markers; for
+    # unversioned buckets every object is listed with VersionId 'null'.
+    stats = purge_versions(s3, bucket_name, cutoff_date, concurrency,
+                           budget=TimeBudget(context), start=start)
+
+    if stats['resume_at']:
+        checkpoint.save(**stats['resume_at'])
+    else:
+        checkpoint.complete()
+
+    print(f"Deleted {stats['deleted']} keys in {stats['batches']} batches "
+          f"({stats['keys_per_second']} keys/s), {stats['failed']} failed, "
+          f"{'incomplete' if stats['resume_at'] else 'complete'}")
+    get_executor().log_metrics()
 
-    return {'statusCode': 200, 'body': 'Old files deleted.'}
+    return {
+        'statusCode': 200 if not stats['failed'] else 207,
+        'body': 'Old files deleted.',
+        'bucket': bucket_name,
+        'complete': stats['resume_at'] is None,
+        **stats
+    }
@@ -1,22 +1,170 @@
-import boto3
+import os
+import time
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+from common.clients import get_client
+from common.executor import get_executor
+from common.state import state_store_from_uri
+
+AUDIT_CONCURRENCY = int(os.environ.get('AUDIT_CONCURRENCY', '16'))  # buckets checked at the same time
+
+# Bucket settings rarely change: results are kept in an index and only new
+# buckets or entries older than AUDIT_TTL_HOURS are queried again
+AUDIT_INDEX_URI = os.environ.get('AUDIT_INDEX_URI', '/tmp/s3-encryption-audit-index.json')  # or s3://bucket/key
+AUDIT_TTL_HOURS = float(os.environ.get('AUDIT_TTL_HOURS', '24'))
+
+PUBLIC_ACCESS_BLOCK_FLAGS = ['BlockPublicAcls', 'IgnorePublicAcls', 'BlockPublicPolicy', 'RestrictPublicBuckets']
+# Fields compared between runs to report what changed
+AUDITED_FIELDS = ['encrypted', 'algorithm', 'bucket_key_enabled', 'public_access_blocked']
+
+def bucket_region(bucket, s3, executor, cached=None):
+    """Region from ListBuckets when present, then the cached one, otherwise one GetBucketLocation call."""
+    if bucket.get('BucketRegion'):
+        return bucket['BucketRegion']
+    if cached:
+        return cached
+    location = executor.call('s3', s3.get_bucket_location, Bucket=bucket['Name']).get('LocationConstraint')
+    if location == 'EU':
+        return 'eu-west-1'
+    return location or 'us-east-1'
+
+
+def audit_bucket(bucket, s3, executor, cached_region=None):
+    """Encryption, bucket-key and public-access-block settings of one bucket."""
+    name = bucket['Name']
+    print(f"Checking bucket: {name}")  # Print all bucket names to console/logs
+    result = {'name': name}
+    try:
+        region = bucket_region(bucket, s3, executor, cached_region)
+        result['region'] = region
+        # One cached client per region, so calls are not redirected
+        regional = get_client('s3', region_name=region)
 
-def lambda_handler(event, context):
-    s3 = boto3.client('s3')
-    buckets = s3.list_buckets()["Buckets"]
-    unencrypted_buckets = []
-    print("Listing all buckets and checking encryption:")
-    for bucket in buckets:
-        name = bucket["Name"]
-        print(f"Checking bucket: {name}")  # Print all bucket names to console/logs
         try:
-            enc = s3.get_bucket_encryption(Bucket=name)
+            enc = executor.call('s3', regional.get_bucket_encryption, Bucket=name)
             # Check if encryption rules exist
             rules = enc["ServerSideEncryptionConfiguration"]["Rules"]
-            if not rules:
-                unencrypted_buckets.append(name)
-        except s3.exceptions.ClientError as e:
+            default = rules[0].get('ApplyServerSideEncryptionByDefault', {}) if rules else {}
+            result['encrypted'] = bool(rules)
+            result['algorithm'] = default.get('SSEAlgorithm')
+            result['bucket_key_enabled'] = bool(rules and rules[0].get('BucketKeyEnabled'))
+        except ClientError as e:
             # If encryption configuration is not found, treat as unencrypted
-            if e.response['Error']['Code'] == 'ServerSideEncryptionConfigurationNotFoundError':
-                unencrypted_buckets.append(name)
+            if e.response['Error']['Code'] != 'ServerSideEncryptionConfigurationNotFoundError':
+                raise
+            result.update(encrypted=False, algorithm=None, bucket_key_enabled=False)
+
+        try:
+            pab = executor.call('s3', regional.get_public_access_block, Bucket=name)['PublicAccessBlockConfiguration']
+            result['public_access_blocked'] = all(pab.get(flag) for flag in PUBLIC_ACCESS_BLOCK_FLAGS)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchPublicAccessBlockConfiguration':
+                raise
+            result['public_access_blocked'] = False
+
+    except ClientError as e:
+        result['error'] = e.response['Error']['Code']
+        print(f"Could not audit {name}: {e}")
+    except Exception as e:
+        # e.g. a connection error or an unexpected response; one bucket must not abort the audit
+        result['error'] = type(e).__name__
+        print(f"Could not audit {name}: {e!r}")
+    return result
+
+
+def needs_check(name, index, now, ttl):
+    entry = index.get(name)
+    if entry is None or 'error' in entry:
+        return True
+    return now - datetime.fromisoformat(entry['checked_at']) >= ttl
+
+
+def cached_region(name, index, now, ttl):
+    """The region recorded by the last good check, while it is within the TTL."""
+    entry = index.get(name)
+    if entry and entry.get('region') and now - datetime.fromisoformat(entry['checked_at']) < ttl:
+        return entry['region']
+    return None
+
+
+def diff_index(previous, current):
+    """New, removed and changed buckets between two index snapshots."""
+    changed = {}
+    for name in previous.keys() & current.keys():
+        before, after = previous[name], current[name]
+        fields = {f: [before.get(f), after.get(f)] for f in AUDITED_FIELDS if before.get(f) != after.get(f)}
+        if fields:
+            changed[name] = fields
+    return {
+        'new': sorted(current.keys() - previous.keys()),
+        'removed': sorted(previous.keys() - current.keys()),
+        'changed': changed
+    }
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    s3 = get_client('s3')
+    buckets = s3.list_buckets()["Buckets"]
+    # Every S3 call goes through the shared executor, which backs off the
+    # whole pool when S3 answers SlowDown
+    executor = get_executor()
+
+    store = state_store_from_uri(AUDIT_INDEX_URI, s3=s3)
+    previous = (store.load() or {}).get('buckets', {})
+    now = datetime.now(timezone.utc)
+    ttl = timedelta(hours=float(event.get('ttl_hours', AUDIT_TTL_HOURS)))
+    full_scan = bool(event.get('full_scan'))
+    to_check = [b for b in buckets if full_scan or needs_check(b['Name'], previous, now, ttl)]
+    print(f"Listing all buckets and checking encryption ({len(to_check)} of {len(buckets)} buckets due, "
+          f"{AUDIT_CONCURRENCY} workers):")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=AUDIT_CONCURRENCY) as pool:
+        fresh = list(pool.map(
+            lambda bucket: audit_bucket(bucket, s3, executor, cached_region(bucket['Name'], previous, now, ttl)),
+            to_check))
+    elapsed = time.monotonic() - started
+
+    # New index: fresh results, cached entries for the rest, deleted buckets dropped.
+    # A failed check keeps the last good entry and is retried on the next run.
+    index = {b['Name']: previous[b['Name']] for b in buckets if b['Name'] in previous}
+    for result in fresh:
+        if 'error' in result and result['name'] in index:
+            index[result['name']] = {**index[result['name']], 'error': result['error']}
+        else:
+            index[result['name']] = {**result, 'checked_at': now.isoformat()}
+    store.save({'buckets': index, 'updated_at': now.isoformat()})
+    diff = diff_index({k: v for k, v in previous.items() if 'encrypted' in v},
+                      {k: v for k, v in index.items() if 'encrypted' in v})
+
+    results = list(index.values())
+    audited = [r for r in results if 'encrypted' in r]
+    unencrypted_buckets = [r['name'] for r in audited if not r['encrypted']]
+    # Bucket keys only matter for SSE-KMS, where they cut KMS request costs
+    bucket_key_disabled = [r['name'] for r in audited
+                           if r['algorithm'] in ('aws:kms', 'aws:kms:dsse') and not r['bucket_key_enabled']]
+    public_access_not_blocked = [r['name'] for r in audited if not r['public_access_blocked']]
+    errors = {r['name']: r['error'] for r in results if 'error' in r}
+
     print("Buckets without server-side encryption:", unencrypted_buckets)
-    return {'unencrypted_buckets': unencrypted_buckets}
+    print("SSE-KMS buckets without S3 Bucket Keys:", bucket_key_disabled)
+    print("Buckets without a full public access block:", public_access_not_blocked)
+    print(f"Changes since last run: {len(diff['new'])} new, {len(diff['removed'])} removed, "
+          f"{len(diff['changed'])} changed")
+    for name, fields in diff['changed'].items():
+        print(f" - {name}: {fields}")
+    print(f"Checked {len(fresh)} buckets in {elapsed:.1f}s, {len(buckets) - len(fresh)} from the index "
+          f"({executor.metrics().get('s3', {}).get('throttled', 0)} throttled calls)")
+    return {
+        'unencrypted_buckets': unencrypted_buckets,
+        'bucket_key_disabled': bucket_key_disabled,
+        'public_access_not_blocked': public_access_not_blocked,
+        'errors': errors,
+        'checked_buckets': len(fresh),
+        'cached_buckets': len(buckets) - len(fresh),
+        'changes': diff,
+        'buckets': results
+    }
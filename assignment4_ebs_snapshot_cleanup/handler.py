@@ -1,40 +1,237 @@
-import boto3
 import datetime
+import json
+import os
+from botocore.exceptions import ClientError
+from concurrent.futures import as_completed
+
+from common.checkpoint import TimeBudget, checkpoint_from_env
+from common.clients import get_client
+from common.executor import AwsExecutor
+
+RETENTION_DAYS = 30  # Snapshots older than this will be deleted (untagged volumes passed in the event)
+
+# Volumes tagged POLICY_TAG_KEY=<policy name> are snapshotted and pruned by that policy.
+# A policy keeps the newest snapshot of each of the last N days, ISO weeks and months.
+POLICY_TAG_KEY = os.environ.get('POLICY_TAG_KEY', 'SnapshotPolicy')
+RETENTION_POLICIES = json.loads(os.environ.get(
+    'RETENTION_POLICIES',
+    '{"default": {"daily": 7, "weekly": 4, "monthly": 6}}'
+))
+API_CALLS_PER_SECOND = float(os.environ.get('API_CALLS_PER_SECOND', '5'))  # create/delete request rate
+API_CONCURRENCY = int(os.environ.get('API_CONCURRENCY', '8'))
+VOLUME_BATCH_SIZE = int(os.environ.get('VOLUME_BATCH_SIZE', '50'))  # volumes handled between time checks
+
+# Only snapshots this function took are ever deleted: tagged CreatedBy=ebs-snapshot-retention,
+# or (taken before the tag existed) described "Automated snapshot of volume ..."
+CREATED_BY = 'ebs-snapshot-retention'
+DESCRIPTION_PREFIX = 'Automated snapshot of volume'
+
+
+def managed_volumes(volume_id=None):
+    """{volume_id: policy name} for every volume carrying the policy tag (or just volume_id)."""
+    paginator = get_client('ec2').get_paginator('describe_volumes')
+    if volume_id:
+        pages = paginator.paginate(VolumeIds=[volume_id])
+    else:
+        pages = paginator.paginate(Filters=[{'Name': 'tag-key', 'Values': [POLICY_TAG_KEY]}])
+    volumes = {}
+    for page in pages:
+        for volume in page['Volumes']:
+            tags = {t['Key']: t['Value'] for t in volume.get('Tags', [])}
+            volumes[volume['VolumeId']] = tags.get(POLICY_TAG_KEY)
+    return volumes
+
+
+def is_managed(snap):
+    """Taken by this function (manual, DLM and AWS Backup snapshots are left alone)."""
+    tags = {t['Key']: t['Value'] for t in snap.get('Tags', [])}
+    return tags.get('CreatedBy') == CREATED_BY or snap.get('Description', '').startswith(DESCRIPTION_PREFIX)
+
+
+def snapshots_by_volume(volume_ids):
+    """One paginated describe_snapshots sweep of this function's snapshots, grouped by volume in memory."""
+    grouped = {volume_id: [] for volume_id in volume_ids}
+    paginator = get_client('ec2').get_paginator('describe_snapshots')
+    for page in paginator.paginate(OwnerIds=['self']):
+        for snap in page['Snapshots']:
+            if snap.get('VolumeId') in grouped and is_managed(snap):
+                grouped[snap['VolumeId']].append(snap)
+    return grouped
+
+
+def resolve_policy(name):
+    """The volume's retention policy, or None when it names none that exists (the volume is skipped)."""
+    if name is None:
+        # Volume passed explicitly without a policy tag: delete snapshots older than RETENTION_DAYS
+        return {'max_age_days': RETENTION_DAYS}
+    if name not in RETENTION_POLICIES:
+        if 'default' not in RETENTION_POLICIES:
+            print(f"Unknown retention policy '{name}' and no 'default' policy")
+            return None
+        print(f"Unknown retention policy '{name}'; using 'default'")
+        name = 'default'
+    return RETENTION_POLICIES[name]
+
+
+def select_snapshots_to_keep(snapshots, policy):
+    """
+    Grandfather-father-son selection: the newest snapshot of each of the last
+    `daily` days, `weekly` ISO weeks and `monthly` months is kept. A
+    {'max_age_days': N} policy keeps every snapshot younger than N days.
+    """
+    if 'max_age_days' in policy:
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=policy['max_age_days'])
+        return {s['SnapshotId'] for s in snapshots if s['StartTime'] >= cutoff or s.get('State') == 'pending'}
+    periods = {
+        'daily': lambda t: t.date(),
+        'weekly': lambda t: t.isocalendar()[:2],
+        'monthly': lambda t: (t.year, t.month),
+    }
+    newest_first = sorted(snapshots, key=lambda s: s['StartTime'], reverse=True)
+    keep = set()
+    for period, count in policy.items():
+        if period not in periods or not count:
+            continue
+        seen = set()
+        for snap in newest_first:
+            bucket = periods[period](snap['StartTime'])
+            if bucket in seen:
+                continue
+            seen.add(bucket)
+            if len(seen) > count:
+                break
+            keep.add(snap['SnapshotId'])
+    # Never touch snapshots that are still being taken
+    keep.update(s['SnapshotId'] for s in snapshots if s.get('State') == 'pending')
+    return keep
+
+
+def delete_snapshots(executor, snapshots):
+    """Submit every delete at once; the executor applies the rate limit. Returns (deleted, failed)."""
+    ec2 = get_client('ec2')
+    futures = {executor.submit('ec2', ec2.delete_snapshot, SnapshotId=snap['SnapshotId']): snap
+               for snap in snapshots}
+    deleted = failed = 0
+    for future in as_completed(futures):
+        snap = futures[future]
+        try:
+            future.result()
+            deleted += 1
+            print(f"Deleted snapshot {snap['SnapshotId']} created on {snap['StartTime']}")
+        except ClientError as e:
+            # e.g. InvalidSnapshot.InUse when an AMI still references it
+            failed += 1
+            print(f"Could not delete {snap['SnapshotId']}: {e}")
+    return deleted, failed
+
+
+def create_snapshots(executor, volumes):
+    """One create_snapshot per volume, tagged with its policy. Returns the new snapshot ids."""
+    ec2 = get_client('ec2')
+    futures = {}
+    for volume_id, policy_name in volumes.items():
+        tags = [{'Key': 'CreatedBy', 'Value': 'ebs-snapshot-retention'}]
+        if policy_name:
+            tags.append({'Key': POLICY_TAG_KEY, 'Value': policy_name})
+        future = executor.submit(
+            'ec2', ec2.create_snapshot,
+            VolumeId=volume_id,
+            Description=f"Automated snapshot of volume {volume_id} on {datetime.datetime.now()}",
+            TagSpecifications=[{'ResourceType': 'snapshot', 'Tags': tags}]
+        )
+        futures[future] = volume_id
+    created = []
+    for future in as_completed(futures):
+        volume_id = futures[future]
+        try:
+            snapshot_id = future.result()['SnapshotId']
+            created.append(snapshot_id)
+            print(f"Created snapshot {snapshot_id} for volume {volume_id}")
+        except ClientError as e:
+            print(f"Could not snapshot {volume_id}: {e}")
+    return created
+
+
+def apply_retention(executor, volumes, snapshots):
+    """Delete the snapshots outside each volume's policy, then snapshot every volume. Returns the counts."""
+    to_delete = []
+    for vol, policy_name in volumes.items():
+        to_delete.extend(s for s in snapshots[vol] if s['SnapshotId'] not in select_snapshots_to_keep(
+            snapshots[vol], resolve_policy(policy_name)))
+    # Delete snapshots outside the retention window first
+    deleted, failed = delete_snapshots(executor, to_delete)
+    # Now create a new snapshot for every volume
+    created_ids = create_snapshots(executor, volumes)
+    return {'deleted': deleted, 'failed': failed, 'created': created_ids}
 
-ec2 = boto3.client('ec2')
-RETENTION_DAYS = 30  # Snapshots older than this will be deleted
 
 def lambda_handler(event, context):
-    volume_id = event.get('volume_id')  # Get volume_id from event
-    if not volume_id:
-        volume_id = 'vol-02fe99c007fbf9cf3'  # Replace with your actual volume ID
-        print(f"No volume_id in event; using fallback: {volume_id}")
-
-    # Calculate cutoff date for deletion
-    delete_date = datetime.datetime.now() - datetime.timedelta(days=RETENTION_DAYS)
-
-    # List all snapshots for the volume owned by self
-    snapshots = ec2.describe_snapshots(
-        Filters=[{'Name': 'volume-id', 'Values': [volume_id]}],
-        OwnerIds=['self']
-    )['Snapshots']
-
-    # Delete snapshots older than retention period first
-    for snap in snapshots:
-        start_time = snap['StartTime'].replace(tzinfo=None)  # naive datetime
-        if start_time < delete_date:
-            snap_id = snap['SnapshotId']
-            ec2.delete_snapshot(SnapshotId=snap_id)
-            print(f"Deleted snapshot {snap_id} created on {start_time}")
-
-    # Now create a new snapshot for the volume
-    snapshot = ec2.create_snapshot(
-        VolumeId=volume_id,
-        Description=f"Automated snapshot of volume {volume_id} on {datetime.datetime.now()}"
-    )
-    print(f"Created snapshot {snapshot['SnapshotId']} for volume {volume_id}")
-
-    return {
-        'created_snapshot': snapshot['SnapshotId'],
-        'message': f"Snapshots older than {RETENTION_DAYS} days deleted for volume {volume_id}"
+    event = event or {}
+    volume_id = event.get('volume_id')  # optional: limit the run to one volume
+    dry_run = bool(event.get('dry_run'))
+
+    try:
+        volumes = managed_volumes(volume_id)
+    except ClientError as e:
+        # e.g. InvalidVolume.NotFound for a mistyped volume_id
+        print(f"Could not describe volumes: {e}")
+        return {'error': e.response['Error']['Code'], 'volume_id': volume_id, 'message': str(e)}
+    for vol, policy_name in list(volumes.items()):
+        if resolve_policy(policy_name) is None:
+            print(f"Skipping {vol}: no retention policy '{policy_name}'")
+            del volumes[vol]
+    snapshots = snapshots_by_volume(volumes)
+    print(f"Managing {len(volumes)} volumes with {sum(len(s) for s in snapshots.values())} snapshots")
+
+    if dry_run:
+        would_delete = [s['SnapshotId'] for vol, policy_name in volumes.items() for s in snapshots[vol]
+                        if s['SnapshotId'] not in select_snapshots_to_keep(snapshots[vol], resolve_policy(policy_name))]
+        print(f"{len(would_delete)} snapshots fall outside their retention policy")
+        return {
+            'dry_run': True,
+            'volumes': len(volumes),
+            'would_delete': would_delete
+        }
+
+    # A fleet sweep goes through the volumes in id order in batches, and stops
+    # between batches when time runs out; the next run carries on after the last one done
+    checkpoint = None if volume_id else checkpoint_from_env('ebs-snapshot-retention', POLICY_TAG_KEY)
+    after = (checkpoint.load() if checkpoint else {}).get('after_volume')
+    if after:
+        print(f"Resuming after volume {after}")
+    order = sorted(v for v in volumes if not after or v > after)
+    budget = TimeBudget(context)
+
+    # Rate-limited, throttle-aware executor for the EC2 write calls
+    executor = AwsExecutor(max_concurrency=API_CONCURRENCY, rates={'ec2': API_CALLS_PER_SECOND})
+    totals = {'deleted': 0, 'failed': 0, 'created': []}
+    done = 0
+    try:
+        while done < len(order) and not budget.exhausted():
+            batch = order[done:done + VOLUME_BATCH_SIZE]
+            counts = apply_retention(executor, {v: volumes[v] for v in batch}, snapshots)
+            for key in totals:
+                totals[key] += counts[key]
+            done += len(batch)
+    finally:
+        executor.shutdown()
+    executor.log_metrics()
+    if checkpoint:
+        if done < len(order):
+            checkpoint.save(after_volume=order[done - 1] if done else after)
+        else:
+            checkpoint.complete()
+
+    created_ids = totals['created']
+    result = {
+        'volumes': done,
+        'complete': done == len(order),
+        'created_snapshots': created_ids,
+        'deleted_snapshots': totals['deleted'],
+        'failed_deletes': totals['failed'],
+        'failed_creates': done - len(created_ids),
+        'message': f"Retention policies applied to {done} of {len(order)} volumes"
     }
+    if volume_id and created_ids:
+        result['created_snapshot'] = created_ids[0]
+    return result
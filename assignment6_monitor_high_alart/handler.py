@@ -1,32 +1,277 @@
-import boto3
+import calendar
+import copy
 import datetime
 import os
 import logging
 from botocore.exceptions import BotoCoreError, ClientError
 
+from common.anomaly import AnomalyDetector
+from common.clients import get_client
+from common.executor import get_executor
+from common.notify import get_notifier
+from common.state import state_store_from_uri
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize Boto3 clients
-# NOTE: Billing metrics are always in 'us-east-1'
-cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
-sns = boto3.client('sns')
-
 # Environment variables
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')  # e.g., arn:aws:sns:eu-west-2:123456789012:aws-billing-alerts
 COST_THRESHOLD = float(os.environ.get('COST_THRESHOLD', 50.0))  # Default to $50 if not set
 
+# Billing analysis mode ({"mode": "analysis"} or BILLING_MODE=analysis)
+BILLING_MODE = os.environ.get('BILLING_MODE', 'threshold')
+COST_TAG_KEYS = [x.strip() for x in os.environ.get('COST_TAG_KEYS', '').split(',') if x.strip()]  # e.g. team,project
+COST_ROLLUP_URI = os.environ.get('COST_ROLLUP_URI', '/tmp/cost-rollup.json')  # or s3://bucket/key
+COST_HISTORY_DAYS = int(os.environ.get('COST_HISTORY_DAYS', '90'))
+COST_REFRESH_DAYS = int(os.environ.get('COST_REFRESH_DAYS', '3'))  # recent days re-fetched; Cost Explorer revises them
+MONTHLY_BUDGET = float(os.environ.get('MONTHLY_BUDGET', COST_THRESHOLD))
+COST_ANOMALY_MIN_USD = float(os.environ.get('COST_ANOMALY_MIN_USD', '5'))  # smaller daily increases never alert
+COST_ANOMALY_MIN_DAYS = 14  # history a series needs before it can alert
+TOP_N = 5
+
+
+class CostExplorerSource:
+    """Daily unblended cost per SERVICE or per tag value from Cost Explorer."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def daily_costs(self, start, end, dimension):
+        """{'YYYY-MM-DD': {group: USD}} for start <= day < end; dimension is 'SERVICE' or 'TAG:<key>'."""
+        if dimension.startswith('TAG:'):
+            group_by = {'Type': 'TAG', 'Key': dimension[4:]}
+        else:
+            group_by = {'Type': 'DIMENSION', 'Key': dimension}
+        ce = get_client('ce', region_name='us-east-1')  # Cost Explorer's only endpoint
+        kwargs = {'TimePeriod': {'Start': start.isoformat(), 'End': end.isoformat()}, 'Granularity': 'DAILY',
+                  'Metrics': ['UnblendedCost'], 'GroupBy': [group_by]}
+        days = {}
+        while True:
+            response = get_executor().call('ce', ce.get_cost_and_usage, **kwargs)
+            self.calls += 1
+            for period in response['ResultsByTime']:
+                groups = days.setdefault(period['TimePeriod']['Start'], {})
+                for group in period.get('Groups', []):
+                    key = group['Keys'][0]
+                    if group_by['Type'] == 'TAG':
+                        key = key.split('$', 1)[-1] or '(untagged)'  # 'team$backend' -> 'backend'
+                    amount = float(group['Metrics']['UnblendedCost']['Amount'])
+                    groups[key] = groups.get(key, 0.0) + amount
+            if not response.get('NextPageToken'):
+                return days
+            kwargs['NextPageToken'] = response['NextPageToken']
+
+
+def cost_source():
+    return CostExplorerSource()
+
+
+def update_rollup(rollup, source, today, dimensions):
+    """
+    Fetch only the days the rollup does not have yet (plus the last
+    COST_REFRESH_DAYS, which Cost Explorer still revises) and drop days older
+    than COST_HISTORY_DAYS. Returns the number of days fetched per dimension.
+    """
+    first = today - datetime.timedelta(days=COST_HISTORY_DAYS)
+    fetched = {}
+    for dimension in dimensions:
+        days = rollup.setdefault(dimension, {})
+        latest = max(days) if days else None
+        start = first
+        if latest:
+            start = max(first, datetime.date.fromisoformat(latest) - datetime.timedelta(days=COST_REFRESH_DAYS - 1))
+        if start < today:
+            days.update(source.daily_costs(start, today, dimension))  # today is still accruing, so it is excluded
+        for day in [d for d in days if d < first.isoformat()]:
+            del days[day]
+        fetched[dimension] = max(0, (today - start).days)
+    return fetched
+
+
+def cost_detector(state):
+    """Per-group daily cost baselines (weekday and weekend buckets) over a persisted state dict."""
+    return AnomalyDetector(state, min_samples=COST_ANOMALY_MIN_DAYS, min_scale=0.05, log_values=True)
+
+
+def fold_days(detector, days, groups, day_list, last_day=None):
+    """
+    Feed day_list through the detector; returns the anomalous results on
+    last_day by group. Without last_day the days are being settled into the
+    persisted baselines, and a sustained rise resets once it has alerted.
+    """
+    findings = {}
+    for day in day_list:
+        date = datetime.date.fromisoformat(day)
+        for group in groups:
+            # Weekday and weekend spend get separate baselines
+            result = detector.update(group, 'weekend' if date.weekday() >= 5 else 'weekday',
+                                     days[day].get(group, 0.0), date.toordinal())
+            if day == last_day and result and result['anomalous']:
+                findings[group] = result
+            elif last_day is None and result and result['reason'] == 'sustained':
+                # Reported while the day was recent; start the next rise from zero
+                detector.reset_cusum(group)
+    return findings
+
+
+def detect_cost_anomalies(days, dimension, last_day, state, settled_through):
+    """
+    Anomalies on last_day with their excess in USD. Days up to settled_through
+    (older than the ones Cost Explorer still revises) are folded into the
+    persisted baselines in state once; the unsettled tail is scored on a copy,
+    so each run only replays the last few days.
+    """
+    groups = sorted({g for costs in days.values() for g in costs})
+    detector = cost_detector(state.setdefault('baselines', {}))
+    through = state.get('through', '')
+    settled = [d for d in sorted(days) if through < d <= settled_through]
+    fold_days(detector, days, groups, settled)
+    if settled:
+        state['through'] = settled[-1]
+    tail = [d for d in sorted(days) if d > state.get('through', '')]
+    findings = fold_days(cost_detector(copy.deepcopy(detector.state)), days, groups, tail, last_day)
+
+    anomalies = []
+    for group, finding in findings.items():
+        value = days[last_day].get(group, 0.0)
+        excess = value - finding['baseline']
+        if excess >= COST_ANOMALY_MIN_USD:
+            anomalies.append({'dimension': dimension, 'group': group, 'day': last_day,
+                              'cost': round(value, 2), 'baseline': finding['baseline'],
+                              'excess': round(excess, 2), 'reason': finding['reason']})
+    return sorted(anomalies, key=lambda a: -a['excess'])
+
+
+def month_end_projection(days, today):
+    """
+    (month to date, projected month end, daily rate) for the month `today` is
+    in: the complete days so far plus the rest of the month at the average
+    daily rate of the last 7 days. On the 1st no day of the new month is
+    complete, so month to date is 0 and the whole month is projected.
+    """
+    month_prefix = today.isoformat()[:7]
+    month_to_date = sum(sum(costs.values()) for day, costs in days.items() if day.startswith(month_prefix))
+    recent = [sum(days[d].values()) for d in sorted(days)[-7:]]
+    daily_rate = sum(recent) / len(recent) if recent else 0.0
+    # First day of the month not yet in the rollup (today, unless Cost Explorer lags behind)
+    next_day = max(datetime.date.fromisoformat(max(days)) + datetime.timedelta(days=1), today.replace(day=1))
+    remaining = calendar.monthrange(today.year, today.month)[1] - next_day.day + 1
+    return round(month_to_date, 2), round(month_to_date + remaining * daily_rate, 2), round(daily_rate, 2)
+
+
+def top_groups(days, month_prefix, n=TOP_N):
+    totals = {}
+    for day, costs in days.items():
+        if day.startswith(month_prefix):
+            for group, amount in costs.items():
+                totals[group] = totals.get(group, 0.0) + amount
+    return [{'name': g, 'month_to_date': round(v, 2)} for g, v in sorted(totals.items(), key=lambda x: -x[1])[:n]]
+
+
+def analyze_billing(source=None, today=None, store=None):
+    """
+    Billing analysis: per-service and per-tag daily costs from the incremental
+    rollup, spend anomalies on the latest complete day and a month-end
+    projection against MONTHLY_BUDGET.
+    """
+    source = source or cost_source()
+    today = today or datetime.datetime.utcnow().date()
+    store = store or state_store_from_uri(COST_ROLLUP_URI)
+    dimensions = ['SERVICE'] + [f"TAG:{key}" for key in COST_TAG_KEYS]
+    state = store.load() or {}
+    if 'rollup' not in state:
+        state = {'rollup': state, 'detectors': {}}  # rollup saved before detector state was kept with it
+    rollup, detectors = state['rollup'], state['detectors']
+    fetched = update_rollup(rollup, source, today, dimensions)
+
+    services = rollup['SERVICE']
+    if not services:
+        store.save(state)
+        return {'mode': 'analysis', 'status': 'no_data'}
+    last_day = max(services)
+    month = today.isoformat()[:7]
+    month_to_date, projected, daily_rate = month_end_projection(services, today)
+    settled_through = (today - datetime.timedelta(days=COST_REFRESH_DAYS + 1)).isoformat()
+    anomalies = []
+    for dimension in dimensions:
+        anomalies += detect_cost_anomalies(rollup[dimension], dimension, last_day,
+                                           detectors.setdefault(dimension, {}), settled_through)
+    store.save(state)
+    result = {
+        'mode': 'analysis',
+        'month': month,
+        'through': last_day,
+        'month_to_date': month_to_date,
+        'projected_month_end': projected,
+        'daily_rate': daily_rate,
+        'budget': MONTHLY_BUDGET,
+        'over_budget': projected > MONTHLY_BUDGET,
+        'top_services': top_groups(services, month),
+        'top_tags': {d[4:]: top_groups(rollup[d], month) for d in dimensions[1:]},
+        'anomalies': anomalies,
+        'days_fetched': fetched,
+        'api_calls': source.calls,
+    }
+    if today.day == 1:
+        # The month that just ended is complete (until Cost Explorer's last revisions)
+        closed = last_day[:7]
+        result['closed_month'] = {
+            'month': closed,
+            'total': round(sum(sum(c.values()) for d, c in services.items() if d.startswith(closed)), 2),
+            'top_services': top_groups(services, closed),
+        }
+    logger.info(f"Billing through {last_day}: month to date ${month_to_date:.2f}, projected ${projected:.2f} "
+                f"(budget ${MONTHLY_BUDGET:.2f}), {len(anomalies)} anomalies, {source.calls} cost queries")
+    return result
+
+
+def notify_billing_analysis(result):
+    notifier = get_notifier(SNS_TOPIC_ARN)
+    if result['over_budget']:
+        top = ', '.join(f"{s['name']} ${s['month_to_date']:.2f}" for s in result['top_services'])
+        notifier.add(
+            f"billing-projection:{result['month']}",
+            "🚨 AWS spend projected over budget",
+            f"Projected month-end spend is ${result['projected_month_end']:.2f}, over the budget of "
+            f"${result['budget']:.2f}.\nMonth to date: ${result['month_to_date']:.2f} through {result['through']} "
+            f"(${result['daily_rate']:.2f}/day recently).\nTop services: {top}\n",
+            group="AWS billing alerts"
+        )
+    for a in result['anomalies']:
+        notifier.add(
+            f"billing-anomaly:{a['dimension']}:{a['group']}:{a['day']}",
+            f"🚨 Spend anomaly: {a['group']}",
+            f"{a['dimension']} {a['group']} cost ${a['cost']:.2f} on {a['day']}, ${a['excess']:.2f} above its "
+            f"usual ${a['baseline']:.2f}/day ({a['reason']}).\n",
+            group="AWS billing alerts"
+        )
+    return notifier.flush()
+
 
 def lambda_handler(event, context):
     """Check AWS billing and send SNS alert if cost exceeds threshold."""
+    event = event or {}
+    if event.get('mode', BILLING_MODE) == 'analysis':
+        try:
+            result = analyze_billing()
+            if SNS_TOPIC_ARN and (result.get('over_budget') or result.get('anomalies')):
+                notify_billing_analysis(result)
+            return {"statusCode": 200, **result}
+        except (BotoCoreError, ClientError) as e:
+            logger.error(f"AWS API error: {e}")
+            return {"statusCode": 500, "error": str(e)}
+
     try:
         end_time = datetime.datetime.utcnow()
         start_time = end_time - datetime.timedelta(days=1)
 
         logger.info(f"Checking billing data from {start_time} to {end_time}...")
 
-        response = cloudwatch.get_metric_statistics(
+        # NOTE: Billing metrics are always in 'us-east-1'
+        cloudwatch = get_client('cloudwatch', region_name='us-east-1')
+        response = get_executor().call(
+            'cloudwatch', cloudwatch.get_metric_statistics,
             Namespace='AWS/Billing',
             MetricName='EstimatedCharges',
             Dimensions=[{'Name': 'Currency', 'Value': 'USD'}],
@@ -55,12 +300,10 @@ def lambda_handler(event, context):
             )
 
             if SNS_TOPIC_ARN:
-                sns.publish(
-                    TopicArn=SNS_TOPIC_ARN,
-                    Subject="🚨 AWS Billing Alert",
-                    Message=message
-                )
-                logger.info(f"SNS alert sent successfully to topic: {SNS_TOPIC_ARN}")
+                # Repeats within the suppression window (e.g. an hourly schedule) are not re-sent
+                stats = get_notifier(SNS_TOPIC_ARN).publish('billing-threshold', "🚨 AWS Billing Alert", message)
+                logger.info(f"SNS alert to topic {SNS_TOPIC_ARN}: {stats['sent']} sent, "
+                            f"{stats['suppressed']} suppressed")
             else:
                 logger.error("SNS_TOPIC_ARN is not set. Cannot send notification.")
 
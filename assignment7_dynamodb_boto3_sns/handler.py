@@ -1,87 +1,144 @@
 import json
-import boto3
 import os
 from datetime import datetime
 
-sns = boto3.client('sns')
+from common.dynamodb import diff_images, filter_changes
+from common.notify import get_notifier
 
 # Hardcode SNS topic ARN for local testing (only for test — remove later)
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN", "arn:aws:sns:eu-west-2:975050024946:dynamodb-update-alerts-adish")
+LOG_EVENT_MAX_BYTES = int(os.environ.get("LOG_EVENT_MAX_BYTES", "4096"))  # larger batches are logged as a summary
+# Comma-separated attribute paths, e.g. "Status,Profile.address"; empty = every attribute
+WATCHED_FIELDS = [x.strip() for x in os.environ.get("WATCHED_FIELDS", "").split(",") if x.strip()]
+IGNORED_FIELDS = [x.strip() for x in os.environ.get("IGNORED_FIELDS", "").split(",") if x.strip()]  # e.g. "UpdatedAt"
+
+# Sample DynamoDB MODIFY event
+SAMPLE_EVENT = {
+    "Records": [
+        {
+            "eventID": "1",
+            "eventName": "MODIFY",
+            "eventVersion": "1.1",
+            "eventSource": "aws:dynamodb",
+            "awsRegion": "eu-west-2",
+            "dynamodb": {
+                "Keys": {"UserId": {"S": "101"}},
+                "OldImage": {
+                    "UserId": {"S": "101"},
+                    "Status": {"S": "Pending"},
+                    "Score": {"N": "80"}
+                },
+                "NewImage": {
+                    "UserId": {"S": "101"},
+                    "Status": {"S": "Approved"},
+                    "Score": {"N": "90"}
+                },
+                "StreamViewType": "NEW_AND_OLD_IMAGES",
+                "SequenceNumber": "111",
+                "SizeBytes": 26
+            },
+            "eventSourceARN": "arn:aws:dynamodb:eu-west-2:123456789012:table/MyDynamoDBTable/stream/2025-10-19T10:00:00.000"
+        }
+    ]
+}
+
+
+def format_change(kind, path, old, new):
+    if kind == 'added':
+        return f"{path}: added '{new}'"
+    if kind == 'removed':
+        return f"{path}: removed (was '{old}')"
+    return f"{path}: '{old}' → '{new}'"
+
+
+def build_notification(record, now):
+    """
+    (fingerprint, subject, message, group) for a MODIFY record, None for other
+    event types and for updates without a change to a watched field.
+    """
+    event_name = record['eventName']  # INSERT, MODIFY, REMOVE
+    if event_name != 'MODIFY':
+        return None
+    table_name = record['eventSourceARN'].split('/')[1]
+    stream = record['dynamodb']
+    # Only attributes whose DynamoDB JSON differs are decoded, then diffed down to nested paths
+    changes = filter_changes(diff_images(stream.get('OldImage', {}), stream.get('NewImage', {})),
+                             WATCHED_FIELDS, IGNORED_FIELDS)
+    if not changes:
+        return None
+    changes = [format_change(*change) for change in changes]
+
+    message = (
+        f"🔔 *DynamoDB Item Updated Alert*\n"
+        f"Table: {table_name}\n"
+        f"Time: {now}\n\n"
+        f"Changes:\n" + "\n".join(changes)
+    )
+    # The fingerprint is the stream record itself, so only a redelivered record is sent once: the same
+    # change made again is a new record and is sent. Many updates to one table in a batch are merged into a digest
+    return (
+        f"dynamodb:{table_name}:{record.get('eventID') or stream['SequenceNumber']}",
+        f"🔔 DynamoDB Update in {table_name}",
+        message,
+        f"🔔 DynamoDB updates in {table_name}",
+    )
+
+
+def log_event(records):
+    """The full event for small batches; counts only for large ones (serialising them costs more than the work)."""
+    size = sum(r.get('dynamodb', {}).get('SizeBytes', 0) for r in records)
+    if size <= LOG_EVENT_MAX_BYTES:
+        print("Received event:", json.dumps({"Records": records}))
+        return
+    counts = {}
+    for record in records:
+        counts[record.get('eventName')] = counts.get(record.get('eventName'), 0) + 1
+    print(f"Received {len(records)} records ({size} bytes of images): {counts}")
+
 
 def lambda_handler(event=None, context=None):
-    # Sample DynamoDB MODIFY event
+    """
+    Alert on MODIFY records of a DynamoDB stream batch. Notifications are
+    sent concurrently through the shared notifier, and only the records whose
+    notification failed are returned in batchItemFailures (configure the event
+    source mapping with ReportBatchItemFailures) so the rest are not replayed.
+    """
     if event is None or 'Records' not in event:
-        event = {
-            "Records": [
-                {
-                    "eventID": "1",
-                    "eventName": "MODIFY",
-                    "eventVersion": "1.1",
-                    "eventSource": "aws:dynamodb",
-                    "awsRegion": "eu-west-2",
-                    "dynamodb": {
-                        "Keys": {"UserId": {"S": "101"}},
-                        "OldImage": {
-                            "UserId": {"S": "101"},
-                            "Status": {"S": "Pending"},
-                            "Score": {"N": "80"}
-                        },
-                        "NewImage": {
-                            "UserId": {"S": "101"},
-                            "Status": {"S": "Approved"},
-                            "Score": {"N": "90"}
-                        },
-                        "StreamViewType": "NEW_AND_OLD_IMAGES",
-                        "SequenceNumber": "111",
-                        "SizeBytes": 26
-                    },
-                    "eventSourceARN": "arn:aws:dynamodb:eu-west-2:123456789012:table/MyDynamoDBTable/stream/2025-10-19T10:00:00.000"
-                }
-            ]
-        }
+        event = SAMPLE_EVENT
+    records = event['Records']
+    log_event(records)
+
+    notifier = get_notifier(SNS_TOPIC_ARN)
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
+    failed = []  # sequence numbers to retry
+    by_fingerprint = {}
+    ignored = 0
+    for record in records:
+        sequence_number = record.get('dynamodb', {}).get('SequenceNumber')
+        try:
+            notification = build_notification(record, now)
+        except (KeyError, IndexError, AttributeError, TypeError, ValueError) as e:
+            print(f"Could not process record {sequence_number}: {e!r}")
+            failed.append(sequence_number)
+            continue
+        if notification is None:
+            ignored += 1
+            continue
+        fingerprint, subject, message, group = notification
+        notifier.add(fingerprint, subject, message, group=group)
+        by_fingerprint.setdefault(fingerprint, []).append(sequence_number)
+
+    stats = notifier.flush()
+    for fingerprint in stats['failed_fingerprints']:
+        failed += by_fingerprint.get(fingerprint, [])
+    print(f"SNS: {stats['sent']} messages sent in {stats['publish_calls']} calls, {stats['suppressed']} suppressed, "
+          f"{ignored} records without relevant changes ignored, {len(failed)} records failed.")
 
-    print("Received event:", json.dumps(event, indent=2))
-
-    for record in event['Records']:
-        event_name = record['eventName']  # INSERT, MODIFY, REMOVE
-        table_name = record['eventSourceARN'].split('/')[1]
-
-        # Only handle updates (MODIFY)
-        if event_name == 'MODIFY':
-            old_image = record['dynamodb'].get('OldImage', {})
-            new_image = record['dynamodb'].get('NewImage', {})
-
-            # Convert DynamoDB JSON to readable format
-            old_item = {k: list(v.values())[0] for k, v in old_image.items()}
-            new_item = {k: list(v.values())[0] for k, v in new_image.items()}
-
-            changed_fields = []
-            for key in new_item.keys():
-                old_val = old_item.get(key)
-                new_val = new_item.get(key)
-                if old_val != new_val:
-                    changed_fields.append(f"{key}: '{old_val}' → '{new_val}'")
-
-            # Construct message
-            message = (
-                f"🔔 *DynamoDB Item Updated Alert*\n"
-                f"Table: {table_name}\n"
-                f"Time: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n\n"
-                f"Changes:\n" + "\n".join(changed_fields)
-            )
-
-            print("Sending SNS notification...")
-            sns.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject=f"🔔 DynamoDB Update in {table_name}",
-                Message=message
-            )
-            print("SNS alert sent successfully.")
-
-        else:
-            print(f"Ignored event type: {event_name}")
-
-    return {"statusCode": 200, "message": "Processed successfully"}
+    return {
+        "statusCode": 200,
+        "message": "Processed successfully" if not failed else f"{len(failed)} records failed",
+        "batchItemFailures": [{"itemIdentifier": seq} for seq in failed if seq is not None],
+    }
 
 # For local test execution
 if __name__ == "__main__":
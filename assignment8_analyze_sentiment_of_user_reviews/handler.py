@@ -1,55 +1,495 @@
+import hashlib
 import json
-import boto3
 import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote_plus
+
+from botocore.exceptions import ClientError
+
+from common.clients import get_client
+from common.executor import get_executor
+from common.state import state_store_from_uri
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Create Comprehend client
-comprehend = boto3.client('comprehend')
+# Environment variables
+LANGUAGE_CODE = os.environ.get('LANGUAGE_CODE')  # e.g. 'en'; unset = detect the language of each review
+BATCH_SIZE = 25  # BatchDetectSentiment / BatchDetectDominantLanguage limit
+MAX_TEXT_BYTES = 5000  # Comprehend limit per document (UTF-8)
+TEXT_OVERFLOW = os.environ.get('TEXT_OVERFLOW', 'truncate')  # 'truncate' or 'chunk' (score every part, average)
+CACHE_SIZE = int(os.environ.get('SENTIMENT_CACHE_SIZE', '10000'))  # results kept per warm container
+SENTIMENT_CACHE_URI = os.environ.get('SENTIMENT_CACHE_URI')  # optional s3://bucket/key (or path) shared by containers
+
+# Local model: confidently scored short English reviews never reach Comprehend
+SENTIMENT_ENGINE = os.environ.get('SENTIMENT_ENGINE', 'hybrid')  # 'hybrid', 'comprehend' or 'local'
+LOCAL_CONFIDENCE_THRESHOLD = float(os.environ.get('LOCAL_CONFIDENCE_THRESHOLD', '0.9'))
+LOCAL_MAX_WORDS = int(os.environ.get('LOCAL_MAX_WORDS', '40'))  # longer reviews always go to Comprehend (hybrid)
+SENTIMENT_LEXICON_PATH = os.environ.get('SENTIMENT_LEXICON_PATH')  # optional JSON {word: weight} replacing LEXICON
+
+SUPPORTED_LANGUAGES = {'ar', 'hi', 'ko', 'zh-TW', 'ja', 'zh', 'de', 'pt', 'en', 'it', 'fr', 'es'}
+SCORE_KEYS = ('Positive', 'Negative', 'Neutral', 'Mixed')
+
+
+class ResultCache:
+    """Sentiment results by content hash, least recently used evicted first."""
+
+    def __init__(self, size=CACHE_SIZE, store=None):
+        self.size = size
+        self.store = store
+        self.entries = OrderedDict()
+        self.dirty = False
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Merge the persisted entries once per container."""
+        if self.loaded or not self.store:
+            return
+        self.loaded = True
+        try:
+            persisted = self.store.load() or {}
+        except ClientError as e:
+            logger.warning(f"Could not load sentiment cache: {e}")
+            return
+        with self._lock:
+            for key, result in persisted.items():
+                self.entries.setdefault(key, result)
+            self._evict()
+
+    def get(self, key):
+        with self._lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            self.dirty = True
+            self._evict()
+
+    def _evict(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        if self.store and self.dirty:
+            with self._lock:
+                snapshot, self.dirty = dict(self.entries), False
+            self.store.save(snapshot)
+
+
+_cache = ResultCache(store=state_store_from_uri(SENTIMENT_CACHE_URI) if SENTIMENT_CACHE_URI else None)
+
+
+def normalize(text):
+    """Whitespace-collapsed text, so templated reviews differing only in spacing share a cache entry."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(text, language):
+    return hashlib.sha256(f"{language or ''}\0{text}".encode('utf-8')).hexdigest()
+
+
+def split_text(text, limit=MAX_TEXT_BYTES):
+    """Parts of at most `limit` UTF-8 bytes, cut at whitespace where possible; only the first with 'truncate'."""
+    parts = []
+    encoded = text.encode('utf-8')
+    while encoded:
+        if len(encoded) <= limit:
+            parts.append(encoded.decode('utf-8'))
+            break
+        cut = encoded.rfind(b' ', 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+            while cut and (encoded[cut] & 0xC0) == 0x80:  # not inside a multi-byte character
+                cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:].lstrip()
+        if TEXT_OVERFLOW != 'chunk':
+            break
+    return parts
+
+
+LEXICON = {
+    # positive
+    'good': 1.0, 'great': 1.5, 'excellent': 2.0, 'amazing': 2.0, 'awesome': 2.0, 'love': 1.8, 'loved': 1.8,
+    'loves': 1.8, 'perfect': 2.0, 'fantastic': 2.0, 'wonderful': 2.0, 'best': 1.5, 'happy': 1.3, 'nice': 1.0,
+    'recommend': 1.3, 'recommended': 1.3, 'fast': 0.7, 'easy': 0.8, 'works': 0.6, 'worth': 1.0, 'satisfied': 1.3,
+    'brilliant': 2.0, 'superb': 2.0, 'outstanding': 2.0, 'pleased': 1.3, 'helpful': 1.0, 'comfortable': 1.0,
+    'beautiful': 1.5, 'reliable': 1.2, 'friendly': 1.0, 'thanks': 0.8, 'thank': 0.8, 'glad': 1.0,
+    # negative
+    'bad': -1.3, 'terrible': -2.0, 'awful': -2.0, 'horrible': -2.0, 'worst': -2.0, 'poor': -1.5, 'hate': -1.8,
+    'hated': -1.8, 'broken': -1.6, 'broke': -1.5, 'useless': -1.8, 'disappointed': -1.6, 'disappointing': -1.6,
+    'refund': -1.3, 'return': -0.7, 'returned': -1.0, 'waste': -1.8, 'slow': -0.9, 'defective': -1.8,
+    'cheap': -0.6, 'faulty': -1.6, 'rude': -1.5, 'never': -0.6, 'failed': -1.4, 'fails': -1.3, 'stopped': -1.0,
+    'late': -0.8, 'missing': -1.0, 'damaged': -1.6, 'scam': -2.0, 'annoying': -1.3, 'unhappy': -1.5, 'avoid': -1.6,
+}
+NEGATIONS = {'not', 'no', "don't", "doesn't", "didn't", "isn't", "wasn't", "aren't", "won't", 'never', "can't",
+             'hardly', 'without'}
+INTENSIFIERS = {'very': 1.5, 'really': 1.4, 'so': 1.3, 'extremely': 1.8, 'absolutely': 1.6, 'totally': 1.5,
+                'super': 1.5, 'quite': 1.2, 'slightly': 0.6, 'somewhat': 0.7}
+CONTRASTS = {'but', 'however', 'although', 'though', 'yet'}
+WORD_RE = re.compile(r"[a-z']+|!")
+
+
+class LocalSentimentModel:
+    """
+    In-process lexicon model with a linear head. Each review becomes three
+    features: positive evidence, negative evidence (lexicon weights with
+    negation flipping and intensifiers applied) and a contrast flag. One
+    NumPy matrix product turns a whole batch of feature rows into
+    Positive/Negative/Neutral/Mixed logits, and a softmax gives scores in
+    Comprehend's format. Reviews without any lexicon word get confidence 0,
+    so they are always left to Comprehend.
+    """
+
+    # Rows: positive evidence, negative evidence, contrast, bias; columns: Positive, Negative, Neutral, Mixed
+    COEFFICIENTS = [
+        [2.2, -1.2, -1.0, 0.9],
+        [-1.2, 2.2, -1.0, 0.9],
+        [-0.5, -0.5, 0.0, 1.5],
+        [0.0, 0.0, 1.2, -2.0],
+    ]
+
+    def __init__(self, lexicon=None, coefficients=None):
+        import numpy as np
+        self.lexicon = lexicon or LEXICON
+        self.coefficients = np.asarray(coefficients or self.COEFFICIENTS, dtype=float)
+
+    def features(self, text):
+        """[positive, negative, contrast, 1] and the number of words."""
+        positive = negative = 0.0
+        contrast = 0.0
+        negate = 0  # words left in the scope of a negation
+        boost = 1.0
+        words = WORD_RE.findall(text.lower())
+        for word in words:
+            if word == '!':
+                # Exclamation marks strengthen whatever was said
+                positive, negative = positive * 1.1, negative * 1.1
+                continue
+            weight = self.lexicon.get(word)
+            if weight is not None:
+                weight *= boost * (-0.8 if negate else 1.0)
+                if weight > 0:
+                    positive += weight
+                else:
+                    negative -= weight
+                boost, negate = 1.0, 0
+            elif word in NEGATIONS:
+                negate = 3
+            elif word in INTENSIFIERS:
+                boost = INTENSIFIERS[word]
+            else:
+                if word in CONTRASTS:
+                    contrast = 1.0
+                negate = max(0, negate - 1)
+        return [positive, negative, contrast, 1.0], len(words)
+
+    def score(self, texts):
+        """[(sentiment, scores, confidence)] for a batch of texts."""
+        import numpy as np
+        if not texts:
+            return []
+        rows = [self.features(text)[0] for text in texts]
+        x = np.asarray(rows, dtype=float)
+        logits = x @ self.coefficients
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        evidence = x[:, 0] + x[:, 1] > 0
+        results = []
+        for n in range(len(texts)):
+            scores = dict(zip(SCORE_KEYS, (float(p) for p in probabilities[n])))
+            confidence = float(probabilities[n, best[n]]) if evidence[n] else 0.0
+            results.append((SCORE_KEYS[best[n]].upper(), scores, confidence))
+        return results
+
+
+_local_model = None
+
+
+def local_model():
+    global _local_model
+    if _local_model is None:
+        lexicon = None
+        if SENTIMENT_LEXICON_PATH:
+            with open(SENTIMENT_LEXICON_PATH) as f:
+                lexicon = json.load(f)
+        _local_model = LocalSentimentModel(lexicon)
+    return _local_model
+
+
+def route_locally(todo, engine=None, threshold=None):
+    """
+    Score English reviews (stated or detected; the lexicon is English) with
+    the local model and keep the confident ones; returns how many were
+    resolved. With engine 'local' every English review is resolved locally,
+    whatever the confidence.
+    """
+    engine = engine or SENTIMENT_ENGINE
+    threshold = LOCAL_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    if engine == 'comprehend':
+        return 0
+    candidates = [item for item in todo if item['language'] == 'en'
+                  and (engine == 'local' or len(item['text'].split()) <= LOCAL_MAX_WORDS)]
+    resolved = 0
+    for item, (sentiment, scores, confidence) in zip(candidates, local_model().score([i['text'] for i in candidates])):
+        if engine == 'local' or confidence >= threshold:
+            item['result'] = {'sentiment': sentiment, 'scores': scores, 'language': 'en'}
+            item['local'] = True
+            resolved += 1
+    return resolved
+
+
+def parse_reviews(event):
+    """
+    Reviews in any supported event shape, as (reviews, kind):
+    {'review': text}, {'reviews': [text or {'id', 'text', 'language'}]}, SQS
+    records (body: text or JSON of either shape) and S3 Batch Operations tasks
+    (the object is the review, read by read_s3_reviews first). Each review is
+    {'id', 'text', 'language', 'source_id'}, where source_id is the SQS
+    messageId it came in (the review's own id may be anything); a task whose
+    object could not be read is None.
+    """
+    def review(item, default_id, language=None, source_id=None):
+        if isinstance(item, str):
+            item = {'text': item}
+        return {'id': str(item.get('id', default_id)), 'text': item.get('text') or item.get('review') or '',
+                'language': item.get('language') or language or LANGUAGE_CODE, 'source_id': source_id}
+
+    if 'tasks' in event and 'invocationId' in event:
+        return [review({'text': task['text']}, task['taskId']) if 'error' not in task else None
+                for task in event['tasks']], 's3batch'
+    if 'Records' in event:
+        reviews = []
+        for record in event['Records']:
+            body = record.get('body', '')
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = body
+            if isinstance(payload, dict) and 'reviews' in payload:
+                reviews += [review(r, f"{record['messageId']}:{n}", payload.get('language'), record['messageId'])
+                            for n, r in enumerate(payload['reviews'])]
+            else:
+                reviews.append(review(payload, record['messageId'], source_id=record['messageId']))
+        return reviews, 'sqs'
+    if 'reviews' in event:
+        return [review(r, n, event.get('language')) for n, r in enumerate(event['reviews'])], 'list'
+    return [review(event, 0, event.get('language'))], 'single'
+
+
+def is_batch_event(event):
+    return 'Records' in event or ('tasks' in event and 'invocationId' in event)
+
+
+def read_s3_reviews(tasks):
+    """Fetch the objects of S3 Batch Operations tasks concurrently; failed reads carry an error instead."""
+    s3 = get_client('s3')
+    executor = get_executor()
+    futures = [
+        executor.submit('s3', s3.get_object, Bucket=task.get('s3Bucket') or task['s3BucketArn'].split(':::')[-1],
+                        Key=unquote_plus(task['s3Key']))
+        for task in tasks
+    ]
+    for task, future in zip(tasks, futures):
+        try:
+            task['text'] = future.result()['Body'].read().decode('utf-8', 'replace')
+        except ClientError as e:
+            task['error'] = str(e)
+    return tasks
+
+
+def batched(items, size=BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def detect_languages(texts):
+    """Dominant language per text with BatchDetectDominantLanguage, batches in parallel."""
+    comprehend = get_client('comprehend')
+    executor = get_executor()
+    batches = batched(texts)
+    futures = [executor.submit('comprehend', comprehend.batch_detect_dominant_language, TextList=batch)
+               for batch in batches]
+    languages = []
+    for batch, future in zip(batches, futures):
+        found = [None] * len(batch)
+        for item in future.result()['ResultList']:
+            if item['Languages']:
+                found[item['Index']] = max(item['Languages'], key=lambda x: x['Score'])['LanguageCode']
+        languages += found
+    return languages
+
+
+def detect_sentiments(texts, language):
+    """(sentiment, scores) or an error string per text, from BatchDetectSentiment calls run in parallel."""
+    comprehend = get_client('comprehend')
+    executor = get_executor()
+    batches = batched(texts)
+    futures = [executor.submit('comprehend', comprehend.batch_detect_sentiment, TextList=batch, LanguageCode=language)
+               for batch in batches]
+    results = []
+    for batch, future in zip(batches, futures):
+        response = future.result()
+        found = [None] * len(batch)
+        for item in response['ResultList']:
+            found[item['Index']] = (item['Sentiment'], item['SentimentScore'])
+        for error in response.get('ErrorList', []):
+            found[error['Index']] = f"{error['ErrorCode']}: {error.get('ErrorMessage', '')}"
+        results += found
+    return results
+
+
+def combine(parts):
+    """Average the scores of a chunked review, weighted by each part's length."""
+    total = sum(weight for weight, _ in parts)
+    scores = {k: sum(weight * s[k] for weight, s in parts) / total for k in SCORE_KEYS}
+    return max(scores, key=scores.get).upper(), scores
+
+
+def analyze_texts(reviews):
+    """
+    Sentiment for each review ({'id', 'text', 'language'}), in order:
+    {'id', 'sentiment', 'scores', 'language', 'cached'} or {'id', 'error'}.
+    """
+    _cache.load()
+    results = [None] * len(reviews)
+    pending = {}  # cache key -> text, language and the indexes of the reviews with that content
+    for n, review in enumerate(reviews):
+        text = normalize(review['text'])
+        if not text:
+            results[n] = {'id': review['id'], 'error': 'Missing review text'}
+            continue
+        key = cache_key(text, review['language'])
+        cached = _cache.get(key)
+        if cached:
+            results[n] = {'id': review['id'], **cached, 'cached': True}
+        else:
+            pending.setdefault(key, {'text': text, 'language': review['language'], 'indexes': []})['indexes'].append(n)
+    logger.info(f"{len(reviews)} reviews: {len(reviews) - len(pending)} from cache or invalid, "
+                f"{len(pending)} distinct texts to analyze")
+
+    todo = list(pending.values())
+    unknown = [item for item in todo if not item['language']]
+    if unknown:
+        # Language detection only needs the first part of a long review
+        for item, language in zip(unknown, detect_languages([split_text(i['text'])[0] for i in unknown])):
+            item['language'] = language
+    local = route_locally(todo)
+    todo = [item for item in todo if 'result' not in item]
+    if local:
+        logger.info(f"{local} texts scored by the local model, {len(todo)} sent to Comprehend")
+
+    by_language = {}
+    for item in todo:
+        by_language.setdefault(item['language'], []).append(item)
+    for language, items in by_language.items():
+        if language not in SUPPORTED_LANGUAGES:
+            for item in items:
+                item['result'] = {'error': f"Unsupported language: {language}", 'language': language}
+            continue
+        parts = [(item, part) for item in items for part in split_text(item['text'])]
+        scored = detect_sentiments([part for _, part in parts], language)
+        for item in items:
+            item['parts'] = []
+        for (item, part), outcome in zip(parts, scored):
+            if isinstance(outcome, str) or outcome is None:
+                item['error'] = outcome or 'No result'
+                item['retryable'] = outcome is None or outcome.startswith('InternalServerException')
+            else:
+                item['parts'].append((len(part), outcome))
+        for item in items:
+            if 'error' in item:
+                item['result'] = {'error': item['error'], 'language': language, 'retryable': item['retryable']}
+                continue
+            if len(item['parts']) == 1:
+                sentiment, scores = item['parts'][0][1]
+            else:
+                sentiment, scores = combine([(w, s) for w, (_, s) in item['parts']])
+            item['result'] = {'sentiment': sentiment, 'scores': scores, 'language': language}
+
+    for key, item in pending.items():
+        result = item['result']
+        if 'error' not in result and not item.get('local'):
+            # The cache keeps paid Comprehend results; local ones are cheap to recompute
+            _cache.put(key, result)
+        for n in item['indexes']:
+            results[n] = {'id': reviews[n]['id'], **result, 'cached': False}
+    _cache.save()
+    return results
+
+
+def task_result_code(result):
+    """S3 Batch Operations result code; None is an object that could not be read."""
+    if result is None:
+        return 'PermanentFailure'
+    if 'error' in result:
+        return 'TemporaryFailure' if result.get('retryable') else 'PermanentFailure'
+    return 'Succeeded'
+
 
 def lambda_handler(event, context):
     """
     Lambda function to analyze sentiment of user reviews using Amazon Comprehend
     """
     try:
-        # Extract review text from the incoming event
-        review_text = event.get('review')
-        if not review_text:
-            logger.error("No review text found in event.")
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'Missing review text'})
-            }
-
-        logger.info(f"Received review: {review_text}")
-
-        # Call Amazon Comprehend for sentiment analysis
-        response = comprehend.detect_sentiment(
-            Text=review_text,
-            LanguageCode='en'
-        )
-
-        sentiment = response['Sentiment']
-        sentiment_scores = response['SentimentScore']
-
-        logger.info(f"Detected Sentiment: {sentiment}")
-        logger.info(f"Sentiment Scores: {json.dumps(sentiment_scores, indent=2)}")
-
-        # Return result
+        if 'tasks' in event and 'invocationId' in event:
+            read_s3_reviews(event['tasks'])
+        reviews, kind = parse_reviews(event)
+        analyzed = iter(analyze_texts([r for r in reviews if r is not None]))
+        results = [next(analyzed) if r is not None else None for r in reviews]
+        errors = sum(1 for r in results if r is None or 'error' in r)
+        # Counts only: review text is never logged
+        logger.info(f"Analyzed {len(results)} reviews ({kind}), {errors} failed")
+    except Exception as e:
+        logger.error(f"Error processing reviews: {str(e)}")
+        if is_batch_event(event):
+            raise  # let Lambda retry the whole SQS batch / S3 Batch Operations task list
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+    if kind == 'single':
+        result = results[0]
+        if 'error' in result:
+            logger.error(f"Review not analyzed: {result['error']}")
+            return {'statusCode': 400, 'body': json.dumps({'error': result['error']})}
+        logger.info(f"Detected Sentiment: {result['sentiment']}")
         return {
             'statusCode': 200,
             'body': json.dumps({
-                'review': review_text,
-                'sentiment': sentiment,
-                'scores': sentiment_scores
+                'review': event.get('review') or event.get('text'),
+                'sentiment': result['sentiment'],
+                'scores': result['scores'],
+                'language': result['language']
             })
         }
-
-    except Exception as e:
-        logger.error(f"Error processing review: {str(e)}")
+    if kind == 'sqs':
+        # Only messages with a transient failure are retried; invalid reviews are reported, not redelivered
+        failed = {review['source_id'] for review, result in zip(reviews, results) if result.get('retryable')}
+        return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(failed)],
+                'results': results}
+    if kind == 's3batch':
         return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'invocationSchemaVersion': event['invocationSchemaVersion'],
+            'treatMissingKeysAs': 'PermanentFailure',
+            'invocationId': event['invocationId'],
+            'results': [
+                {'taskId': task['taskId'],
+                 'resultCode': task_result_code(result),
+                 'resultString': task['error'] if result is None else json.dumps(result)}
+                for task, result in zip(event['tasks'], results)
+            ],
         }
+    return {'statusCode': 200, 'body': json.dumps({'results': results})}
@@ -1,64 +1,660 @@
-import boto3
+import queue
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 import os
+from urllib.parse import quote
 
-# Initialize S3 client
-s3 = boto3.client('s3')
+from common.checkpoint import TimeBudget, checkpoint_from_env
+from common.clients import get_client
+from common.executor import get_executor
 
 # Number of months after which files should be archived
 MONTHS_OLD = 6
 
+# Storage classes that are already archived
+ARCHIVED_STORAGE_CLASSES = ['GLACIER', 'DEEP_ARCHIVE', 'GLACIER_IR']
+
+# Sharded listing: 'none' (one paginator), 'prefix' (one shard per top-level
+# common prefix) or 'range' (shards split at the keys in SHARD_RANGES)
+SHARD_MODE = os.environ.get('SHARD_MODE', 'none')
+SHARD_RANGES = os.environ.get('SHARD_RANGES', '')  # e.g. "g,n,t": shards (..g], (g..n], (n..t], (t..]
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', '8'))  # shards listed at the same time
+CANDIDATE_QUEUE_SIZE = int(os.environ.get('CANDIDATE_QUEUE_SIZE', '1000'))  # bounds memory use
+
+# Objects at or above this size are copied with parallel UploadPartCopy requests
+# (CopyObject itself is limited to 5 GB)
+MIB = 1024 * 1024
+MULTIPART_THRESHOLD = int(os.environ.get('MULTIPART_THRESHOLD_MB', '512')) * MIB
+PART_SIZE = int(os.environ.get('PART_SIZE_MB', '256')) * MIB
+PART_CONCURRENCY = int(os.environ.get('PART_CONCURRENCY', '8'))
+MAX_PARTS = 10000  # S3 multipart upload limit
+MIN_PART_SIZE = 5 * MIB
+MAX_PART_SIZE = 5 * 1024 * MIB
+
+# Headers CopyObject carries over with MetadataDirective='COPY'; a multipart
+# copy has to set them on CreateMultipartUpload itself
+COPIED_HEADERS = ['CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage',
+                  'ContentType', 'Expires', 'WebsiteRedirectLocation']
+
+# 'copy' rewrites each old object; 'plan' installs lifecycle transition rules
+# and only copies what the rules cannot cover
+ARCHIVE_MODE = os.environ.get('ARCHIVE_MODE', 'copy')
+EXCLUDE_PREFIXES = [p.strip() for p in os.environ.get('EXCLUDE_PREFIXES', '').split(',') if p.strip()]
+LIFECYCLE_RULE_PREFIX = 'archive-to-glacier'  # ID prefix of the rules this function owns
+# S3 lifecycle does not transition objects smaller than 128 KiB by default
+LIFECYCLE_MIN_OBJECT_SIZE = 128 * 1024
+MAX_LIFECYCLE_RULES = 1000
+AGE_BUCKETS_DAYS = [30, 90, 180, 365]
+
+
+def iter_object_pages(bucket_name, continuation_token=None, start_after=None, **list_args):
+    """
+    Yield (page, next_token) for each list_objects_v2 page, starting from
+    a saved continuation token or after a saved key. Extra list_args (Prefix,
+    Delimiter) are passed through to every call.
+    """
+    s3 = get_client('s3')
+    kwargs = {'Bucket': bucket_name, **list_args}
+    if continuation_token:
+        kwargs['ContinuationToken'] = continuation_token
+    elif start_after:
+        kwargs['StartAfter'] = start_after
+    while True:
+        try:
+            page = get_executor().call('s3', s3.list_objects_v2, **kwargs)
+        except ClientError:
+            if 'ContinuationToken' not in kwargs:
+                raise
+            # Saved tokens can expire; fall back to the last processed key
+            print("Continuation token rejected; resuming after last key instead")
+            kwargs.pop('ContinuationToken')
+            if start_after:
+                kwargs['StartAfter'] = start_after
+            continue
+        next_token = page.get('NextContinuationToken') if page.get('IsTruncated') else None
+        yield page, next_token
+        if not next_token:
+            return
+        kwargs.pop('StartAfter', None)
+        kwargs['ContinuationToken'] = next_token
+
+
+def is_archive_candidate(obj, cutoff_date):
+    """Old enough, not already in an archive storage class and not excluded."""
+    return (obj['LastModified'] < cutoff_date
+            and obj.get('StorageClass', 'STANDARD') not in ARCHIVED_STORAGE_CLASSES
+            and not any(obj['Key'].startswith(ex) for ex in EXCLUDE_PREFIXES))
+
+
+def plan_parts(size, part_size=PART_SIZE):
+    """Byte ranges (first, last) for a multipart copy, growing parts to stay under 10,000."""
+    part_size = min(max(part_size, MIN_PART_SIZE, -(-size // MAX_PARTS)), MAX_PART_SIZE)
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+def multipart_copy(bucket_name, key, size, storage_class, part_size=PART_SIZE, concurrency=PART_CONCURRENCY):
+    """
+    Server-side copy of a large object onto itself with a new storage class,
+    using UploadPartCopy parts in parallel. The upload is aborted if any part
+    fails so no orphaned parts are left behind. Returns the version id of the
+    copied (now superseded) object, None on unversioned buckets.
+    """
+    s3 = get_client('s3')
+    executor = get_executor()
+    head = executor.call('s3', s3.head_object, Bucket=bucket_name, Key=key)
+    create_args = {k: head[k] for k in COPIED_HEADERS if k in head}
+    create_args['Metadata'] = head.get('Metadata', {})
+    # Keep the object's own encryption (SSE-S3, SSE-KMS or DSSE-KMS) rather than the bucket default
+    for header in ('ServerSideEncryption', 'SSEKMSKeyId', 'BucketKeyEnabled'):
+        if header in head:
+            create_args[header] = head[header]
+    tags = executor.call('s3', s3.get_object_tagging, Bucket=bucket_name, Key=key).get('TagSet', [])
+    if tags:
+        create_args['Tagging'] = '&'.join(f"{quote(t['Key'])}={quote(t['Value'])}" for t in tags)
+
+    upload_id = executor.call(
+        's3', s3.create_multipart_upload,
+        Bucket=bucket_name, Key=key, StorageClass=storage_class, **create_args
+    )['UploadId']
+
+    def copy_part(part_number, first, last):
+        resp = executor.call(
+            's3', s3.upload_part_copy,
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={'Bucket': bucket_name, 'Key': key},
+            CopySourceRange=f"bytes={first}-{last}",
+            CopySourceIfMatch=head['ETag']  # fail if the object changes mid-copy
+        )
+        return {'PartNumber': part_number, 'ETag': resp['CopyPartResult']['ETag']}
+
+    # The executor retries throttled parts; this pool only bounds parts in flight
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [pool.submit(copy_part, n, first, last)
+                   for n, (first, last) in enumerate(plan_parts(size, part_size), start=1)]
+        parts = [future.result() for future in as_completed(futures)]
+        pool.shutdown()
+        executor.call(
+            's3', s3.complete_multipart_upload,
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': sorted(parts, key=lambda p: p['PartNumber'])}
+        )
+    except Exception:
+        pool.shutdown(cancel_futures=True)
+        executor.call('s3', s3.abort_multipart_upload, Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
+    print(f"Multipart copy of {key}: {len(futures)} parts, {size / MIB:.0f} MiB")
+    return head.get('VersionId')
+
+
+def copy_to_storage_class(bucket_name, key, size, storage_class):
+    """
+    CopyObject for small objects, parallel multipart copy above
+    MULTIPART_THRESHOLD. Returns the version id of the superseded object
+    (None on unversioned buckets, where the copy replaced it).
+    """
+    s3 = get_client('s3')
+    if size >= MULTIPART_THRESHOLD:
+        return multipart_copy(bucket_name, key, size, storage_class)
+    # Copy object to same location with Glacier storage class
+    resp = get_executor().call(
+        's3', s3.copy_object,
+        Bucket=bucket_name,
+        CopySource={'Bucket': bucket_name, 'Key': key},
+        Key=key,
+        StorageClass=storage_class,
+        MetadataDirective='COPY'
+    )
+    return resp.get('CopySourceVersionId')
+
+
+def archive_object(bucket_name, key, storage_class, size=0):
+    """Rewrite one object into the archive storage class. Returns True on success."""
+    s3 = get_client('s3')
+    try:
+        old_version = copy_to_storage_class(bucket_name, key, size, storage_class)
+
+        # The copy is now the current object. On versioned buckets delete the
+        # superseded version; a plain delete_object would remove (or hide) the copy.
+        if old_version and old_version != 'null':
+            get_executor().call('s3', s3.delete_object, Bucket=bucket_name, Key=key, VersionId=old_version)
+
+        print(f"Archived: {key}")
+        return True
+
+    except Exception as e:
+        print(f"Error archiving {key}: {str(e)}")
+        return False
+
+
+def discover_shards(bucket_name, mode=SHARD_MODE, ranges=SHARD_RANGES):
+    """
+    Split the keyspace into shards. Each shard is a dict with an 'id' (stable
+    across runs, used for checkpoints) and the listing bounds it covers.
+    """
+    if mode == 'prefix':
+        # Root-level keys are their own shard; every common prefix is another
+        shards = [{'id': '/', 'Delimiter': '/'}]
+        for page, _ in iter_object_pages(bucket_name, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                shards.append({'id': common_prefix['Prefix'], 'Prefix': common_prefix['Prefix']})
+        return shards
+
+    if mode == 'range':
+        points = sorted({p.strip() for p in ranges.split(',') if p.strip()})
+        bounds = [None] + points + [None]
+        return [
+            {'id': f"{low or ''}..{high or ''}", 'start_after': low, 'end_key': high}
+            for low, high in zip(bounds, bounds[1:])
+        ]
+
+    return [{'id': '*'}]
+
+
+def _put(candidates, item, stop):
+    """Blocking put that gives up once the consumer has stopped (backpressure)."""
+    while not stop.is_set():
+        try:
+            candidates.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def list_shard(bucket_name, shard, resume_after, cutoff_date, candidates, stop):
+    """
+    Worker: list one shard and feed archive candidates into the shared queue,
+    followed by a ('progress', ...) marker per page and a final ('done', ...).
+    """
+    shard_id = shard['id']
+    list_args = {k: shard[k] for k in ('Prefix', 'Delimiter') if k in shard}
+    start_after = max(filter(None, [shard.get('start_after'), resume_after]), default=None)
+    end_key = shard.get('end_key')
+    try:
+        for page, _ in iter_object_pages(bucket_name, start_after=start_after, **list_args):
+            if stop.is_set():
+                return
+            last_key = None
+            for obj in page.get('Contents', []):
+                if end_key is not None and obj['Key'] > end_key:
+                    if last_key:
+                        _put(candidates, ('progress', shard_id, last_key), stop)
+                    _put(candidates, ('done', shard_id, None), stop)
+                    return
+                if is_archive_candidate(obj, cutoff_date):
+                    if not _put(candidates, ('candidate', shard_id, obj), stop):
+                        return
+                last_key = obj['Key']
+            if last_key:
+                _put(candidates, ('progress', shard_id, last_key), stop)
+        _put(candidates, ('done', shard_id, None), stop)
+    except Exception as e:
+        _put(candidates, ('error', shard_id, str(e)), stop)
+
+
+def iter_sharded_candidates(bucket_name, shards, cutoff_date, progress, workers=SHARD_WORKERS,
+                            queue_size=CANDIDATE_QUEUE_SIZE):
+    """
+    List all shards in parallel and yield (shard_id, obj) archive candidates
+    from one bounded queue. `progress` ({'last_keys': {...}, 'done': [...]})
+    is updated in place once the caller has handled each item, so it can be
+    checkpointed whenever the caller stops iterating.
+    """
+    candidates = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    last_keys = progress.setdefault('last_keys', {})
+    done = progress.setdefault('done', [])
+    active = [shard for shard in shards if shard['id'] not in done]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(active)))) as pool:
+        for shard in active:
+            pool.submit(list_shard, bucket_name, shard, last_keys.get(shard['id']),
+                        cutoff_date, candidates, stop)
+        remaining = len(active)
+        try:
+            while remaining:
+                kind, shard_id, value = candidates.get()
+                if kind == 'candidate':
+                    yield shard_id, value
+                    last_keys[shard_id] = value['Key']
+                elif kind == 'progress':
+                    last_keys[shard_id] = value
+                elif kind == 'done':
+                    done.append(shard_id)
+                    last_keys.pop(shard_id, None)
+                    remaining -= 1
+                else:
+                    print(f"Listing shard {shard_id} failed: {value}")
+                    remaining -= 1
+        finally:
+            stop.set()  # release workers blocked on a full queue
+
+
+def archive_sharded(bucket_name, cutoff_date, storage_class, checkpoint, budget):
+    """Sharded listing mode. Returns (archived_files, progress or None when finished)."""
+    progress = checkpoint.load() or {'last_keys': {}, 'done': []}
+    shards = discover_shards(bucket_name)
+    print(f"Listing {len(shards)} shards ({SHARD_MODE} mode) with {SHARD_WORKERS} workers")
+
+    archived_files = []
+    stopped = False
+    candidates = iter_sharded_candidates(bucket_name, shards, cutoff_date, progress)
+    for shard_id, obj in candidates:
+        if budget.exhausted():
+            stopped = True
+            break
+        if archive_object(bucket_name, obj['Key'], storage_class, obj.get('Size', 0)):
+            archived_files.append(obj['Key'])
+    candidates.close()
+
+    finished = not stopped and all(shard['id'] in progress['done'] for shard in shards)
+    return archived_files, None if finished else progress
+
+
+def archive_sequential(bucket_name, cutoff_date, storage_class, checkpoint, budget):
+    """Single-paginator mode. Returns (archived_files, resume position or None when finished)."""
+    position = checkpoint.load()
+    if position:
+        print(f"Resuming scan after key: {position.get('last_key')}")
+
+    # List all objects in the bucket
+    pages = iter_object_pages(bucket_name, position.get('continuation_token'), position.get('last_key'))
+    archived_files = []
+    last_key = position.get('last_key')
+
+    for page, next_token in pages:
+        contents = page.get('Contents', [])
+        if not contents:
+            print("No files found in the bucket.")
+
+        for obj in contents:
+            if budget.exhausted():
+                # Out of time mid-page: resume right after the last key handled
+                return archived_files, {'continuation_token': None, 'last_key': last_key}
+
+            key = obj['Key']
+            # Check if file is older than 6 months (skip if already Glacier)
+            if is_archive_candidate(obj, cutoff_date):
+                if archive_object(bucket_name, key, storage_class, obj.get('Size', 0)):
+                    archived_files.append(key)
+            elif obj['LastModified'] < cutoff_date:
+                print(f"Skipping {key} (already archived)")
+            last_key = key
+
+        if next_token and budget.exhausted():
+            # Out of time at a page boundary: the token resumes exactly here
+            return archived_files, {'continuation_token': next_token, 'last_key': last_key}
+
+    return archived_files, None
+
+
+def top_level_prefix(key):
+    """'logs/2024/a.gz' -> 'logs/'; root-level keys have no prefix ('')."""
+    head, sep, _ = key.partition('/')
+    return head + sep if sep else ''
+
+
+def is_excluded(prefix, exclude_prefixes):
+    """True when a lifecycle rule on `prefix` would also reach an excluded key."""
+    return any(prefix.startswith(ex) or ex.startswith(prefix) for ex in exclude_prefixes)
+
+
+def copy_path_calls(size):
+    """API calls the per-object path spends on one object (copy, plus the old-version delete on versioned buckets)."""
+    if size >= MULTIPART_THRESHOLD:
+        return 5 + len(plan_parts(size))  # head, tagging, create, parts, complete, delete
+    return 2
+
+
+def always_uncovered(prefix, size, exclude_prefixes):
+    """Candidates no plan can cover: too small to transition, or root-level keys when prefixes are excluded."""
+    return size < LIFECYCLE_MIN_OBJECT_SIZE or bool(exclude_prefixes and not prefix)
+
+
+def analyse_bucket(bucket_name, cutoff_date, budget, position=None, archive=None,
+                   exclude_prefixes=EXCLUDE_PREFIXES):
+    """
+    One listing pass keeping counters per top-level prefix: objects, bytes,
+    an age histogram, and count, bytes and copy calls of the archive
+    candidates (those below LIFECYCLE_MIN_OBJECT_SIZE also separately).
+    Candidates no lifecycle rule can cover are handed to archive(key, size)
+    as they are listed rather than collected. Stops when the budget runs out;
+    returns (stats, resume position or None when the listing finished).
+    """
+    position = position or {}
+    now = datetime.now(timezone.utc)
+    stats = position.get('stats') or {'list_calls': 0, 'prefixes': {}}
+    last_key = position.get('last_key')
+    for page, next_token in iter_object_pages(bucket_name, position.get('continuation_token'), last_key):
+        stats['list_calls'] += 1
+        for obj in page.get('Contents', []):
+            if budget.exhausted():
+                return stats, {'continuation_token': None, 'last_key': last_key, 'stats': stats}
+            prefix = top_level_prefix(obj['Key'])
+            size = obj.get('Size', 0)
+            entry = stats['prefixes'].setdefault(prefix, {
+                'objects': 0, 'bytes': 0, 'ages': [0] * (len(AGE_BUCKETS_DAYS) + 1),
+                'candidates': 0, 'candidate_bytes': 0, 'copy_calls': 0,
+                'small_candidates': 0, 'small_bytes': 0, 'small_copy_calls': 0
+            })
+            entry['objects'] += 1
+            entry['bytes'] += size
+            age_days = (now - obj['LastModified']).days
+            entry['ages'][sum(age_days >= limit for limit in AGE_BUCKETS_DAYS)] += 1
+            if is_archive_candidate(obj, cutoff_date):
+                entry['candidates'] += 1
+                entry['candidate_bytes'] += size
+                entry['copy_calls'] += copy_path_calls(size)
+                if size < LIFECYCLE_MIN_OBJECT_SIZE:
+                    entry['small_candidates'] += 1
+                    entry['small_bytes'] += size
+                    entry['small_copy_calls'] += copy_path_calls(size)
+                if archive and always_uncovered(prefix, size, exclude_prefixes):
+                    archive(obj['Key'], size)
+            last_key = obj['Key']
+        if next_token and budget.exhausted():
+            return stats, {'continuation_token': next_token, 'last_key': last_key, 'stats': stats}
+    return stats, None
+
+
+def rule_covers(rule, prefix, days, storage_class):
+    """Does an existing enabled rule already transition `prefix` at least as early?"""
+    if rule.get('Status') != 'Enabled':
+        return False
+    rule_filter = rule.get('Filter', {})
+    if set(rule_filter) - {'Prefix'}:
+        return False  # tag / size / And filters only reach part of the prefix
+    rule_prefix = rule_filter.get('Prefix', rule.get('Prefix', ''))
+    if not prefix.startswith(rule_prefix):
+        return False
+    return any(t.get('Days') is not None and t['Days'] <= days
+               and t.get('StorageClass') in (storage_class, 'DEEP_ARCHIVE')
+               for t in rule.get('Transitions', []))
+
+
+def plan_lifecycle_rules(stats, existing_rules, days, storage_class, exclude_prefixes=EXCLUDE_PREFIXES):
+    """
+    Minimal set of transition rules for the bucket: one bucket-wide rule when
+    nothing is excluded, otherwise one rule per top-level prefix that holds
+    objects, so the rules stay put once a prefix's old objects have moved.
+    Returns (rules, covered prefixes).
+    """
+    foreign_rules = [r for r in existing_rules if not r.get('ID', '').startswith(LIFECYCLE_RULE_PREFIX)]
+    prefixes = stats['prefixes']
+
+    def rule(prefix):
+        return {
+            'ID': f"{LIFECYCLE_RULE_PREFIX}-{prefix or 'all'}"[:255],
+            'Filter': {'Prefix': prefix},
+            'Status': 'Enabled',
+            'Transitions': [{'Days': days, 'StorageClass': storage_class}]
+        }
+
+    if not exclude_prefixes:
+        covered = set(prefixes)
+        wanted = [] if any(rule_covers(r, '', days, storage_class) for r in foreign_rules) else ['']
+    else:
+        # Root-level keys cannot get a rule of their own without one per key
+        covered = {p for p, entry in prefixes.items()
+                   if p and entry['objects'] and not is_excluded(p, exclude_prefixes)}
+        wanted = [p for p in covered if not any(rule_covers(r, p, days, storage_class) for r in foreign_rules)]
+        room = MAX_LIFECYCLE_RULES - len(foreign_rules)
+        if len(wanted) > room:
+            # Keep the prefixes holding the most candidate bytes; the rest are copied
+            wanted.sort(key=lambda p: (prefixes[p]['candidate_bytes'], p), reverse=True)
+            covered -= set(wanted[room:])
+            wanted = wanted[:room]
+    return [rule(p) for p in sorted(wanted)], covered
+
+
+def uncovered_totals(stats, covered):
+    """Candidates the plan leaves to the copy path: {'objects', 'bytes', 'copy_calls'}."""
+    totals = {'objects': 0, 'bytes': 0, 'copy_calls': 0}
+    for prefix, entry in stats['prefixes'].items():
+        small = prefix in covered
+        totals['objects'] += entry['small_candidates' if small else 'candidates']
+        totals['bytes'] += entry['small_bytes' if small else 'candidate_bytes']
+        totals['copy_calls'] += entry['small_copy_calls' if small else 'copy_calls']
+    return totals
+
+
+def estimate_savings(stats, uncovered, rules_written):
+    """API calls and bytes copied by the per-object loop versus the plan."""
+    loop_calls = stats['list_calls'] + sum(e['copy_calls'] for e in stats['prefixes'].values())
+    loop_bytes = sum(e['candidate_bytes'] for e in stats['prefixes'].values())
+    plan_calls = stats['list_calls'] + 1 + (1 if rules_written else 0) + uncovered['copy_calls']
+    return {
+        'loop_api_calls': loop_calls,
+        'plan_api_calls': plan_calls,
+        'api_calls_avoided': loop_calls - plan_calls,
+        'loop_bytes_copied': loop_bytes,
+        'plan_bytes_copied': uncovered['bytes'],
+        'bytes_avoided': loop_bytes - uncovered['bytes']
+    }
+
+
+def get_lifecycle_rules(bucket_name):
+    s3 = get_client('s3')
+    try:
+        return get_executor().call('s3', s3.get_bucket_lifecycle_configuration,
+                                   Bucket=bucket_name).get('Rules', [])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchLifecycleConfiguration':
+            return []
+        raise
+
+
+def apply_lifecycle_plan(bucket_name, stats, days, storage_class, dry_run):
+    """Merge this function's rules into the bucket's lifecycle configuration. Returns (summary, covered)."""
+    s3 = get_client('s3')
+    for prefix, entry in sorted(stats['prefixes'].items()):
+        print(f"Prefix {prefix or '(root)'}: {entry['objects']} objects, {entry['bytes'] / MIB:.1f} MiB, "
+              f"{entry['candidates']} older than {days} days, ages {entry['ages']} "
+              f"(buckets <{AGE_BUCKETS_DAYS} days)")
+
+    existing_rules = get_lifecycle_rules(bucket_name)
+    rules, covered = plan_lifecycle_rules(stats, existing_rules, days, storage_class)
+    foreign_rules = [r for r in existing_rules if not r.get('ID', '').startswith(LIFECYCLE_RULE_PREFIX)]
+    owned_rules = [r for r in existing_rules if r.get('ID', '').startswith(LIFECYCLE_RULE_PREFIX)]
+    changed = sorted(r['ID'] for r in rules) != sorted(r['ID'] for r in owned_rules) or any(
+        r not in owned_rules for r in rules)
+
+    if changed and not dry_run:
+        merged = foreign_rules + rules
+        if merged:
+            get_executor().call('s3', s3.put_bucket_lifecycle_configuration, Bucket=bucket_name,
+                                LifecycleConfiguration={'Rules': merged})
+        else:
+            get_executor().call('s3', s3.delete_bucket_lifecycle, Bucket=bucket_name)
+        print(f"Lifecycle configuration updated: {[r['ID'] for r in rules]} (+{len(foreign_rules)} existing rules)")
+    else:
+        print(f"Lifecycle rules {'unchanged' if not changed else 'not written (dry run)'}: {[r['ID'] for r in rules]}")
+
+    uncovered = uncovered_totals(stats, covered)
+    savings = estimate_savings(stats, uncovered, changed and not dry_run)
+    print(f"Estimated API calls: loop {savings['loop_api_calls']} vs plan {savings['plan_api_calls']} "
+          f"({savings['api_calls_avoided']} avoided); bytes copied: loop {savings['loop_bytes_copied']} "
+          f"vs plan {savings['plan_bytes_copied']} ({savings['bytes_avoided']} avoided)")
+    return {'rules': rules, 'uncovered_objects': uncovered['objects'], **savings}, covered
+
+
+def archive_prefix(bucket_name, prefix, cutoff_date, archive, budget, last_key=None):
+    """
+    Copy the lifecycle-sized candidates under one prefix that did not get a
+    rule (the smaller ones were copied during the analysis). Returns the last
+    key handled when the budget runs out, None when the prefix is done.
+    """
+    for page, _ in iter_object_pages(bucket_name, start_after=last_key, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if budget.exhausted():
+                return last_key or ''
+            if is_archive_candidate(obj, cutoff_date) and obj.get('Size', 0) >= LIFECYCLE_MIN_OBJECT_SIZE:
+                archive(obj['Key'], obj.get('Size', 0))
+            last_key = obj['Key']
+    return None
+
+
+def archive_with_lifecycle_plan(bucket_name, cutoff_date, storage_class, budget, position=None, dry_run=False):
+    """
+    Plan mode: analyse the bucket, merge transition rules into its lifecycle
+    configuration and copy only the candidates the rules cannot cover.
+    Returns (archived_files, plan summary, resume position or None when finished).
+    """
+    position = position or {}
+    days = (datetime.now(timezone.utc) - cutoff_date).days
+    archived_files = []
+
+    def archive(key, size):
+        if not dry_run and archive_object(bucket_name, key, storage_class, size):
+            archived_files.append(key)
+
+    if position.get('phase') != 'copy':
+        if position:
+            print(f"Resuming analysis after key: {position.get('last_key')}")
+        stats, resume = analyse_bucket(bucket_name, cutoff_date, budget, position, archive)
+        if resume:
+            print("Out of time while listing; the analysis resumes on the next run")
+            return archived_files, {'rules': None}, {'phase': 'analyse', **resume}
+        plan, covered = apply_lifecycle_plan(bucket_name, stats, days, storage_class, dry_run)
+        # Prefixes left without a rule (MAX_LIFECYCLE_RULES) are listed again for their larger candidates
+        # (root-level keys were all copied during the analysis)
+        pending = sorted(p for p, entry in stats['prefixes'].items()
+                         if p and p not in covered and entry['candidates'] > entry['small_candidates'])
+        last_key = None
+    else:
+        plan, pending, last_key = position['plan'], position['pending'], position.get('last_key')
+        print(f"Resuming the copy of {len(pending)} prefixes without a lifecycle rule")
+
+    if dry_run:
+        return archived_files, plan, None
+    while pending:
+        last_key = archive_prefix(bucket_name, pending[0], cutoff_date, archive, budget, last_key)
+        if last_key is not None:
+            print("Out of time; remaining objects will be archived on the next run")
+            return archived_files, plan, {'phase': 'copy', 'plan': plan, 'pending': pending, 'last_key': last_key}
+        pending = pending[1:]
+    return archived_files, plan, None
+
+
 def lambda_handler(event, context):
     # Read bucket name from environment variable (recommended)
     bucket_name = os.environ.get('BUCKET_NAME', 'your-s3-bucket-name')
     glacier_storage_class = 'GLACIER'  # or 'GLACIER_IR' (Instant Retrieval) if you prefer faster retrieval
+    s3 = get_client('s3')
 
     print(f"Checking for files older than {MONTHS_OLD} months in bucket: {bucket_name}")
 
     # Calculate the cutoff date
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=MONTHS_OLD * 30)
 
-    # List all objects in the bucket
-    paginator = s3.get_paginator('list_objects_v2')
-    archived_files = []
-
-    for page in paginator.paginate(Bucket=bucket_name):
-        if 'Contents' not in page:
-            print("No files found in the bucket.")
-            continue
-
-        for obj in page['Contents']:
-            key = obj['Key']
-            last_modified = obj['LastModified']
-
-            # Check if file is older than 6 months
-            if last_modified < cutoff_date:
-                # Get the current storage class (skip if already Glacier)
-                current_storage_class = obj.get('StorageClass', 'STANDARD')
-                if current_storage_class in ['GLACIER', 'DEEP_ARCHIVE', 'GLACIER_IR']:
-                    print(f"Skipping {key} (already archived)")
-                    continue
-
-                try:
-                    # Copy object to same location with Glacier storage class
-                    s3.copy_object(
-                        Bucket=bucket_name,
-                        CopySource={'Bucket': bucket_name, 'Key': key},
-                        Key=key,
-                        StorageClass=glacier_storage_class,
-                        MetadataDirective='COPY'
-                    )
-
-                    # Delete the old version
-                    s3.delete_object(Bucket=bucket_name, Key=key)
+    budget = TimeBudget(context)
+    event = event or {}
+    if event.get('mode', ARCHIVE_MODE) == 'plan':
+        # A dry run copies nothing, so it neither resumes nor leaves a checkpoint for a real run
+        dry_run = bool(event.get('dry_run'))
+        checkpoint = checkpoint_from_env('glacier-archiver', f"{bucket_name}:plan", s3=s3)
+        archived_files, plan, resume_at = archive_with_lifecycle_plan(
+            bucket_name, cutoff_date, glacier_storage_class, budget,
+            position=None if dry_run else checkpoint.load(), dry_run=dry_run)
+        if not dry_run:
+            if resume_at:
+                checkpoint.save(**resume_at)
+            else:
+                checkpoint.complete()
+        return {
+            'statusCode': 200,
+            'mode': 'plan',
+            'complete': resume_at is None,
+            'archived_files_count': len(archived_files),
+            'archived_files': archived_files,
+            **plan
+        }
 
-                    archived_files.append(key)
-                    print(f"Archived: {key}")
+    # Resume where the previous run stopped, if it ran out of time
+    if SHARD_MODE in ('prefix', 'range'):
+        checkpoint = checkpoint_from_env('glacier-archiver', f"{bucket_name}:{SHARD_MODE}", s3=s3)
+        archived_files, resume_at = archive_sharded(bucket_name, cutoff_date, glacier_storage_class,
+                                                    checkpoint, budget)
+    else:
+        checkpoint = checkpoint_from_env('glacier-archiver', bucket_name, s3=s3)
+        archived_files, resume_at = archive_sequential(bucket_name, cutoff_date, glacier_storage_class,
+                                                       checkpoint, budget)
 
-                except Exception as e:
-                    print(f"Error archiving {key}: {str(e)}")
+    if resume_at:
+        checkpoint.save(**resume_at)
+    else:
+        checkpoint.complete()
 
-    print(f"\n✅ Archival complete. Total files moved: {len(archived_files)}")
+    print(f"\n✅ Archival {'paused' if resume_at else 'complete'}. Total files moved: {len(archived_files)}")
+    get_executor().log_metrics()
     if archived_files:
         print("Archived files list:")
         for file in archived_files:
@@ -66,6 +662,7 @@ def lambda_handler(event, context):
 
     return {
         'statusCode': 200,
+        'complete': resume_at is None,
         'archived_files_count': len(archived_files),
         'archived_files': archived_files
     }
@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for the handlers. Run from the repository root, e.g.
+
+    python -m benchmarks.glacier_sharded_listing
+
+They use the in-memory fakes in benchmarks.fakes and never call AWS.
+"""
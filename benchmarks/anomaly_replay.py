@@ -0,0 +1,128 @@
+"""
+Replay months of ELB 5xx error-rate datapoints through the anomaly detector.
+
+Synthetic series (one per load balancer, 5-minute points) have a daily
+error-rate cycle with busier peak hours, noise, and labelled incidents:
+short spikes and slow burns that ramp up over hours. The detector sees every
+point once, as it would across scheduled runs, and the report gives the cost
+per update, the persisted state size and event-level precision/recall next
+to the static-threshold rule.
+
+    python -m benchmarks.anomaly_replay --days 90 --elbs 20
+    python -m benchmarks.anomaly_replay --trace rates.csv
+
+A recorded trace is a CSV of `timestamp,error_rate_percent[,label]` rows
+(epoch seconds or ISO 8601; label 1 marks incident points).
+"""
+import argparse
+import json
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+from common.anomaly import AnomalyDetector
+
+STEP = 300
+STATIC_RATE_THRESHOLD = 5.0  # percent, the assignment10 default
+
+
+def synthetic_series(days, seed):
+    """[(timestamp, rate, incident_id or None)] for one load balancer."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+    points = days * 86400 // STEP
+    base = rng.uniform(0.2, 1.0)
+    rates = []
+    for i in range(points):
+        hour = (i * STEP // 3600) % 24
+        # Peak hours run a higher, noisier error rate (up to ~3x base, above the static threshold on bad ELBs)
+        peak = 1 + 2 * max(0.0, math.sin(math.pi * (hour - 8) / 12)) if 8 <= hour <= 20 else 1
+        rates.append(max(0.0, base * peak * rng.lognormvariate(0, 0.35)))
+    labels = [None] * points
+    for incident in range(max(1, days // 7)):
+        at = rng.randrange(288, points - 288)
+        if rng.random() < 0.5:
+            length, shape = rng.randint(2, 6), 'spike'
+        else:
+            length, shape = rng.randint(24, 72), 'burn'
+        for j in range(length):
+            if at + j >= points:
+                break
+            extra = base * (6 if shape == 'spike' else 1.5 * (j + 1) / length + 0.8)
+            rates[at + j] += extra
+            labels[at + j] = incident
+    return [(start + i * STEP, rates[i], labels[i]) for i in range(points)]
+
+
+def load_trace(path):
+    points = []
+    with open(path) as f:
+        for line in f:
+            fields = [x.strip() for x in line.split(',')]
+            try:
+                ts = float(fields[0]) if fields[0].replace('.', '', 1).isdigit() \
+                    else datetime.fromisoformat(fields[0].replace('Z', '+00:00')).timestamp()
+                label = 0 if len(fields) < 3 or fields[2] in ('', '0') else 1
+                points.append((ts, float(fields[1]), label or None))
+            except (ValueError, IndexError):
+                continue  # header row
+    return points
+
+
+def score(alerts, series):
+    """
+    Event-level counts: an incident is caught by any alert inside it, and a
+    run of consecutive alerting points outside every incident is one false event.
+    """
+    incidents = {label for _, _, label in series if label is not None}
+    caught = {series[i][2] for i in alerts if series[i][2] is not None}
+    outside = [i for i in alerts if series[i][2] is None]
+    false = sum(1 for k, i in enumerate(outside) if k == 0 or outside[k - 1] != i - 1)
+    return len(caught), len(incidents), false
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--elbs', type=int, default=20)
+    parser.add_argument('--trace', help='recorded CSV of timestamp,rate[,label]')
+    args = parser.parse_args()
+
+    if args.trace:
+        fleet = {'trace': load_trace(args.trace)}
+    else:
+        fleet = {f'app/elb{n}/x': synthetic_series(args.days, seed=n) for n in range(args.elbs)}
+
+    detector = AnomalyDetector(min_scale=0.02, log_values=True)  # as assignment10 configures it
+    totals = {'detector': [0, 0, 0], 'static': [0, 0, 0]}
+    updates = 0
+    elapsed = 0.0
+    for lb, series in fleet.items():
+        detector_alerts = []
+        started = time.perf_counter()
+        for i, (ts, rate, _) in enumerate(series):
+            result = detector.update(lb, int(ts // 3600) % 24, rate, ts)
+            if result and result['anomalous']:
+                detector_alerts.append(i)
+                if result['reason'] == 'sustained':
+                    detector.reset_cusum(lb)
+        elapsed += time.perf_counter() - started
+        updates += len(series)
+        static_alerts = [i for i, (_, rate, _) in enumerate(series) if rate >= STATIC_RATE_THRESHOLD]
+        for name, alerts in (('detector', detector_alerts), ('static', static_alerts)):
+            for k, v in enumerate(score(alerts, series)):
+                totals[name][k] += v
+
+    state_bytes = len(json.dumps(detector.to_state()))
+    print(f"{len(fleet)} series, {updates} datapoints, {elapsed / updates * 1e6:.2f} us per update, "
+          f"state {state_bytes / 1024:.1f} KiB ({state_bytes // len(fleet)} bytes per ELB)")
+    print(f"{'rule':<10} {'incidents caught':>17} {'false events':>13} {'precision':>10} {'recall':>7}")
+    for name, (caught, incidents, false) in totals.items():
+        precision = caught / (caught + false) if caught + false else 0.0
+        print(f"{name:<10} {caught:>8}/{incidents:<8} {false:>13} {precision:>10.2f} "
+              f"{caught / incidents if incidents else 0:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
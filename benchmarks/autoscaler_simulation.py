@@ -0,0 +1,139 @@
+"""
+Replay load traces through the assignment12 scaling policies.
+
+Each trace is total demand in requests/s per PERIOD_SECONDS step. The
+simulated fleet serves demand / serving instances per host; instances take
+--boot-periods steps from launch to serving. Each step the policy sees the
+load per serving host, acts, and the step counts as overloaded if the hosts
+serving after the action (including any that serve within the step, boot 0)
+are still above the high threshold. Every policy starts from the
+same state and sees the same trace, and the report shows how quickly each one
+reacts (periods and minutes spent overloaded), what it costs (instance-hours)
+and how often it acts (flapping). The "+ pool" rows add a warm pool of
+stopped instances that serve after --warm-boot-periods instead of
+--boot-periods (defaults: 1 step against 3, i.e. about 5 minutes to start a
+bootstrapped instance against 15 to launch and bootstrap one).
+
+    python -m benchmarks.autoscaler_simulation
+    python -m benchmarks.autoscaler_simulation --trace recorded.csv --boot-periods 2 --warm-boot-periods 0
+
+A recorded trace is a CSV/text file with one demand value per line (an
+optional second column is used when the first is a timestamp).
+"""
+import argparse
+import math
+from datetime import datetime, timedelta, timezone
+
+from assignment12_auto_scale_ec2_based_on_loading import handler
+
+PERIOD_SECONDS = 300
+HIGH, LOW, TARGET = 80.0, 20.0, 50.0  # requests/s per host
+
+BASE_POLICY = {
+    'high': HIGH, 'low': LOW, 'target': TARGET, 'tolerance': 0.1,
+    'scale_out_steps': [[0, 1]], 'scale_in_steps': [[0, 1]],
+    'min': 1, 'max': 40, 'scale_out_cooldown': 300, 'scale_in_cooldown': 900,
+}
+POLICIES = {
+    'step +/-1 (legacy)': {**BASE_POLICY, 'type': 'step', 'scale_out_cooldown': 0, 'scale_in_cooldown': 0},
+    'step +/-1, cooldown': {**BASE_POLICY, 'type': 'step'},
+    'step table': {**BASE_POLICY, 'type': 'step', 'scale_out_steps': [[0, 1], [40, 3], [120, 6]],
+                   'scale_in_steps': [[0, 1], [10, 2]]},
+    'target tracking': {**BASE_POLICY, 'type': 'target'},
+}
+
+
+def synthetic_traces():
+    steps_per_day = 86400 // PERIOD_SECONDS
+    spike = [100.0] * 24 + [900.0] * 24 + [100.0] * 48
+    ramp = [100.0 + 10 * i for i in range(72)] + [820.0] * 24
+    daily = [100 + 400 * max(0.0, math.sin(math.pi * (i % steps_per_day) / steps_per_day)) ** 2
+             for i in range(2 * steps_per_day)]
+    return {'spike x9': spike, 'linear ramp': ramp, 'daily cycle (2 days)': daily}
+
+
+def load_trace(path):
+    values = []
+    with open(path) as f:
+        for line in f:
+            fields = [x.strip() for x in line.split(',') if x.strip()]
+            if not fields:
+                continue
+            try:
+                values.append(float(fields[-1] if len(fields) > 1 else fields[0]))
+            except ValueError:
+                continue  # header row
+    return values
+
+
+def simulate(policy, trace, boot_periods, initial=1, warm_pool=0, warm_boot_periods=0):
+    """
+    With warm_pool > 0, scale-out starts stopped pool members first (serving
+    after warm_boot_periods), scale-in stops instances back into the pool and
+    the pool refills with cold launches that are ready after boot_periods.
+    """
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    launches = [-boot_periods] * initial  # step from which each live instance serves
+    pool = warm_pool
+    refilling = []  # steps at which refill launches join the pool
+    state = {}
+    overloaded = actions = 0
+    instance_periods = 0
+    for step, demand in enumerate(trace):
+        pool += sum(1 for ready in refilling if ready == step)
+        refilling = [ready for ready in refilling if ready > step]
+        serving = sum(1 for ready in launches if ready <= step)
+        per_host = demand / max(serving, 1)
+        instance_periods += len(launches)
+
+        capacity = len(launches)
+        desired, reason = handler.decide(policy, per_host, capacity, state, now)
+        if desired != capacity:
+            actions += 1
+            if desired > capacity:
+                warm = min(pool, desired - capacity)
+                pool -= warm
+                launches += [step + warm_boot_periods] * warm + [step + boot_periods] * (desired - capacity - warm)
+            else:
+                # Oldest first, like select_instances_to_terminate()
+                launches = sorted(launches)[capacity - desired:]
+                pool += min(capacity - desired, max(0, warm_pool - pool - len(refilling)))
+            if warm_pool:
+                refilling += [step + boot_periods] * max(0, warm_pool - pool - len(refilling))
+            state = {'last_action': reason, 'last_action_at': now.isoformat()}
+        if demand / max(sum(1 for ready in launches if ready <= step), 1) > policy['high']:
+            overloaded += 1
+        now += timedelta(seconds=PERIOD_SECONDS)
+    return {
+        'overloaded_periods': overloaded,
+        'overloaded_minutes': overloaded * PERIOD_SECONDS // 60,
+        'instance_hours': round(instance_periods * PERIOD_SECONDS / 3600, 1),
+        'actions': actions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--trace', help='recorded demand trace (one value per line)')
+    parser.add_argument('--boot-periods', type=int, default=3, help='steps from launch to serving')
+    parser.add_argument('--warm-pool', type=int, default=4, help='warm pool size for the warm-pool rows')
+    parser.add_argument('--warm-boot-periods', type=int, default=1, help='steps from starting a pool member to serving')
+    args = parser.parse_args()
+
+    traces = {args.trace: load_trace(args.trace)} if args.trace else synthetic_traces()
+    for name, trace in traces.items():
+        print(f"\n{name}: {len(trace)} periods of {PERIOD_SECONDS}s, peak {max(trace):.0f} req/s, "
+              f"target {TARGET:.0f} req/s per host, boot {args.boot_periods} period(s), "
+              f"warm start {args.warm_boot_periods} period(s)")
+        print(f"{'policy':<28} {'overloaded':>10} {'minutes':>8} {'inst-hours':>10} {'actions':>8}")
+        runs = [(name, policy, 0) for name, policy in POLICIES.items()]
+        runs += [(f'{name} + pool', POLICIES[name], args.warm_pool) for name in ('step table', 'target tracking')]
+        for policy_name, policy, warm_pool in runs:
+            r = simulate(policy, trace, args.boot_periods, warm_pool=warm_pool,
+                         warm_boot_periods=args.warm_boot_periods)
+            print(f"{policy_name:<28} {r['overloaded_periods']:>10} {r['overloaded_minutes']:>8} "
+                  f"{r['instance_hours']:>10} {r['actions']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Decode + diff cost for large DynamoDB stream images.
+
+Each synthetic item has --attributes top-level attributes of every type
+(strings, numbers, sets, nested maps and lists); an update changes a couple
+of them, one deep inside a map, and rewrites one number as "80.0" instead of
+"80". Compared per MODIFY record (old and new image):
+
+- legacy: the old assignment7 flattening, {k: list(v.values())[0]}, then a
+  comparison of the keys of the new image;
+- boto3: TypeDeserializer on both images, then common.dynamodb.diff;
+- decode+diff: common.dynamodb.decode_image on both images, then diff;
+- diff_images: common.dynamodb.diff_images, which decodes only differing attributes.
+
+    python -m benchmarks.dynamodb_diff --attributes 200 --records 2000
+"""
+import argparse
+import copy
+import random
+import time
+import tracemalloc
+
+from common.dynamodb import decode_image, diff, diff_images
+
+
+def synthetic_image(attributes, rng):
+    image = {'Id': {'S': 'item-1'}}
+    for i in range(attributes):
+        kind = i % 6
+        if kind == 0:
+            image[f's{i}'] = {'S': f'value-{rng.randrange(10 ** 6)}'}
+        elif kind == 1:
+            image[f'n{i}'] = {'N': str(rng.randrange(1000))}
+        elif kind == 2:
+            image[f'ss{i}'] = {'SS': [f'tag{j}' for j in range(5)]}
+        elif kind == 3:
+            image[f'm{i}'] = {'M': {'city': {'S': 'Leeds'}, 'zip': {'S': 'LS1'},
+                                    'geo': {'M': {'lat': {'N': '53.8'}, 'lon': {'N': '-1.54'}}}}}
+        elif kind == 4:
+            image[f'l{i}'] = {'L': [{'N': str(j)} for j in range(10)]}
+        else:
+            image[f'b{i}'] = {'BOOL': bool(i % 2)}
+    return image
+
+
+def synthetic_update(image):
+    new = copy.deepcopy(image)
+    numbers = [k for k in new if k.startswith('n')]
+    new[numbers[0]] = {'N': new[numbers[0]]['N'] + '.0'}  # same number, different text
+    new[numbers[1]] = {'N': str(int(new[numbers[1]]['N']) + 1)}
+    maps = [k for k in new if k.startswith('m')]
+    new[maps[0]]['M']['geo']['M']['lat'] = {'N': '53.9'}
+    return new
+
+
+def legacy(old_image, new_image):
+    old_item = {k: list(v.values())[0] for k, v in old_image.items()}
+    new_item = {k: list(v.values())[0] for k, v in new_image.items()}
+    return [key for key in new_item if old_item.get(key) != new_item.get(key)]
+
+
+def boto3_diff(old_image, new_image, deserializer):
+    old = {k: deserializer.deserialize(v) for k, v in old_image.items()}
+    new = {k: deserializer.deserialize(v) for k, v in new_image.items()}
+    return diff(old, new)
+
+
+def measure(fn, pairs):
+    started = time.perf_counter()
+    for old, new in pairs:
+        result = fn(old, new)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn(*pairs[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / len(pairs) * 1e6, peak, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--attributes', type=int, default=200)
+    parser.add_argument('--records', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    old = synthetic_image(args.attributes, rng)
+    pairs = [(old, synthetic_update(old))] * args.records
+
+    candidates = {'legacy': legacy}
+    try:
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+        candidates['boto3'] = lambda o, n: boto3_diff(o, n, deserializer)
+    except ImportError:
+        print("boto3 not installed; skipping the TypeDeserializer baseline")
+    candidates['decode+diff'] = lambda o, n: diff(decode_image(o), decode_image(n))
+    candidates['diff_images'] = diff_images
+
+    print(f"{args.records} records, {len(old)} attributes per image")
+    print(f"{'method':<12} {'us/record':>10} {'peak alloc KiB':>15} {'changes':>8}")
+    for name, fn in candidates.items():
+        per_record, peak, changes = measure(fn, pairs)
+        print(f"{name:<12} {per_record:>10.1f} {peak / 1024:>15.1f} {changes:>8}")
+    print("legacy reports the reformatted number as a change and only the top-level map name for the nested one")
+
+
+if __name__ == '__main__':
+    main()
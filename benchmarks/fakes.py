@@ -0,0 +1,255 @@
+"""
+In-memory stand-ins for the AWS APIs the handlers call, with an optional
+per-request latency so concurrency effects show up as they would against
+the real endpoints. Only the parameters the handlers use are implemented.
+"""
+import bisect
+import random
+import threading
+import time
+import zlib
+from datetime import date, datetime, timezone, timedelta
+
+
+class FakeS3:
+    """Flat keyspace with list_objects_v2 semantics (1000 keys per page)."""
+
+    def __init__(self, objects=None, latency=0.0):
+        # objects: {key: {'LastModified': datetime, 'Size': int, 'StorageClass': str}}
+        self.objects = dict(objects or {})
+        self.keys = sorted(self.objects)
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, StartAfter=None,
+                        ContinuationToken=None, MaxKeys=1000):
+        self._call('list_objects_v2')
+        after = ContinuationToken or StartAfter
+        start = bisect.bisect_right(self.keys, after) if after else bisect.bisect_left(self.keys, Prefix)
+        contents, prefixes, last = [], [], None
+        i = start
+        while i < len(self.keys) and len(contents) + len(prefixes) < MaxKeys:
+            key = self.keys[i]
+            if not key.startswith(Prefix):
+                break
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                common = Prefix + rest[:rest.index(Delimiter) + len(Delimiter)]
+                prefixes.append({'Prefix': common})
+                # skip every key under this common prefix
+                i = bisect.bisect_left(self.keys, common + '\U0010ffff')
+                last = self.keys[i - 1]
+                continue
+            contents.append({'Key': key, **self.objects[key]})
+            last = key
+            i += 1
+        truncated = i < len(self.keys) and self.keys[i].startswith(Prefix)
+        page = {'IsTruncated': truncated, 'KeyCount': len(contents) + len(prefixes)}
+        if contents:
+            page['Contents'] = contents
+        if prefixes:
+            page['CommonPrefixes'] = prefixes
+        if truncated:
+            page['NextContinuationToken'] = last
+        return page
+
+    def copy_object(self, **kwargs):
+        self._call('copy_object')
+        return {}
+
+    def delete_object(self, **kwargs):
+        self._call('delete_object')
+        return {}
+
+
+def make_bucket_objects(count, prefixes=16, old_fraction=0.5, size=1024):
+    """Synthetic keys spread evenly over `prefixes` top-level folders."""
+    now = datetime.now(timezone.utc)
+    objects = {}
+    for i in range(count):
+        age = timedelta(days=400) if (i % 100) < old_fraction * 100 else timedelta(days=1)
+        objects[f"logs-{i % prefixes:03d}/2024/{i:09d}.gz"] = {
+            'LastModified': now - age,
+            'Size': size,
+            'StorageClass': 'STANDARD'
+        }
+    return objects
+
+
+class FakeSNS:
+    """publish_batch with per-call latency; entries fail with probability failure_rate."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.messages = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        if self.latency:
+            time.sleep(self.latency)
+        successful, failed = [], []
+        with self._lock:
+            self.calls += 1
+            for entry in PublishBatchRequestEntries:
+                if self._random.random() < self.failure_rate:
+                    failed.append({'Id': entry['Id'], 'Code': 'InternalError', 'SenderFault': False})
+                else:
+                    successful.append({'Id': entry['Id'], 'MessageId': f'msg-{self.messages}'})
+                    self.messages += 1
+        return {'Successful': successful, 'Failed': failed}
+
+
+class FakeComprehend:
+    """
+    Batch sentiment and language calls with Comprehend's limits (25 texts,
+    5000 bytes each). Sentiment comes from a few keywords, which is enough to
+    exercise batching, caching and routing; languages are 'en' unless the
+    text starts with '[xx]'.
+    """
+
+    POSITIVE = ('great', 'love', 'excellent', 'perfect', 'good', 'amazing')
+    NEGATIVE = ('terrible', 'bad', 'broken', 'awful', 'refund', 'worst')
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.documents = 0
+        self._lock = threading.Lock()
+
+    def _call(self, name, texts):
+        if len(texts) > 25:
+            raise ValueError(f"{name}: {len(texts)} documents, the limit is 25")
+        for text in texts:
+            if len(text.encode('utf-8')) > 5000:
+                raise ValueError(f"{name}: document over 5000 bytes")
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.documents += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def sentiment(self, text):
+        words = text.lower()
+        positive = sum(words.count(w) for w in self.POSITIVE)
+        negative = sum(words.count(w) for w in self.NEGATIVE)
+        if positive and negative:
+            scores = {'Positive': 0.3, 'Negative': 0.3, 'Neutral': 0.1, 'Mixed': 0.3}
+        elif positive:
+            scores = {'Positive': 0.9, 'Negative': 0.03, 'Neutral': 0.05, 'Mixed': 0.02}
+        elif negative:
+            scores = {'Positive': 0.03, 'Negative': 0.9, 'Neutral': 0.05, 'Mixed': 0.02}
+        else:
+            scores = {'Positive': 0.1, 'Negative': 0.1, 'Neutral': 0.75, 'Mixed': 0.05}
+        return max(scores, key=scores.get).upper(), scores
+
+    def batch_detect_sentiment(self, TextList, LanguageCode):
+        self._call('batch_detect_sentiment', TextList)
+        results = []
+        for n, text in enumerate(TextList):
+            sentiment, scores = self.sentiment(text)
+            results.append({'Index': n, 'Sentiment': sentiment, 'SentimentScore': scores})
+        return {'ResultList': results, 'ErrorList': []}
+
+    def batch_detect_dominant_language(self, TextList):
+        self._call('batch_detect_dominant_language', TextList)
+        return {'ResultList': [
+            {'Index': n, 'Languages': [{'LanguageCode': text[1:3] if text.startswith('[') else 'en', 'Score': 0.99}]}
+            for n, text in enumerate(TextList)
+        ], 'ErrorList': []}
+
+
+class FakeCostSource:
+    """
+    Synthetic daily costs with the CostExplorerSource interface of the
+    assignment6 billing analysis. A day's cost per group depends only
+    on the seed, day and group, so any query window returns the same numbers.
+    Costs follow a slow trend and a weekend dip with noise; is_spike() tells
+    which days were multiplied as injected incidents.
+    """
+
+    def __init__(self, services=12, tag_values=('backend', 'frontend', 'data', ''), seed=0, spike_rate=0.01,
+                 latency=0.0):
+        self.services = [f"Service {n}" for n in range(services)]
+        self.tag_values = list(tag_values)
+        self.seed = seed
+        self.spike_rate = spike_rate
+        self.latency = latency  # seconds per query, to stand in for Cost Explorer
+        self.calls = 0
+        self.days_returned = 0
+
+    def _random(self, day, group):
+        return random.Random(zlib.crc32(f"{self.seed}:{day}:{group}".encode()))
+
+    def is_spike(self, day, group):
+        return self._random(day, group).random() < self.spike_rate
+
+    def cost(self, day, group):
+        base = 1 + zlib.crc32(f"{self.seed}:{group}".encode()) % 40
+        rng = self._random(day, group)
+        spike = rng.random() < self.spike_rate
+        trend = 1 + 0.002 * (day - date(2024, 1, 1)).days
+        weekend = 0.7 if day.weekday() >= 5 else 1.0
+        return round(base * trend * weekend * rng.lognormvariate(0, 0.1) * (4 if spike else 1), 4)
+
+    def daily_costs(self, start, end, dimension):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        groups = [v or '(untagged)' for v in self.tag_values] if dimension.startswith('TAG:') else self.services
+        prefix = dimension[4:] + ':' if dimension.startswith('TAG:') else ''
+        days = {}
+        day = start
+        while day < end:
+            days[day.isoformat()] = {g: self.cost(day, prefix + g) for g in groups}
+            day += timedelta(days=1)
+        self.days_returned += len(days)
+        return days
+
+
+class _Body:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+    def read(self, *args):
+        return self.body
+
+
+def offline_endpoints(session):
+    """
+    Answer every request of the session's real boto3 clients locally with an
+    empty 200 response, so client creation, request signing and response
+    parsing are the real ones but nothing goes over the network. List members
+    of the result are filled in empty, as AWS returns them. The session needs
+    (any) credentials.
+    """
+    from urllib.parse import parse_qs
+    from botocore.awsrequest import AWSResponse
+
+    def send(request, **kwargs):
+        body = request.body or b''
+        action = parse_qs(body.decode() if isinstance(body, bytes) else str(body)).get('Action')
+        # Query-protocol services (EC2, SNS, ELB, ...) need the result element; JSON and REST ones take no body
+        xml = f"<{action[0]}Response><{action[0]}Result/></{action[0]}Response>".encode() if action else b''
+        return AWSResponse(request.url, 200, {}, _Body(xml))
+
+    def fill(parsed, model, **kwargs):
+        if model.output_shape is not None:
+            for name, shape in model.output_shape.members.items():
+                if shape.type_name == 'list':
+                    parsed.setdefault(name, [])
+
+    session.events.register('before-send', send)
+    session.events.register('after-call', fill)
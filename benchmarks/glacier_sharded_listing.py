@@ -0,0 +1,62 @@
+"""
+Listing throughput of the Glacier archiver against a fake S3 as the number of
+shards grows. The keyspace is split into equal key ranges (SHARD_MODE=range)
+and each list_objects_v2 call sleeps for --latency seconds, which is what
+dominates real listings. Peak traced memory is measured in a second pass to
+show that the bounded candidate queue keeps it flat.
+
+    python -m benchmarks.glacier_sharded_listing --keys 200000 --latency 0.02
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timezone, timedelta
+
+from assignment9_archive_old_files_from_s3_to_glacier import handler
+from benchmarks.fakes import FakeS3, make_bucket_objects
+from common.clients import register_client
+
+
+def split_points(keys, shards):
+    """Keys that cut the sorted keyspace into `shards` equal ranges."""
+    step = len(keys) / shards
+    return ','.join(keys[int(step * i) - 1] for i in range(1, shards))
+
+
+def run(fake, shards, queue_size):
+    register_client('s3', fake)
+    cutoff = datetime.now(timezone.utc) - timedelta(days=180)
+    mode = 'range' if shards > 1 else 'none'
+    shard_list = handler.discover_shards('bench', mode=mode, ranges=split_points(fake.keys, shards))
+    progress = {'last_keys': {}, 'done': []}
+    started = time.monotonic()
+    found = sum(1 for _ in handler.iter_sharded_candidates('bench', shard_list, cutoff, progress,
+                                                           workers=shards, queue_size=queue_size))
+    return found, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per list call')
+    parser.add_argument('--queue-size', type=int, default=handler.CANDIDATE_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    objects = make_bucket_objects(args.keys)
+    print(f"{args.keys} keys, {args.latency * 1000:.0f} ms per list call, queue size {args.queue_size}")
+    print(f"{'shards':>6} {'candidates':>10} {'seconds':>8} {'keys/s':>10} {'list calls':>10} {'peak MiB':>9}")
+    for shards in (1, 2, 4, 8, 16, 32):
+        fake = FakeS3(objects, latency=args.latency)
+        found, elapsed = run(fake, shards, args.queue_size)
+        calls = fake.calls.get('list_objects_v2', 0)
+
+        tracemalloc.start()
+        run(FakeS3(objects, latency=args.latency), shards, args.queue_size)
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        print(f"{shards:>6} {found:>10} {elapsed:>8.2f} {args.keys / elapsed:>10.0f} {calls:>10} {peak:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
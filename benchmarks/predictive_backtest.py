@@ -0,0 +1,88 @@
+"""
+Offline backtest of the assignment12 demand forecast.
+
+Replays an hourly requests/s series: the model is refitted once a day on the
+history so far and forecasts the next day. Reports forecast error and the
+capacity predictive scaling would have provisioned against what the demand
+needed, next to a reactive baseline sized for the previous hour.
+
+    python -m benchmarks.predictive_backtest
+    python -m benchmarks.predictive_backtest --trace demand.csv --target 50
+
+A recorded series is a CSV with `timestamp,value` rows (ISO 8601 or epoch
+seconds, one row per hour). Needs NumPy.
+"""
+import argparse
+import json
+import math
+import random
+import time
+from datetime import datetime, timezone
+
+from assignment12_auto_scale_ec2_based_on_loading import handler
+
+
+def synthetic_series(weeks=6, seed=7):
+    """Hourly demand with a daily ramp, quieter weekends, growth and noise."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()  # a Monday
+    timestamps, values = [], []
+    for h in range(weeks * 168):
+        hour, weekday = h % 24, (h // 24) % 7
+        daily = max(0.0, math.sin(math.pi * (hour - 6) / 14)) if 6 <= hour <= 20 else 0.0
+        weekly = 0.4 if weekday >= 5 else 1.0
+        growth = 1 + 0.002 * h / 24
+        timestamps.append(start + h * 3600)
+        values.append(max(0.0, (60 + 600 * daily * weekly) * growth * rng.gauss(1, 0.08)))
+    return timestamps, values
+
+
+def load_series(path):
+    timestamps, values = [], []
+    with open(path) as f:
+        for line in f:
+            fields = [x.strip() for x in line.split(',')]
+            if len(fields) < 2:
+                continue
+            try:
+                ts = float(fields[0]) if fields[0].replace('.', '', 1).isdigit() \
+                    else datetime.fromisoformat(fields[0].replace('Z', '+00:00')).timestamp()
+                timestamps.append(ts)
+                values.append(float(fields[1]))
+            except ValueError:
+                continue  # header row
+    return timestamps, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--trace', help='CSV of timestamp,requests_per_second (hourly)')
+    parser.add_argument('--target', type=float, default=50.0, help='requests/s per instance')
+    parser.add_argument('--train-weeks', type=int, default=2)
+    parser.add_argument('--headroom', type=float, default=handler.FORECAST_HEADROOM)
+    args = parser.parse_args()
+
+    timestamps, values = load_series(args.trace) if args.trace else synthetic_series()
+    policy = {'target': args.target, 'min': 1, 'max': 1000}
+
+    started = time.perf_counter()
+    model = handler.fit_forecast_model(timestamps, values)
+    fit_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    scores = handler.backtest(timestamps, values, policy, train_hours=args.train_weeks * 168,
+                              headroom=args.headroom)
+    backtest_s = time.perf_counter() - started
+
+    print(f"{len(values)} hourly points, trained on {args.train_weeks} weeks, scored on {scores['hours']} hours")
+    print(f"model fit {fit_ms:.1f} ms on the full series, cached model {len(json.dumps(model))} bytes, "
+          f"backtest {backtest_s:.2f} s")
+    print(f"forecast MAE {scores['forecast_mae']} req/s, MAPE {scores['forecast_mape']}")
+    print(f"{'provisioning':<12} {'instance-h':>10} {'over-prov. inst-h':>18} {'under-prov. hours':>18}")
+    for name in ('predictive', 'reactive'):
+        r = scores[name]
+        print(f"{name:<12} {r['instance_hours']:>10.0f} {r['over_provisioned_instance_hours']:>18.0f} "
+              f"{r['under_provisioned_hours']:>18}")
+
+
+if __name__ == '__main__':
+    main()
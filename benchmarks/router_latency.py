@@ -0,0 +1,141 @@
+"""
+Cold and warm latency of every route through router.lambda_handler against
+the handler deployed as its own function.
+
+Each route gets a representative event (a schedule, a direct invoke, a
+DynamoDB stream batch, SQS records). Real boto3 clients are used, with every
+request answered locally by benchmarks.fakes.offline_endpoints, so client
+creation, signing and parsing count but the network does not. Per route:
+
+- separate: a fresh interpreter imports the handler module and invokes it
+  twice (cold = import + first invoke, including boto3; warm = second invoke);
+- router: the same through the router in a fresh interpreter;
+- shared: one interpreter runs every route through the router in turn, which
+  is what the single bundle does once its container is warm: a route's first
+  dispatch only imports its module, the session and clients are already there.
+
+A cold start of a separate function also pays interpreter startup (measured
+here) and the Lambda runtime's own initialisation (not measured), once per
+function instead of once per bundle.
+
+    python -m benchmarks.router_latency --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import router
+
+
+def scheduled(rule):
+    return {'version': '0', 'detail-type': 'Scheduled Event', 'source': 'aws.events', 'detail': {},
+            'resources': [f'arn:aws:events:us-east-1:123456789012:rule/{rule}']}
+
+
+EVENTS = {
+    'ec2-automanage': {'route': 'ec2-automanage', 'action': 'schedule'},
+    's3-cleanup': scheduled('s3-cleanup'),
+    's3-encryption-check': scheduled('s3-encryption-check'),
+    'ebs-snapshot-cleanup': {'route': 'ebs-snapshot-cleanup', 'dry_run': True},
+    'billing-alert': scheduled('billing-alert'),
+    'dynamodb-notify': {'Records': [{
+        'eventID': str(n), 'eventName': 'MODIFY', 'eventSource': 'aws:dynamodb',
+        'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/Orders/stream/2025-01-01T00:00:00.000',
+        'dynamodb': {'Keys': {'Id': {'S': str(n)}}, 'OldImage': {'Id': {'S': str(n)}, 'Status': {'S': 'Pending'}},
+                     'NewImage': {'Id': {'S': str(n)}, 'Status': {'S': 'Shipped'}}, 'SequenceNumber': str(n)},
+    } for n in range(10)]},
+    'review-sentiment': {'Records': [{
+        'messageId': f'm{n}', 'eventSource': 'aws:sqs', 'eventSourceARN': 'arn:aws:sqs:us-east-1:123456789012:reviews',
+        'body': text,
+    } for n, text in enumerate(['Great product, love it', 'Broken on arrival', 'Arrived on Tuesday'])]},
+    'glacier-archive': scheduled('glacier-archive'),
+    'elb-5xx': scheduled('elb-5xx'),
+    'auto-scale': scheduled('auto-scale'),
+}
+
+PRELUDE = """
+import contextlib, importlib, io, json, time
+t0 = time.perf_counter()
+from benchmarks.fakes import offline_endpoints
+from common.clients import get_session
+offline_endpoints(get_session())
+"""
+
+SINGLE = PRELUDE + """
+module = importlib.import_module({module!r})
+event = {event!r}
+with contextlib.redirect_stdout(io.StringIO()):
+    module.lambda_handler(dict(event), None)
+    t1 = time.perf_counter()
+    module.lambda_handler(dict(event), None)
+    t2 = time.perf_counter()
+print(json.dumps({{'cold': t1 - t0, 'warm': t2 - t1}}))
+"""
+
+SHARED = PRELUDE + """
+import router
+out = {{}}
+with contextlib.redirect_stdout(io.StringIO()):
+    for route, event in {events!r}.items():
+        t1 = time.perf_counter()
+        router.lambda_handler(dict(event), None)
+        t2 = time.perf_counter()
+        router.lambda_handler(dict(event), None)
+        out[route] = {{'first': (t2 - t1) + (t1 - t0 if not out else 0), 'warm': time.perf_counter() - t2}}
+print(json.dumps(out))
+"""
+
+
+def run(code):
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench', AWS_DEFAULT_REGION='us-east-1')
+    return json.loads(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                     check=True, env=env).stdout)
+
+
+def median_ms(runs, *path):
+    def get(run):
+        for key in path:
+            run = run[key]
+        return run
+    return statistics.median(get(r) for r in runs) * 1000
+
+
+def interpreter_startup(repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    startup = interpreter_startup(args.repeat)
+    shared = [run(SHARED.format(events=EVENTS)) for _ in range(args.repeat)]
+    print(f"median of {args.repeat} fresh interpreters, milliseconds; interpreter startup {startup:.0f} ms")
+    print(f"{'route':<22} {'separate':>9} {'separate':>9} | {'router':>7} {'router':>7} | {'shared':>7} {'shared':>7}")
+    print(f"{'':<22} {'cold':>9} {'warm':>9} | {'cold':>7} {'warm':>7} | {'first':>7} {'warm':>7}")
+    totals = {'separate': 0.0, 'shared': 0.0}
+    for route, event in EVENTS.items():
+        separate_event = {k: v for k, v in event.items() if k != 'route'}
+        separate = [run(SINGLE.format(module=router.ROUTES[route], event=separate_event)) for _ in range(args.repeat)]
+        routed = [run(SINGLE.format(module='router', event=event)) for _ in range(args.repeat)]
+        totals['separate'] += startup + median_ms(separate, 'cold')
+        totals['shared'] += median_ms(shared, route, 'first')
+        print(f"{route:<22} {median_ms(separate, 'cold'):>9.1f} {median_ms(separate, 'warm'):>9.2f} | "
+              f"{median_ms(routed, 'cold'):>7.1f} {median_ms(routed, 'warm'):>7.2f} | "
+              f"{median_ms(shared, route, 'first'):>7.1f} {median_ms(shared, route, 'warm'):>7.2f}")
+    print(f"first run of every job: {len(EVENTS)} separate cold starts {totals['separate']:.0f} ms, "
+          f"one bundle {startup + totals['shared']:.0f} ms (interpreter startup included, Lambda init excluded)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Tune the assignment8 local/Comprehend routing on a labelled sample.
+
+For the local model alone it reports the latency of one review, the
+throughput of batched scoring and its agreement with the labels. For each
+confidence threshold it reports the share of reviews the model would answer
+itself, its agreement with the labels on that share, and the overall
+agreement if Comprehend agreed with the labels on the rest. Finally both
+engines run through the handler against a fake Comprehend with --latency
+seconds per call.
+
+The default sample is synthetic: short obvious reviews, negations, and
+longer mixed or neutral ones. Pass --sample with a JSON Lines file of
+{"text": ..., "label": "POSITIVE|NEGATIVE|NEUTRAL|MIXED"} (e.g. reviews
+labelled by Comprehend or by hand) to tune on real data.
+
+    python -m benchmarks.sentiment_routing --reviews 5000
+    python -m benchmarks.sentiment_routing --sample labelled.jsonl
+"""
+import argparse
+import json
+import random
+import time
+
+from assignment8_analyze_sentiment_of_user_reviews import handler
+from benchmarks.fakes import FakeComprehend
+from common.clients import register_client
+
+TEMPLATES = {
+    'POSITIVE': ["great!", "Love it", "Excellent product, highly recommend", "really good value",
+                 "Perfect, thanks!", "Works great, very happy", "not bad at all", "Fast delivery, great seller"],
+    'NEGATIVE': ["terrible", "Broken on arrival, want a refund", "worst purchase ever", "not good",
+                 "Awful quality, avoid", "Stopped working after two days", "very disappointed", "useless!"],
+    'NEUTRAL': ["Arrived on Tuesday", "It is a phone case", "Ordered the blue one", "Package contained two items",
+                "The box says 500ml"],
+    'MIXED': ["Great screen but the battery is terrible", "Love the design, however it broke after a week",
+              "Good price but slow delivery", "Nice colour, though the fit is poor"],
+}
+# Reviews a lexicon gets wrong or cannot decide (sarcasm, no sentiment words, hedging)
+HARD = {
+    'POSITIVE': ["It does the job", "Would buy again", "Exactly as described", "Five stars", "No complaints"],
+    'NEGATIVE': ["Great, another one that stopped charging", "Never again", "Item never arrived",
+                 "Not what I ordered", "One star"],
+    'NEUTRAL': ["Not sure yet, will update", "Good question, I have no idea", "It is what it is"],
+    'MIXED': ["Not the best but fine for the price", "Good enough, could be better", "Bad packaging, product ok"],
+}
+FILLER = ["I bought this for my sister", "after reading the reviews", "compared with the previous model",
+          "which I use every day", "as mentioned in the description"]
+
+
+def synthetic_sample(count, seed):
+    rng = random.Random(seed)
+    sample = []
+    for _ in range(count):
+        label = rng.choices(list(TEMPLATES), weights=[45, 30, 15, 10])[0]
+        text = rng.choice(HARD[label] if rng.random() < 0.2 else TEMPLATES[label])
+        if rng.random() < 0.3:
+            text = f"{rng.choice(FILLER)}, {text[0].lower()}{text[1:]}"
+        if rng.random() < 0.7:
+            text += f" (order {rng.randrange(10 ** 6)})"  # most reviews are unique, the rest templated repeats
+        sample.append({'text': text, 'label': label})
+    return sample
+
+
+def load_sample(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def agreement(pairs):
+    return sum(1 for predicted, label in pairs if predicted == label) / len(pairs) if pairs else 0.0
+
+
+def run_handler(sample, engine, latency):
+    fake = FakeComprehend(latency=latency)
+    register_client('comprehend', fake)
+    handler._cache.entries.clear()
+    handler.SENTIMENT_ENGINE = engine
+    reviews = [{'id': str(n), 'text': item['text'], 'language': 'en'} for n, item in enumerate(sample)]
+    started = time.perf_counter()
+    handler.analyze_texts(reviews)
+    return time.perf_counter() - started, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--sample', help='JSON Lines of {"text", "label"}')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per fake Comprehend call')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sample = load_sample(args.sample) if args.sample else synthetic_sample(args.reviews, args.seed)
+    texts = [item['text'] for item in sample]
+    labels = [item['label'] for item in sample]
+    model = handler.local_model()
+
+    started = time.perf_counter()
+    for text in texts[:1000]:
+        model.score([text])
+    single = (time.perf_counter() - started) / min(1000, len(texts))
+    started = time.perf_counter()
+    scored = model.score(texts)
+    batched = time.perf_counter() - started
+    overall = agreement([(s[0], label) for s, label in zip(scored, labels)])
+    print(f"{len(sample)} labelled reviews; local model: {single * 1e6:.0f} us per single review, "
+          f"{len(texts) / batched:.0f} reviews/s batched, agreement {overall:.2f} when it answers everything")
+
+    print(f"{'threshold':>9} {'local share':>12} {'local agreement':>16} {'overall agreement':>18}")
+    for threshold in (0.6, 0.7, 0.8, 0.9, 0.95):
+        local = [(s[0], label) for s, label in zip(scored, labels) if s[2] >= threshold]
+        overall = (sum(1 for p, label in local if p == label) + len(sample) - len(local)) / len(sample)
+        print(f"{threshold:>9.2f} {len(local) / len(sample):>12.2f} {agreement(local):>16.2f} {overall:>18.2f}")
+
+    print(f"handler at threshold {handler.LOCAL_CONFIDENCE_THRESHOLD}, "
+          f"{args.latency * 1000:.0f} ms per Comprehend call:")
+    for engine in ('comprehend', 'hybrid'):
+        elapsed, fake = run_handler(sample, engine, args.latency)
+        print(f"  {engine:<10} {elapsed:6.2f} s, {len(sample) / elapsed:8.0f} reviews/s, "
+              f"{fake.documents} Comprehend documents in {sum(fake.calls.values())} calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Cold-start cost of each handler before and after the lazy client factory.
+
+"before" replays what the handlers used to do: import boto3 and build their
+clients at import time (or, for the handlers that built them inside the
+function, on every invocation). "after" imports the handler module as it is
+now, then times the first get_client() calls (first invoke) and a repeated
+call (warm invoke). Every sample runs in a fresh interpreter.
+
+    python -m benchmarks.startup --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# module -> (services its first invocation needs, clients were built per invocation before)
+HANDLERS = {
+    'assignment1_ec2_automanage.handler': (['ec2'], True),
+    'assignment2_s3_cleanup.handler': (['s3'], True),
+    'assignment3_s3_encryption_check.handler': (['s3'], True),
+    'assignment4_ebs_snapshot_cleanup.handler': (['ec2'], False),
+    'assignment6_monitor_high_alart.handler': (['cloudwatch', 'sns'], False),
+    'assignment7_dynamodb_boto3_sns.handler': (['sns'], False),
+    'assignment8_analyze_sentiment_of_user_reviews.handler': (['comprehend'], False),
+    'assignment9_archive_old_files_from_s3_to_glacier.handler': (['s3'], False),
+    'assignment10_elb_error.hendler': (['cloudwatch', 'sns'], False),
+    'assignment12_auto_scale_ec2_based_on_loading.handler': (['cloudwatch', 'ec2', 'sns'], False),
+}
+
+BEFORE = """
+import json, time
+t0 = time.perf_counter()
+import boto3
+clients = [boto3.client(s) for s in {services!r}]
+t1 = time.perf_counter()
+clients = [boto3.client(s) for s in {services!r}]
+t2 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'per_invoke': t2 - t1}}))
+"""
+
+AFTER = """
+import importlib, json, time
+t0 = time.perf_counter()
+importlib.import_module({module!r})
+t1 = time.perf_counter()
+from common.clients import get_client
+clients = [get_client(s) for s in {services!r}]
+t2 = time.perf_counter()
+clients = [get_client(s) for s in {services!r}]
+t3 = time.perf_counter()
+print(json.dumps({{'import': t1 - t0, 'first_invoke': t2 - t1, 'warm_invoke': t3 - t2}}))
+"""
+
+
+def sample(code, repeat):
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    runs = [json.loads(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                      check=True, env=env).stdout) for _ in range(repeat)]
+    return {k: statistics.median(r[k]for r in runs) * 1000 for k in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"median of {args.repeat} fresh interpreters, milliseconds")
+    print(f"{'handler':<58} {'before':>8} {'before':>8} | {'after':>7} {'after':>7} {'after':>7}")
+    print(f"{'':<58} {'cold':>8} {'warm':>8} | {'import':>7} {'first':>7} {'warm':>7}")
+    for module, (services, per_invoke) in HANDLERS.items():
+        before = sample(BEFORE.format(services=services), args.repeat)
+        after = sample(AFTER.format(module=module, services=services), args.repeat)
+        before_warm = before['per_invoke'] if per_invoke else 0.0
+        print(f"{module:<58} {before['import']:>8.1f} {before_warm:>8.1f} | "
+              f"{after['import']:>7.1f} {after['first_invoke']:>7.1f} {after['warm_invoke']:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Load test of the assignment7 DynamoDB stream consumer with synthetic
+1000-record batches against a fake SNS (--latency seconds per PublishBatch
+call, --failure-rate of entries rejected).
+
+Two notifier settings are measured: the default, where a burst of updates to
+one table becomes a digest, and one message per changed item (digests off),
+which exercises the concurrent PublishBatch calls. Reported: records per
+second, p50/p99 handler duration, SNS calls and messages, and the records
+returned as batchItemFailures.
+
+    python -m benchmarks.stream_batch_load --batches 20 --records 1000 --latency 0.02
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from assignment7_dynamodb_boto3_sns import handler
+from benchmarks.fakes import FakeSNS
+from common.clients import register_client
+from common.notify import get_notifier
+from common.state import MemoryStateStore
+
+
+def synthetic_batch(batch, records, tables, rng):
+    out = []
+    for i in range(records):
+        table = f"Table{rng.randrange(tables)}"
+        item_id = f"{batch}-{i}"
+        old = {'Id': {'S': item_id}, 'Status': {'S': 'Pending'}, 'Score': {'N': str(rng.randrange(100))},
+               'Tags': {'SS': ['a', 'b']}, 'Profile': {'M': {'city': {'S': 'Leeds'}, 'age': {'N': '40'}}}}
+        new = dict(old, Status={'S': rng.choice(['Approved', 'Rejected'])}, Score={'N': str(rng.randrange(100))})
+        name = rng.choices(['MODIFY', 'INSERT', 'REMOVE'], weights=[8, 1, 1])[0]
+        out.append({
+            'eventID': item_id,
+            'eventName': name,
+            'eventSource': 'aws:dynamodb',
+            'dynamodb': {'Keys': {'Id': {'S': item_id}}, 'OldImage': old, 'NewImage': new,
+                         'StreamViewType': 'NEW_AND_OLD_IMAGES', 'SequenceNumber': f"{batch:06d}{i:06d}",
+                         'SizeBytes': 180},
+            'eventSourceARN': f"arn:aws:dynamodb:eu-west-2:123456789012:table/{table}/stream/2025-01-01T00:00:00.000",
+        })
+    return {'Records': out}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def run(batches, digest_threshold, args):
+    sns = FakeSNS(latency=args.latency, failure_rate=args.failure_rate)
+    register_client('sns', sns)
+    notifier = get_notifier(handler.SNS_TOPIC_ARN)
+    notifier.store = MemoryStateStore()
+    notifier.digest_threshold = digest_threshold
+    durations, failures = [], 0
+    for event in batches:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = handler.lambda_handler(event, None)
+        durations.append(time.perf_counter() - started)
+        failures += len(result['batchItemFailures'])
+    records = sum(len(event['Records']) for event in batches)
+    return {
+        'records_per_s': records / sum(durations),
+        'p50_ms': 1000 * percentile(durations, 50),
+        'p99_ms': 1000 * percentile(durations, 99),
+        'sns_calls': sns.calls,
+        'messages': sns.messages,
+        'failed_records': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--tables', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per PublishBatch call')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    batches = [synthetic_batch(b, args.records, args.tables, rng) for b in range(args.batches)]
+    print(f"{args.batches} batches x {args.records} records, {args.tables} tables, "
+          f"{args.latency * 1000:.0f} ms per PublishBatch, failure rate {args.failure_rate}")
+    print(f"{'mode':<18} {'records/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'SNS calls':>10} {'messages':>9} "
+          f"{'failed recs':>12}")
+    for mode, threshold in (('digests', get_notifier(handler.SNS_TOPIC_ARN).digest_threshold),
+                            ('message per item', args.records + 1)):
+        r = run(batches, threshold, args)
+        print(f"{mode:<18} {r['records_per_s']:>10.0f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['sns_calls']:>10} {r['messages']:>9} {r['failed_records']:>12}")
+
+
+if __name__ == '__main__':
+    main()
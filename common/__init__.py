@@ -0,0 +1,6 @@
+"""
+Helpers shared by the assignment Lambda handlers.
+
+Deploy this package next to a handler (copy the `common/` directory into the
+function's zip, or publish it as a Lambda layer under `python/common`).
+"""
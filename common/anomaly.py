@@ -0,0 +1,97 @@
+"""
+Streaming anomaly detection with rolling seasonal baselines.
+
+AnomalyDetector keeps, per series (e.g. one load balancer) and season bucket
+(e.g. hour of day), an exponentially weighted mean and an exponentially
+weighted mean absolute deviation, the streaming stand-in for the median
+absolute deviation. Each new datapoint is scored against its bucket and then
+folded into it, so no history is re-read:
+
+    score = (value - mean) / max(1.4826 * deviation, min_scale)
+
+- A "spike" is a score above z_threshold.
+- A "sustained" deviation is a one-sided CUSUM of the scores above cusum_h;
+  it catches slow burns that never cross the spike threshold.
+
+Values are clipped to the alert boundary before they update the baseline, so
+an incident does not become the new normal. Heavy-tailed, non-negative series
+such as error rates are better scored as log1p(value) (log_values=True): a
+noisy bucket then needs a proportionally larger excursion to alert. State is a small JSON-friendly
+dict (three numbers per bucket) for common/state.py stores.
+"""
+import math
+import os
+
+ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA', '0.05'))  # weight of each new datapoint
+ANOMALY_Z = float(os.environ.get('ANOMALY_Z', '5'))
+ANOMALY_MIN_SAMPLES = int(os.environ.get('ANOMALY_MIN_SAMPLES', '36'))  # per bucket before it can alert
+CUSUM_K = 0.5  # slack subtracted from each score
+CUSUM_H = 8.0  # accumulated excess that counts as a sustained deviation
+
+
+class AnomalyDetector:
+    """Per-series, per-season EWMA/MAD baselines with spike and CUSUM detection."""
+
+    def __init__(self, state=None, alpha=ANOMALY_ALPHA, z_threshold=ANOMALY_Z, min_samples=ANOMALY_MIN_SAMPLES,
+                 cusum_k=CUSUM_K, cusum_h=CUSUM_H, min_scale=0.1, log_values=False):
+        self.state = state if state is not None else {}
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.min_scale = min_scale  # floor on the deviation, in units of the (transformed) series
+        self.log_values = log_values
+
+    def update(self, series_key, season_key, value, timestamp):
+        """
+        Score value against its baseline, then fold it in. timestamp is any
+        increasing number (e.g. epoch seconds); points at or before the last
+        one seen for the series are ignored and return None.
+        """
+        series = self.state.setdefault(series_key, {'buckets': {}, 'cusum': 0.0, 'last': None})
+        if series['last'] is not None and timestamp <= series['last']:
+            return None
+        series['last'] = timestamp
+        if self.log_values:
+            value = math.log1p(max(value, 0.0))
+        bucket = series['buckets'].setdefault(str(season_key), [value, 0.0, 0])
+        mean, deviation, count = bucket
+        scale = max(1.4826 * deviation, self.min_scale)
+        score = (value - mean) / scale if count >= self.min_samples else 0.0
+
+        if count >= self.min_samples:
+            series['cusum'] = max(0.0, series['cusum'] + min(score, self.z_threshold) - self.cusum_k)
+        reason = None
+        if score > self.z_threshold:
+            reason = 'spike'
+        elif series['cusum'] > self.cusum_h:
+            reason = 'sustained'
+
+        clipped = min(value, mean + self.z_threshold * scale) if count >= self.min_samples else value
+        # Plain running averages while warming up, so early baselines are not biased towards the first value
+        weight = max(self.alpha, 1.0 / (count + 1))
+        bucket[:] = [mean + weight * (clipped - mean),
+                     deviation + max(self.alpha, 1.0 / count) * (abs(clipped - mean) - deviation) if count else 0.0,
+                     count + 1]
+        return {
+            'score': round(score, 2),
+            'baseline': round(math.expm1(mean) if self.log_values else mean, 4),
+            'deviation': round(deviation, 4),
+            'cusum': round(series['cusum'], 2),
+            'anomalous': reason is not None,
+            'reason': reason,
+        }
+
+    def reset_cusum(self, series_key):
+        """Call after alerting on a sustained deviation so it does not re-alert every point."""
+        if series_key in self.state:
+            self.state[series_key]['cusum'] = 0.0
+
+    def to_state(self):
+        """Compact copy for persisting (baselines rounded)."""
+        return {
+            key: {**series, 'cusum': round(series['cusum'], 3),
+                  'buckets': {k: [round(m, 5), round(d, 5), n] for k, (m, d, n) in series['buckets'].items()}}
+            for key, series in self.state.items()
+        }
@@ -0,0 +1,86 @@
+"""
+Resumable, time-budgeted scans.
+
+Long scans (bucket listings, version purges ...) check a TimeBudget between
+units of work. When the Lambda is about to run out of time they save their
+position (continuation token, last key, key/version markers) in a Checkpoint
+and return; the next invocation loads it and carries on from there, so a
+bucket of any size is covered by a series of short runs instead of every run
+restarting from the first key.
+"""
+import os
+import time
+from datetime import datetime, timezone
+
+from common.state import state_store_from_uri
+
+# Stop starting new work when less than this much time is left
+CHECKPOINT_RESERVE_MS = int(os.environ.get('CHECKPOINT_RESERVE_MS', '30000'))
+
+
+class TimeBudget:
+    """Tracks the remaining Lambda execution time via the context object."""
+
+    def __init__(self, context, reserve_ms=CHECKPOINT_RESERVE_MS):
+        self.context = context
+        self.reserve_ms = reserve_ms
+        self._started = time.monotonic()
+
+    def remaining_ms(self):
+        if self.context is not None and hasattr(self.context, 'get_remaining_time_in_millis'):
+            return self.context.get_remaining_time_in_millis()
+        return float('inf')  # local runs have no deadline
+
+    def exhausted(self):
+        return self.remaining_ms() < self.reserve_ms
+
+    def elapsed_seconds(self):
+        return time.monotonic() - self._started
+
+
+class Checkpoint:
+    """
+    Position of one scan, identified by scan_id (e.g. the bucket name). The
+    store keeps one position per scan_id, so scans of different buckets can
+    share a CHECKPOINT_URI without resuming or clearing each other's.
+    """
+
+    def __init__(self, store, scan_id):
+        self.store = store
+        self.scan_id = scan_id
+
+    def _scans(self):
+        state = self.store.load() or {}
+        if 'scan_id' in state:
+            # Single-scan document written before positions were keyed by scan_id
+            return {state['scan_id']: {'position': state.get('position'), 'saved_at': state.get('saved_at')}}
+        return state.get('scans', {})
+
+    def load(self):
+        """Return the saved position dict, or {} to start from the beginning."""
+        return (self._scans().get(self.scan_id) or {}).get('position') or {}
+
+    def save(self, **position):
+        scans = self._scans()
+        scans[self.scan_id] = {'position': position, 'saved_at': datetime.now(timezone.utc).isoformat()}
+        self.store.save({'scans': scans})
+        print(f"Checkpoint saved for {self.scan_id}: {position}")
+
+    def complete(self):
+        """The scan reached the end; its next run starts over. Other scans keep their positions."""
+        scans = self._scans()
+        if scans.pop(self.scan_id, None) is None:
+            return
+        if scans:
+            self.store.save({'scans': scans})
+        else:
+            self.store.clear()
+
+
+def checkpoint_from_env(name, scan_id, s3=None):
+    """
+    Checkpoint stored at CHECKPOINT_URI ('s3://bucket/key' or a file path);
+    defaults to /tmp/<name>-checkpoint.json, which only survives warm starts.
+    """
+    uri = os.environ.get('CHECKPOINT_URI', f"/tmp/{name}-checkpoint.json")
+    return Checkpoint(state_store_from_uri(uri, s3=s3), scan_id)
@@ -0,0 +1,65 @@
+"""
+Lazy, cached boto3 clients.
+
+Handlers ask for clients with get_client() at the point of use instead of
+creating them at import time or on every invocation. The first request for a
+(service, region, config) combination builds the client from one shared
+boto3 session; later requests in the same warm container reuse it. boto3 is
+only imported when the first client is needed, which keeps cold-start
+imports of the handler modules cheap.
+"""
+import threading
+
+_session = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def _cache_key(service, region_name, config):
+    # Config values can be dicts (e.g. retries={'mode': 'standard'}), so key on their repr
+    return service, region_name, tuple(sorted((k, repr(v)) for k, v in config.items()))
+
+
+def get_session():
+    """The boto3 session shared by every client in this container."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3.session
+                _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service, region_name=None, **config):
+    """
+    Cached client for `service`. Extra keyword arguments are passed to
+    botocore.config.Config and become part of the cache key.
+    """
+    key = _cache_key(service, region_name, config)
+    client = _clients.get(key)
+    if client is None:
+        session = get_session()
+        with _lock:
+            # Session.client() is not thread-safe, so creation stays under the lock
+            client = _clients.get(key)
+            if client is None:
+                client_config = None
+                if config:
+                    from botocore.config import Config
+                    client_config = Config(**config)
+                client = session.client(service, region_name=region_name, config=client_config)
+                _clients[key] = client
+    return client
+
+
+def register_client(service, client, region_name=None, **config):
+    """Install a ready-made client (e.g. an offline fake used by the benchmarks)."""
+    with _lock:
+        _clients[_cache_key(service, region_name, config)] = client
+
+
+def clear_clients():
+    """Forget every cached client (the next get_client() builds a new one)."""
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,126 @@
+"""
+DynamoDB attribute values and item diffs.
+
+decode() turns a DynamoDB-JSON attribute value ({"N": "80"}, {"M": {...}}, ...)
+into Python the way boto3's TypeDeserializer does: N as Decimal (so "80" and
+"80.0" compare equal), B/BS as bytes (stream images carry them base64
+encoded), SS/NS/BS as sets, M as dict, L as list, NULL as None. It is a plain
+recursive dispatch with no per-value objects beyond the results.
+
+diff_images() compares two raw stream images. Attributes whose DynamoDB JSON
+is identical are skipped without decoding; the rest are decoded and diffed
+recursively, so a change deep inside a map or list is reported at its path:
+
+    [('changed', 'Profile.address.city', 'Leeds', 'York'),
+     ('added', 'Tags[2]', None, 'vip'),
+     ('removed', 'Nickname', 'Bob', None)]
+
+filter_changes() keeps only the paths a consumer cares about.
+"""
+import base64
+from decimal import Decimal
+
+
+def _binary(value):
+    return base64.b64decode(value) if isinstance(value, str) else bytes(value)
+
+
+_DECODERS = {
+    'S': lambda v: v,
+    'N': Decimal,
+    'BOOL': bool,
+    'NULL': lambda v: None,
+    'B': _binary,
+    'SS': set,
+    'NS': lambda v: {Decimal(x) for x in v},
+    'BS': lambda v: {_binary(x) for x in v},
+    'M': lambda v: {k: decode(x) for k, x in v.items()},
+    'L': lambda v: [decode(x) for x in v],
+}
+
+
+def decode(attribute):
+    """One DynamoDB-JSON attribute value -> Python value."""
+    for tag, value in attribute.items():
+        try:
+            return _DECODERS[tag](value)
+        except KeyError:
+            raise ValueError(f"Unsupported DynamoDB type: {tag}") from None
+    raise ValueError("Empty DynamoDB attribute value")
+
+
+def decode_image(image):
+    """A stream image ({name: attribute value}) -> plain dict."""
+    return {name: decode(attribute) for name, attribute in image.items()}
+
+
+def _differs(old, new):
+    # True == Decimal(1) in Python, but a BOOL replaced by an N is a change
+    return old != new or type(old) is not type(new)
+
+
+def _diff(path, old, new, changes):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in old.items():
+            child = f"{path}.{key}" if path else key
+            if key not in new:
+                changes.append(('removed', child, value, None))
+            elif _differs(value, new[key]):
+                _diff(child, value, new[key], changes)
+        for key, value in new.items():
+            if key not in old:
+                changes.append(('added', f"{path}.{key}" if path else key, None, value))
+    elif isinstance(old, list) and isinstance(new, list):
+        for i in range(max(len(old), len(new))):
+            child = f"{path}[{i}]"
+            if i >= len(new):
+                changes.append(('removed', child, old[i], None))
+            elif i >= len(old):
+                changes.append(('added', child, None, new[i]))
+            elif _differs(old[i], new[i]):
+                _diff(child, old[i], new[i], changes)
+    else:
+        changes.append(('changed', path, old, new))
+
+
+def diff(old, new):
+    """[(kind, path, old value, new value)] between two decoded values; kind is added, removed or changed."""
+    changes = []
+    if _differs(old, new):
+        _diff('', old, new, changes)
+    return changes
+
+
+def diff_images(old_image, new_image):
+    """Like diff(decode_image(old), decode_image(new)), decoding only attributes whose DynamoDB JSON differs."""
+    changes = []
+    for name, attribute in old_image.items():
+        other = new_image.get(name)
+        if other is None:
+            changes.append(('removed', name, decode(attribute), None))
+        elif other != attribute:
+            old, new = decode(attribute), decode(other)
+            if _differs(old, new):
+                _diff(name, old, new, changes)
+    for name, attribute in new_image.items():
+        if name not in old_image:
+            changes.append(('added', name, None, decode(attribute)))
+    return changes
+
+
+def _inside(path, pattern):
+    return path == pattern or path.startswith(pattern) and path[len(pattern)] in '.['
+
+
+def path_matches(path, pattern):
+    """Path is the pattern, inside it ('Profile.city' for 'Profile') or contains it ('Profile' for 'Profile.city')."""
+    return _inside(path, pattern) or _inside(pattern, path)
+
+
+def filter_changes(changes, watched=(), ignored=()):
+    """Changes touching a watched path (all when watched is empty) and not inside an ignored one."""
+    return [
+        change for change in changes
+        if (not watched or any(path_matches(change[1], p) for p in watched))
+        and not any(_inside(change[1], p) for p in ignored)
+    ]
@@ -0,0 +1,213 @@
+"""
+Shared executor for AWS API calls.
+
+Handlers submit boto3 calls through an AwsExecutor instead of calling the
+client directly. For each service the executor keeps:
+
+- an adaptive concurrency limit (AIMD): +1/limit per successful call, halved
+  when the service answers with a throttling error;
+- an optional token bucket (AWS_CALL_RATES, e.g. "ec2=20,sns=30") capping
+  calls per second;
+- retries with full-jitter exponential backoff for throttling and transient
+  server errors.
+
+submit() returns a concurrent.futures.Future; call() runs inline in the
+calling thread with the same policy. metrics() reports calls, retries,
+throttles, failures, latency and the current limit per service.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+    'SlowDown', 'TooManyRequests', 'TooManyRequestsException', 'RequestThrottled',
+    'RequestThrottledException', 'ProvisionedThroughputExceededException', 'EC2ThrottledException',
+}
+TRANSIENT_CODES = {
+    'InternalError', 'InternalFailure', 'InternalServerError', 'ServiceUnavailable',
+    'ServiceUnavailableException', 'RequestTimeout', 'RequestTimeoutException',
+}
+
+MAX_CONCURRENCY = int(os.environ.get('AWS_MAX_CONCURRENCY', '32'))
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '8'))
+BASE_DELAY = float(os.environ.get('AWS_RETRY_BASE_DELAY', '0.1'))  # seconds
+MAX_DELAY = float(os.environ.get('AWS_RETRY_MAX_DELAY', '20'))
+
+
+def parse_rates(spec):
+    """'ec2=20,sns=30' -> {'ec2': 20.0, 'sns': 30.0}"""
+    rates = {}
+    for item in spec.split(','):
+        if '=' in item:
+            service, _, rate = item.partition('=')
+            rates[service.strip()] = float(rate)
+    return rates
+
+
+def error_code(exc):
+    if isinstance(exc, ClientError):
+        return exc.response.get('Error', {}).get('Code', '')
+    return ''
+
+
+class TokenBucket:
+    """Calls per second with a small burst allowance."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit for one service, adjusted additive-increase /
+    multiplicative-decrease. Decreases are applied at most once per
+    `cooldown` seconds so one burst of throttles only halves it once.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, cooldown=0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial or maximum)
+        self.in_flight = 0
+        self.cooldown = cooldown
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class AwsExecutor:
+    """Runs AWS calls with per-service adaptive concurrency, rate limits and retries."""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_attempts=MAX_ATTEMPTS,
+                 base_delay=BASE_DELAY, max_delay=MAX_DELAY, rates=None, initial_concurrency=None):
+        self.max_concurrency = max_concurrency
+        self.initial_concurrency = initial_concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rates = dict(rates if rates is not None else parse_rates(os.environ.get('AWS_CALL_RATES', '')))
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._limits = {}
+        self._buckets = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _service_state(self, service):
+        with self._lock:
+            if service not in self._limits:
+                self._limits[service] = AdaptiveLimit(self.max_concurrency, initial=self.initial_concurrency)
+                if service in self.rates:
+                    self._buckets[service] = TokenBucket(self.rates[service])
+                self._metrics[service] = {'calls': 0, 'succeeded': 0, 'retries': 0, 'throttled': 0,
+                                          'failed': 0, 'latency_total': 0.0}
+            return self._limits[service], self._buckets.get(service), self._metrics[service]
+
+    def _record(self, metrics, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                metrics[name] += value
+
+    def call(self, service, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in this thread, retrying throttles and transient errors."""
+        limit, bucket, metrics = self._service_state(service)
+        for attempt in range(self.max_attempts):
+            if bucket:
+                bucket.acquire()
+            limit.acquire()
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except ClientError as e:
+                code = error_code(e)
+                throttled = code in THROTTLE_CODES
+                limit.release(throttled)
+                self._record(metrics, calls=1, throttled=int(throttled),
+                             latency_total=time.monotonic() - started)
+                if not (throttled or code in TRANSIENT_CODES) or attempt == self.max_attempts - 1:
+                    self._record(metrics, failed=1)
+                    raise
+                self._record(metrics, retries=1)
+                # Full jitter: sleep a random time up to the exponential cap
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+                continue
+            except Exception:
+                limit.release(False)
+                self._record(metrics, calls=1, failed=1, latency_total=time.monotonic() - started)
+                raise
+            limit.release(False)
+            self._record(metrics, calls=1, succeeded=1, latency_total=time.monotonic() - started)
+            return result
+
+    def submit(self, service, fn, *args, **kwargs):
+        """Schedule a call on the shared pool; returns a Future."""
+        return self._pool.submit(self.call, service, fn, *args, **kwargs)
+
+    def metrics(self):
+        with self._lock:
+            snapshot = {}
+            for service, metrics in self._metrics.items():
+                calls = metrics['calls']
+                snapshot[service] = {
+                    **{k: v for k, v in metrics.items() if k != 'latency_total'},
+                    'avg_latency_ms': round(1000 * metrics['latency_total'] / calls, 1) if calls else 0.0,
+                    'concurrency_limit': round(self._limits[service].limit, 1),
+                }
+            return snapshot
+
+    def log_metrics(self):
+        for service, metrics in self.metrics().items():
+            print(f"AWS {service} calls: {metrics}")
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+_default_executor = None
+_default_lock = threading.Lock()
+
+
+def get_executor():
+    """Executor shared by everything in this (warm) Lambda container."""
+    global _default_executor
+    with _default_lock:
+        if _default_executor is None:
+            _default_executor = AwsExecutor()
+        return _default_executor
@@ -0,0 +1,193 @@
+"""
+Cached inventory of a managed EC2 fleet.
+
+A FleetInventory lists the instances matching its describe_instances filters
+once (every page), keeps one compact record per instance and serves later
+reads from memory until INVENTORY_TTL_SECONDS have passed:
+
+    {'id': 'i-0abc...', 'state': 'running', 'launch_time': '2024-05-01T08:00:00+00:00',
+     'az': 'eu-west-1a', 'type': 't3.micro', 'tags': {...only the requested tag keys...}}
+
+Between full listings the snapshot is kept current incrementally:
+
+- apply_event() takes the "EC2 Instance State-change Notification" events
+  EventBridge delivers to the function;
+- record_launch() / set_state() reflect the function's own start, stop and
+  terminate calls.
+
+With INVENTORY_CACHE_URI (s3://bucket/key or a file path) the snapshot is
+also persisted, so a cold container or a different function can reuse it.
+"""
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from datetime import datetime, timezone
+
+from common.clients import get_client
+from common.executor import get_executor
+from common.state import state_store_from_uri
+
+INVENTORY_TTL_SECONDS = float(os.environ.get('INVENTORY_TTL_SECONDS', '300'))
+INVENTORY_CACHE_URI = os.environ.get('INVENTORY_CACHE_URI')
+
+LIVE_STATES = ['pending', 'running', 'stopping', 'stopped', 'shutting-down']
+STATE_CHANGE_EVENT = 'EC2 Instance State-change Notification'
+
+
+def compact_record(instance, tag_keys=()):
+    tags = {t['Key']: t['Value'] for t in instance.get('Tags', []) if t['Key'] in tag_keys}
+    launch_time = instance.get('LaunchTime')
+    return {
+        'id': instance['InstanceId'],
+        'state': instance['State']['Name'],
+        'launch_time': launch_time.isoformat() if hasattr(launch_time, 'isoformat') else launch_time,
+        'az': instance.get('Placement', {}).get('AvailabilityZone'),
+        'type': instance.get('InstanceType'),
+        'tags': tags,
+    }
+
+
+def is_state_change_event(event):
+    return isinstance(event, dict) and event.get('detail-type') == STATE_CHANGE_EVENT
+
+
+class FleetInventory:
+    """Instances matching `filters` in one region, cached for `ttl` seconds."""
+
+    def __init__(self, filters, region_name=None, tag_keys=(), ttl=INVENTORY_TTL_SECONDS, store=None):
+        self.filters = filters
+        self.region_name = region_name
+        self.tag_keys = tuple(tag_keys)
+        self.ttl = ttl
+        self.store = store
+        self.records = None
+        self.fetched_at = 0.0  # epoch seconds of the last full listing
+        self.full_listings = 0
+        self._lock = threading.RLock()
+
+    @property
+    def ec2(self):
+        return get_client('ec2', region_name=self.region_name)
+
+    def _list(self, instance_ids=None):
+        kwargs = {'Filters': self.filters + [{'Name': 'instance-state-name', 'Values': LIVE_STATES}]}
+        if instance_ids:
+            kwargs['InstanceIds'] = instance_ids
+        records = {}
+        for page in self.ec2.get_paginator('describe_instances').paginate(**kwargs):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    records[instance['InstanceId']] = compact_record(instance, self.tag_keys)
+        return records
+
+    def _load_persisted(self):
+        cached = self.store.load() if self.store else None
+        if cached and time.time() - cached.get('fetched_at', 0) < self.ttl:
+            self.records = cached['records']
+            self.fetched_at = cached['fetched_at']
+            return True
+        return False
+
+    def _persist(self):
+        if self.store:
+            self.store.save({'fetched_at': self.fetched_at, 'records': self.records})
+
+    def refresh(self):
+        """Full paginated listing."""
+        with self._lock:
+            self.records = get_executor().call('ec2', self._list)
+            self.fetched_at = time.time()
+            self.full_listings += 1
+            self._persist()
+            print(f"Inventory: listed {len(self.records)} instances")
+
+    def snapshot(self, force=False):
+        """Current records; lists the fleet only when the cached snapshot has expired."""
+        with self._lock:
+            expired = time.time() - self.fetched_at >= self.ttl
+            if force or self.records is None or expired:
+                if force or not self._load_persisted():
+                    self.refresh()
+            return list(self.records.values())
+
+    def set_state(self, instance_ids, state):
+        """Reflect a state change this function caused (or learned about)."""
+        with self._lock:
+            if self.records is None:
+                return
+            for instance_id in instance_ids:
+                if state == 'terminated':
+                    self.records.pop(instance_id, None)
+                elif instance_id in self.records:
+                    self.records[instance_id]['state'] = state
+            self._persist()
+
+    def set_tags(self, instance_ids, tags):
+        with self._lock:
+            if self.records is None:
+                return
+            for instance_id in instance_ids:
+                if instance_id in self.records:
+                    self.records[instance_id]['tags'].update({k: v for k, v in tags.items() if k in self.tag_keys})
+            self._persist()
+
+    def record_launch(self, instances, tags=None):
+        """Add instances from a run_instances response (tags: those set through TagSpecifications)."""
+        with self._lock:
+            if self.records is None:
+                return
+            for instance in instances:
+                record = compact_record(instance, self.tag_keys)
+                record['tags'].update({k: v for k, v in (tags or {}).items() if k in self.tag_keys})
+                if record['launch_time'] is None:
+                    record['launch_time'] = datetime.now(timezone.utc).isoformat()
+                self.records[record['id']] = record
+            self._persist()
+
+    def apply_event(self, event):
+        """
+        Update one instance from an EC2 state-change event. Instances not in
+        the snapshot are looked up once so that only managed ones are added.
+        Returns True when the snapshot changed.
+        """
+        detail = event.get('detail', {})
+        instance_id, state = detail.get('instance-id'), detail.get('state')
+        if not instance_id or not state:
+            return False
+        with self._lock:
+            if self.records is None and not self._load_persisted():
+                return False  # nothing cached yet; the next read lists the fleet anyway
+            if instance_id in self.records:
+                self.set_state([instance_id], state)
+                return True
+            if state == 'terminated':
+                return False
+            try:
+                found = get_executor().call('ec2', self._list, [instance_id])
+            except ClientError as e:
+                print(f"Inventory: could not look up {instance_id}: {e}")
+                return False
+            if not found:
+                return False  # not one of ours
+            self.records.update(found)
+            self._persist()
+            return True
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(name, filters, region_name=None, tag_keys=()):
+    """Inventory shared by everything in this (warm) container, one per name and region."""
+    key = (name, region_name)
+    with _inventories_lock:
+        if key not in _inventories:
+            store = None
+            if INVENTORY_CACHE_URI:
+                # One document per inventory next to the configured location
+                root, ext = os.path.splitext(INVENTORY_CACHE_URI)
+                store = state_store_from_uri(f"{root}-{name}-{region_name or 'default'}{ext or '.json'}")
+            _inventories[key] = FleetInventory(filters, region_name=region_name, tag_keys=tag_keys, store=store)
+        return _inventories[key]
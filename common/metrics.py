@@ -0,0 +1,97 @@
+"""
+Batched CloudWatch GetMetricData queries.
+
+Callers describe what they need as groups of metric queries (MetricStat or
+metric-math expressions). A group stays together in one request, so an
+expression always travels with the metrics it references. Groups are packed
+into requests of at most MAX_QUERIES queries, the requests run concurrently
+through the shared executor and paginated results are merged per query id:
+
+    groups = [[metric_stat('r0', 'AWS/ApplicationELB', 'RequestCount', {'LoadBalancer': lb}, 'Sum', 60,
+                           return_data=False),
+               expression('rps0', 'r0 / 60')]]
+    series = get_metric_data(groups, start, end)
+    latest(series['rps0'])
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from common.clients import get_client
+from common.executor import get_executor
+
+MAX_QUERIES = 500  # GetMetricData limit per request
+REQUEST_CONCURRENCY = int(os.environ.get('METRIC_REQUEST_CONCURRENCY', '8'))
+
+
+def metric_stat(query_id, namespace, metric_name, dimensions, stat, period, return_data=True, label=None):
+    query = {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': namespace,
+                'MetricName': metric_name,
+                'Dimensions': [{'Name': k, 'Value': v} for k, v in dimensions.items()]
+            },
+            'Period': period,
+            'Stat': stat
+        },
+        'ReturnData': return_data
+    }
+    if label:
+        query['Label'] = label
+    return query
+
+
+def expression(query_id, expr, return_data=True, label=None):
+    query = {'Id': query_id, 'Expression': expr, 'ReturnData': return_data}
+    if label:
+        query['Label'] = label
+    return query
+
+
+def pack_groups(groups, limit=MAX_QUERIES):
+    """Pack query groups into request-sized batches without splitting a group."""
+    batches, current = [], []
+    for group in groups:
+        if len(group) > limit:
+            raise ValueError(f"query group of {len(group)} exceeds the {limit}-query limit")
+        if len(current) + len(group) > limit:
+            batches.append(current)
+            current = []
+        current.extend(group)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _fetch_batch(cloudwatch, queries, start, end):
+    series = {}
+    kwargs = {'MetricDataQueries': queries, 'StartTime': start, 'EndTime': end, 'ScanBy': 'TimestampAscending'}
+    while True:
+        resp = get_executor().call('cloudwatch', cloudwatch.get_metric_data, **kwargs)
+        for result in resp.get('MetricDataResults', []):
+            series.setdefault(result['Id'], []).extend(zip(result['Timestamps'], result['Values']))
+        if not resp.get('NextToken'):
+            return series
+        kwargs['NextToken'] = resp['NextToken']
+
+
+def get_metric_data(groups, start, end, cloudwatch=None):
+    """{query id: [(timestamp, value), ...] oldest first} for every query with ReturnData."""
+    cloudwatch = cloudwatch or get_client('cloudwatch')
+    batches = pack_groups(groups)
+    if len(batches) <= 1:
+        results = [_fetch_batch(cloudwatch, batch, start, end) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(batches), REQUEST_CONCURRENCY)) as pool:
+            results = list(pool.map(lambda batch: _fetch_batch(cloudwatch, batch, start, end), batches))
+    series = {}
+    for result in results:
+        for query_id, points in result.items():
+            series[query_id] = sorted(points)
+    return series
+
+
+def latest(points):
+    """Value of the newest datapoint, or None."""
+    return float(points[-1][1]) if points else None
@@ -0,0 +1,215 @@
+"""
+Deduplicating, coalescing SNS notifications.
+
+Handlers queue notifications with a fingerprint (what the alert is about) and
+a group (which digest it may be merged into), then flush once per invocation:
+
+    notifier = get_notifier(SNS_TOPIC_ARN)
+    notifier.add('elb-5xx:app/web/123', 'ELB 5xx error rate 7%', message, group='ELB 5xx alerts')
+    notifier.flush()
+
+- A fingerprint sent within the last NOTIFY_SUPPRESS_SECONDS is suppressed;
+  the next message sent for it after the window says how many repeats were
+  dropped.
+- When more than NOTIFY_DIGEST_THRESHOLD notifications of one group are left
+  in a flush they go out as a single digest message.
+- Whatever remains is sent with SNS PublishBatch, 10 entries per call, the
+  calls running concurrently on the shared executor.
+
+flush() reports the fingerprints that could not be sent, so stream consumers
+can return exactly those records as batch item failures.
+
+Dedup state (fingerprint -> last sent, suppressed count) lives in any store
+with load()/save() from common/state.py: in memory by default, or a file or
+S3 object (NOTIFY_STATE_URI) to dedup across containers and cold starts.
+Updates from concurrent containers are last-writer-wins, so suppression is
+best-effort under heavy concurrency.
+"""
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+
+from common.clients import get_client
+from common.executor import error_code, get_executor
+from common.state import MemoryStateStore, state_store_from_uri
+
+NOTIFY_SUPPRESS_SECONDS = float(os.environ.get('NOTIFY_SUPPRESS_SECONDS', '900'))
+NOTIFY_DIGEST_THRESHOLD = int(os.environ.get('NOTIFY_DIGEST_THRESHOLD', '3'))
+NOTIFY_STATE_URI = os.environ.get('NOTIFY_STATE_URI')
+
+BATCH_ENTRIES = 10  # PublishBatch limit
+MAX_BATCH_BYTES = 256 * 1024  # total payload of one PublishBatch (and of a single message)
+MAX_SUBJECT = 100
+DIGEST_MAX_ITEMS = 50  # listed in full; the rest are counted
+
+
+def _size(entry):
+    return len(entry['Message'].encode('utf-8')) + len(entry.get('Subject', '').encode('utf-8'))
+
+
+class Notifier:
+    """Queue, dedup and batch-publish notifications to one SNS topic."""
+
+    def __init__(self, topic_arn, store=None, suppress_seconds=NOTIFY_SUPPRESS_SECONDS,
+                 digest_threshold=NOTIFY_DIGEST_THRESHOLD):
+        self.topic_arn = topic_arn
+        self.store = store if store is not None else MemoryStateStore()
+        self.suppress_seconds = suppress_seconds
+        self.digest_threshold = digest_threshold
+        self.pending = {}  # fingerprint -> notification; a repeat in the same flush replaces the earlier one
+        self._lock = threading.Lock()
+
+    @property
+    def sns(self):
+        return get_client('sns')
+
+    def add(self, fingerprint, subject, message, group=None):
+        """Queue a notification; nothing is sent before flush()."""
+        with self._lock:
+            previous = self.pending.get(fingerprint)
+            self.pending[fingerprint] = {
+                'fingerprint': fingerprint,
+                'subject': subject,
+                'message': message,
+                'group': group or subject,
+                'repeats': previous['repeats'] + 1 if previous else 0,
+            }
+
+    def publish(self, fingerprint, subject, message, group=None):
+        """add() and flush() in one step, for handlers that send a single notification."""
+        self.add(fingerprint, subject, message, group)
+        return self.flush()
+
+    def flush(self, now=None):
+        """
+        Dedup and send everything queued. Returns counts: queued, suppressed,
+        digests, sent (SNS messages), publish_calls and failed, plus
+        failed_fingerprints (those of failed messages, digests included).
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            pending, self.pending = list(self.pending.values()), {}
+        stats = {'queued': len(pending), 'suppressed': 0, 'digests': 0, 'sent': 0, 'publish_calls': 0, 'failed': 0,
+                 'failed_fingerprints': []}
+        if not pending:
+            return stats
+
+        state = self.store.load() or {}
+        fresh = []
+        for item in pending:
+            seen = state.get(item['fingerprint'])
+            stats['suppressed'] += item['repeats']
+            if seen and now - seen['sent_at'] < self.suppress_seconds:
+                seen['suppressed'] += 1 + item['repeats']
+                stats['suppressed'] += 1
+            else:
+                item['suppressed'] = (seen or {}).get('suppressed', 0) + item['repeats']
+                fresh.append(item)
+
+        entries = []  # (fingerprints covered, PublishBatch entry)
+        groups = {}
+        for item in fresh:
+            groups.setdefault(item['group'], []).append(item)
+        for group, items in groups.items():
+            if len(items) > self.digest_threshold:
+                entries.append(([i['fingerprint'] for i in items], self._digest(group, items)))
+                stats['digests'] += 1
+            else:
+                entries += [([i['fingerprint']], self._single(i)) for i in items]
+        for n, (_, entry) in enumerate(entries):
+            entry['Id'] = str(n)
+
+        sent = self._publish_batches([entry for _, entry in entries], stats)
+        for fingerprints, entry in entries:
+            if entry['Id'] in sent:
+                for fingerprint in fingerprints:
+                    state[fingerprint] = {'sent_at': now, 'suppressed': 0}
+            else:
+                stats['failed_fingerprints'] += fingerprints
+        # Expired records are kept one more window so a late repeat still reports what was dropped
+        state = {k: v for k, v in state.items() if now - v['sent_at'] < 2 * self.suppress_seconds}
+        self.store.save(state)
+        print(f"Notifications: {({k: v for k, v in stats.items() if k != 'failed_fingerprints'})}")
+        return stats
+
+    def _single(self, item):
+        message = item['message']
+        if item['suppressed']:
+            message += f"\n\n(Repeats suppressed since the last message: {item['suppressed']})"
+        return {'Subject': item['subject'][:MAX_SUBJECT], 'Message': self._truncate(message)}
+
+    def _digest(self, group, items):
+        lines = [f"{len(items)} notifications for {group}:", ""]
+        for item in items[:DIGEST_MAX_ITEMS]:
+            lines += [f"- {item['subject']}", item['message'], ""]
+        if len(items) > DIGEST_MAX_ITEMS:
+            lines.append(f"... and {len(items) - DIGEST_MAX_ITEMS} more.")
+        suppressed = sum(item['suppressed'] for item in items)
+        if suppressed:
+            lines.append(f"(Repeats suppressed since the last messages: {suppressed})")
+        return {'Subject': f"{group}: {len(items)} notifications"[:MAX_SUBJECT],
+                'Message': self._truncate('\n'.join(lines))}
+
+    @staticmethod
+    def _truncate(message, limit=MAX_BATCH_BYTES - 1024):
+        encoded = message.encode('utf-8')
+        if len(encoded) <= limit:
+            return message
+        return encoded[:limit].decode('utf-8', 'ignore') + '\n... (truncated)'
+
+    def _publish_batches(self, entries, stats):
+        """PublishBatch calls of up to 10 entries and 256 KB; returns the ids SNS accepted."""
+        batches, batch, size = [], [], 0
+        for entry in entries:
+            if batch and (len(batch) == BATCH_ENTRIES or size + _size(entry) > MAX_BATCH_BYTES):
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append(entry)
+            size += _size(entry)
+        if batch:
+            batches.append(batch)
+
+        executor = get_executor()
+        if len(batches) == 1:
+            futures = None
+        else:
+            futures = [executor.submit('sns', self.sns.publish_batch, TopicArn=self.topic_arn,
+                                       PublishBatchRequestEntries=batch) for batch in batches]
+        sent = set()
+        for n, batch in enumerate(batches):
+            try:
+                if futures is None:
+                    response = executor.call('sns', self.sns.publish_batch, TopicArn=self.topic_arn,
+                                             PublishBatchRequestEntries=batch)
+                else:
+                    response = futures[n].result()
+            except ClientError as e:
+                # The executor already retried throttling; every entry of this call counts as failed
+                print(f"PublishBatch of {len(batch)} notifications failed: {e}")
+                response = {'Failed': [{'Id': entry['Id'], 'Code': error_code(e)} for entry in batch]}
+            stats['publish_calls'] += 1
+            sent.update(x['Id'] for x in response.get('Successful', []))
+            for failure in response.get('Failed', []):
+                # Not recorded as sent, so the next occurrence is not suppressed
+                print(f"Notification {failure['Id']} failed: {failure.get('Code')} {failure.get('Message', '')}")
+                stats['failed'] += 1
+        stats['sent'] = len(sent)
+        return sent
+
+
+_notifiers = {}
+_notifiers_lock = threading.Lock()
+
+
+def get_notifier(topic_arn):
+    """Notifier shared by everything in this (warm) container, one per topic."""
+    with _notifiers_lock:
+        if topic_arn not in _notifiers:
+            store = None
+            if NOTIFY_STATE_URI:
+                # One document per topic next to the configured location
+                root, ext = os.path.splitext(NOTIFY_STATE_URI)
+                store = state_store_from_uri(f"{root}-{topic_arn.rsplit(':', 1)[-1]}{ext or '.json'}")
+            _notifiers[topic_arn] = Notifier(topic_arn, store=store)
+        return _notifiers[topic_arn]
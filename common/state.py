@@ -0,0 +1,121 @@
+"""
+Small JSON state stores used by handlers that need to remember something
+between invocations (checkpoints, caches, cooldowns ...).
+
+Each store holds a single JSON document and exposes load()/save()/clear().
+FileStateStore keeps it on local disk (/tmp inside Lambda, or any path when
+testing locally); S3StateStore keeps it in an S3 object so it survives cold
+starts. MemoryStateStore keeps it in the process only (per warm container).
+Use state_store_from_uri() to pick one from configuration.
+"""
+import json
+import os
+from botocore.exceptions import ClientError
+
+from common.clients import get_client
+
+
+class MemoryStateStore:
+    """JSON document kept in memory; lasts as long as the container."""
+
+    def __init__(self):
+        self.state = None
+
+    def load(self):
+        return self.state
+
+    def save(self, state):
+        self.state = state
+
+    def clear(self):
+        self.state = None
+
+    def __repr__(self):
+        return "MemoryStateStore()"
+
+
+class FileStateStore:
+    """JSON document stored in a local file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            print(f"Ignoring unreadable state file {self.path}")
+            return None
+
+    def save(self, state):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, self.path)  # atomic, so a timeout never leaves half a file
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f"FileStateStore({self.path!r})"
+
+
+class S3StateStore:
+    """JSON document stored in an S3 object."""
+
+    def __init__(self, bucket, key, s3=None):
+        self.bucket = bucket
+        self.key = key
+        self._s3 = s3
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = get_client('s3')
+        return self._s3
+
+    def load(self):
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(resp['Body'].read())
+
+    def save(self, state):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Body=json.dumps(state, default=str).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def clear(self):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.key)
+
+    def __repr__(self):
+        return f"S3StateStore('s3://{self.bucket}/{self.key}')"
+
+
+def state_store_from_uri(uri, s3=None):
+    """
+    Build a store from 's3://bucket/key', 'file:///path' or a plain file path.
+    """
+    if uri.startswith('s3://'):
+        bucket, _, key = uri[len('s3://'):].partition('/')
+        if not bucket or not key:
+            raise ValueError(f"Invalid S3 state URI: {uri}")
+        return S3StateStore(bucket, key, s3=s3)
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    return FileStateStore(uri)
@@ -0,0 +1,180 @@
+"""
+One entry point for every assignment handler.
+
+Deploy the repository root as a single function with the handler
+`router.lambda_handler`. All the low-volume jobs then share one container:
+the boto3 session, the cached clients (common.clients), the executor and the
+notifiers are created once and stay warm for whichever job runs next. A
+handler's module is only imported the first time an event is routed to it.
+
+An event is routed by, in order:
+
+1. its routing key, {"route": "s3-cleanup", ...} (direct invokes, or the
+   constant input of an EventBridge schedule target);
+2. the name of its source in ROUTER_SOURCES ("name=route,..."), where the name
+   is the EventBridge rule of a scheduled event, the queue of SQS records,
+   the table of DynamoDB stream records or the bucket of S3 notifications
+   and S3 Batch Operations tasks; a rule named after a route needs no entry;
+3. its shape: DynamoDB stream records go to dynamodb-notify, SQS records and
+   S3 Batch Operations jobs to review-sentiment, EC2 state-change events to
+   every route in ROUTER_STATE_CHANGE_ROUTES, anything else to
+   ROUTER_DEFAULT_ROUTE (if set).
+
+The handler receives the event unchanged (minus "route") and its result is
+returned as is, so batchItemFailures and S3 Batch Operations results still
+reach Lambda.
+
+The handlers read their settings from environment variables, and some share a
+name (SNS_TOPIC_ARN, BUCKET_NAME, LOAD_BALANCERS). A variable prefixed with
+the route name in upper case and two underscores, e.g.
+GLACIER_ARCHIVE__BUCKET_NAME, overrides the plain one while that route's
+module is imported and while its handler runs. Settings of the common/
+modules (executor, notifications) are shared by every route.
+"""
+import importlib
+import os
+
+ROUTES = {
+    'ec2-automanage': 'assignment1_ec2_automanage.handler',
+    's3-cleanup': 'assignment2_s3_cleanup.handler',
+    's3-encryption-check': 'assignment3_s3_encryption_check.handler',
+    'ebs-snapshot-cleanup': 'assignment4_ebs_snapshot_cleanup.handler',
+    'billing-alert': 'assignment6_monitor_high_alart.handler',
+    'dynamodb-notify': 'assignment7_dynamodb_boto3_sns.handler',
+    'review-sentiment': 'assignment8_analyze_sentiment_of_user_reviews.handler',
+    'glacier-archive': 'assignment9_archive_old_files_from_s3_to_glacier.handler',
+    'elb-5xx': 'assignment10_elb_error.hendler',
+    'auto-scale': 'assignment12_auto_scale_ec2_based_on_loading.handler',
+}
+
+ROUTER_SOURCES = dict(
+    pair.strip().split('=', 1) for pair in os.environ.get('ROUTER_SOURCES', '').split(',') if '=' in pair
+)
+ROUTER_STATE_CHANGE_ROUTES = [
+    r.strip() for r in os.environ.get('ROUTER_STATE_CHANGE_ROUTES', 'ec2-automanage,auto-scale').split(',')
+    if r.strip()
+]
+ROUTER_DEFAULT_ROUTE = os.environ.get('ROUTER_DEFAULT_ROUTE', '')
+
+# Routes used for an event shape when its source has no ROUTER_SOURCES entry
+SHAPE_ROUTES = {
+    'dynamodb': 'dynamodb-notify',
+    'sqs': 'review-sentiment',
+    's3batch': 'review-sentiment',
+}
+# Checked here rather than through common.inventory, which would import botocore on every cold start
+STATE_CHANGE_EVENT = 'EC2 Instance State-change Notification'
+RECORD_SOURCES = {'aws:s3': 's3', 'aws:sqs': 'sqs', 'aws:dynamodb': 'dynamodb'}
+
+_handlers = {}  # route -> (lambda_handler, environment overrides), filled on first dispatch
+
+
+def event_kind(event):
+    """schedule, ec2-state, s3, sqs, dynamodb, s3batch or direct."""
+    records = event.get('Records')
+    if records:
+        return RECORD_SOURCES.get(records[0].get('eventSource') or records[0].get('EventSource'), 'records')
+    if 'tasks' in event and 'invocationId' in event:
+        return 's3batch'
+    if event.get('detail-type') == 'Scheduled Event':
+        return 'schedule'
+    if event.get('detail-type') == STATE_CHANGE_EVENT:
+        return 'ec2-state'
+    return 'direct'
+
+
+def source_name(kind, event):
+    """The rule, queue, table or bucket an event came from (None when it has none)."""
+    try:
+        if kind == 'schedule':
+            return event['resources'][0].rsplit('/', 1)[-1]
+        record = event['Records'][0] if kind in ('s3', 'sqs', 'dynamodb') else None
+        if kind == 's3':
+            return record['s3']['bucket']['name']
+        if kind == 'sqs':
+            return record['eventSourceARN'].rsplit(':', 1)[-1]
+        if kind == 'dynamodb':
+            return record['eventSourceARN'].split('/')[1]
+        if kind == 's3batch':
+            task = event['tasks'][0]
+            return task.get('s3Bucket') or task['s3BucketArn'].split(':::')[-1]
+    except (KeyError, IndexError):
+        pass
+    return None
+
+
+def resolve(event):
+    """(kind, routes) for an event; raises ValueError when no route matches."""
+    kind = event_kind(event)
+    if event.get('route'):
+        routes = [event['route']]
+    elif kind == 'ec2-state':
+        routes = ROUTER_STATE_CHANGE_ROUTES
+    else:
+        name = source_name(kind, event)
+        route = ROUTER_SOURCES.get(name) or (name if name in ROUTES else None)
+        route = route or SHAPE_ROUTES.get(kind) or (ROUTER_DEFAULT_ROUTE if kind in ('direct', 'schedule') else None)
+        routes = [route] if route else []
+    unknown = [r for r in routes if r not in ROUTES]
+    if not routes or unknown:
+        raise ValueError(f"No route for {kind} event" + (f" (unknown: {', '.join(unknown)})" if unknown else "")
+                         + f". Routes: {', '.join(ROUTES)}")
+    return kind, routes
+
+
+def _overrides(route):
+    prefix = route.upper().replace('-', '_') + '__'
+    return {k[len(prefix):]: v for k, v in os.environ.items() if k.startswith(prefix)}
+
+
+class _Environment:
+    """Apply a route's environment overrides for the duration of a with block."""
+
+    def __init__(self, overrides):
+        self.overrides = overrides
+        self.saved = {}
+
+    def __enter__(self):
+        self.saved = {k: os.environ.get(k) for k in self.overrides}
+        os.environ.update(self.overrides)
+
+    def __exit__(self, *exc):
+        for key, value in self.saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def load(route):
+    """The route's lambda_handler and overrides, importing its module on first use."""
+    entry = _handlers.get(route)
+    if entry is None:
+        overrides = _overrides(route)
+        with _Environment(overrides):
+            module = importlib.import_module(ROUTES[route])
+        entry = _handlers[route] = (module.lambda_handler, overrides)
+    return entry
+
+
+def dispatch(route, event, context):
+    handler, overrides = load(route)
+    with _Environment(overrides):
+        return handler(event, context)
+
+
+def lambda_handler(event, context):
+    event = event or {}
+    try:
+        kind, routes = resolve(event)
+    except ValueError as e:
+        print(e)
+        if event.get('Records') or 'tasks' in event:
+            raise  # a batch event source retries; dropping its records silently would lose them
+        return {'statusCode': 400, 'body': str(e)}
+    if 'route' in event:
+        event = {k: v for k, v in event.items() if k != 'route'}
+    print(f"Routing {kind} event to {', '.join(routes)}")
+    if len(routes) == 1:
+        return dispatch(routes[0], event, context)
+    return {'routes': {route: dispatch(route, event, context) for route in routes}}
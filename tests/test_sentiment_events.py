@@ -0,0 +1,46 @@
+from assignment8_analyze_sentiment_of_user_reviews import handler
+from benchmarks.fakes import FakeComprehend
+from common.clients import register_client
+
+
+class FailingComprehend(FakeComprehend):
+    """Every sentiment call answers with a transient per-document error."""
+
+    def batch_detect_sentiment(self, TextList, LanguageCode):
+        self._call('batch_detect_sentiment', TextList)
+        return {'ResultList': [], 'ErrorList': [
+            {'Index': n, 'ErrorCode': 'InternalServerException', 'ErrorMessage': 'try again'}
+            for n in range(len(TextList))
+        ]}
+
+
+def sqs_event(*bodies):
+    return {'Records': [{'messageId': f'msg-{n}', 'eventSource': 'aws:sqs', 'body': body}
+                        for n, body in enumerate(bodies)]}
+
+
+def test_batch_item_failures_use_the_sqs_message_id(monkeypatch):
+    register_client('comprehend', FailingComprehend())
+    monkeypatch.setattr(handler, 'SENTIMENT_ENGINE', 'comprehend')
+    handler._cache.entries.clear()
+    event = sqs_event('{"id": "r-42", "text": "Arrived on Tuesday", "language": "en"}',
+                      '{"reviews": [{"id": "a:b", "text": "It is a phone case", "language": "en"}]}')
+
+    response = handler.lambda_handler(event, None)
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'msg-0'}, {'itemIdentifier': 'msg-1'}]
+    assert [r['id'] for r in response['results']] == ['r-42', 'a:b']
+
+
+def test_reviews_without_a_language_are_detected_before_local_scoring(monkeypatch):
+    comprehend = FakeComprehend()
+    register_client('comprehend', comprehend)
+    monkeypatch.setattr(handler, 'SENTIMENT_ENGINE', 'hybrid')
+    handler._cache.entries.clear()
+    event = {'reviews': ['[fr] Produit excellent, je recommande', 'Excellent, love it, highly recommend']}
+
+    results = handler.analyze_texts(handler.parse_reviews(event)[0])
+
+    assert [r['language'] for r in results] == ['fr', 'en']
+    assert comprehend.calls == {'batch_detect_dominant_language': 1, 'batch_detect_sentiment': 1}
+    assert comprehend.documents == 3  # both detected, only the French one scored by Comprehend